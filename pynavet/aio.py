@@ -0,0 +1,226 @@
+"""
+This module implements an asyncio version of "personpostXML" for the Swedish government population register service
+(NAVET). It requires Python 3.5+ and aiohttp.
+"""
+import asyncio
+import ssl
+from logging import getLogger
+
+import aiohttp
+from lxml import etree
+from suds import WebFault
+
+from pynavet import __ws_endpoint__
+from pynavet.envelope import get_template, parse_response
+from pynavet.plugins import translate
+from pynavet.postaladdress import (find_person, select_official_address, select_name, select_name_and_official_address,
+                                   select_relations)
+from pynavet.xmlutil import etree_to_dict
+
+
+class AsyncSingleFlight(object):
+    """
+    asyncio version of pynavet.coalesce.SingleFlight. A waiter being cancelled does not cancel the shared call.
+    """
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._calls = {}
+
+    async def do(self, key, func, *args):
+        """
+        Await func(*args), or an identical call already in flight.
+
+        @param key: Identifies identical calls, must be hashable
+        @param func: Coroutine function to call
+        @return: The result of the call
+        """
+        future = self._calls.get(key)
+        if future is None:
+            self.calls += 1
+            future = self._calls[key] = asyncio.ensure_future(func(*args))
+            future.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(future)
+
+    def stats(self):
+        """
+        @return: Number of upstream calls made and number of calls served by another caller's call
+        @rtype: dict
+        """
+        return {'calls': self.calls, 'coalesced': self.coalesced}
+
+
+class AsyncPostalAddress(object):
+    """
+    This class is used to retrieve postal address information for a provided national identity number using asyncio.
+
+    Requests are rendered from the bundled personpostXML.wsdl and replies go through the same translation as
+    PostalAddress, so results are identical to the synchronous client. The object must be closed when done, either
+    with 'await close()' or by using it as an async context manager.
+    """
+    def __init__(self, cert, key_file, order_id, debug=False, verify=True, timeout=None, max_concurrency=10,
+                 url=__ws_endpoint__, transform_hook=None, coalesce=False):
+        """
+        @param cert: Path to authentication client certificate in PEM format
+        @type cert: str
+        @param key_file: Path to key file in PEM format
+        @type key_file: str
+        @param order_id: Organisation number + Ordering ID ie (16XXXXXXXXXX XXXXXXXX-XXXX-XXXX)
+        @type order_id: str
+        @param debug: (Optional) Set to True to get some debug logging.
+        @type debug: bool
+        @param verify: (optional) Whether to verify SSL endpoint certificate or not, default True
+        @type verify: bool
+        @param timeout: (optional) Timeout in seconds for a whole lookup, or a tuple (connect, read)
+        @type timeout: float | tuple
+        @param max_concurrency: (optional) Max number of lookups in flight, default 10
+        @type max_concurrency: int
+        @param url: (optional) Service URL endpoint
+        @type url: str
+        @param transform_hook: (optional) Callable receiving the XSLT transform time in seconds for every reply
+        @type transform_hook: callable
+        @param coalesce: (optional) Share one request between concurrent lookups of the same identity number, the
+        callers then get the same result object which must not be modified, default False
+        @type coalesce: bool
+        """
+        self.cert = cert
+        self.key_file = key_file
+        self.order_id = order_id
+        self.debug = debug
+        self.verify = verify
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.url = url
+        self.transform_hook = transform_hook
+        self.logger = getLogger(__name__)
+        self.template = get_template('wsdl/personpostXML.wsdl')
+        self.single_flight = AsyncSingleFlight() if coalesce else None
+        self._session = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _ssl_context(self):
+        context = ssl.create_default_context()
+        if not self.verify:
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        if self.cert:
+            context.load_cert_chain(self.cert, self.key_file or None)
+        return context
+
+    def _client_timeout(self):
+        if isinstance(self.timeout, tuple):
+            return aiohttp.ClientTimeout(sock_connect=self.timeout[0], sock_read=self.timeout[1])
+        return aiohttp.ClientTimeout(total=self.timeout)
+
+    def _get_session(self):
+        if self._session is None:
+            connector = aiohttp.TCPConnector(ssl=self._ssl_context(), limit=self.max_concurrency)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self._client_timeout())
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    async def close(self):
+        """
+        Close the HTTP session and all pooled connections.
+        """
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _post(self, envelope):
+        """
+        Send a request envelope, cancelling the request (and releasing its connection) on timeout.
+
+        @return: HTTP status code and response body
+        @rtype: tuple (int, bytes)
+        """
+        session = self._get_session()
+        async with self._semaphore:
+            async with session.post(self.url, data=envelope, headers=self.template.headers) as response:
+                return response.status, await response.read()
+
+    async def get_all_data(self, identity_number, as_xml=False):
+        """
+        Get all data available for the provided national identity number from the Swedish population register.
+
+        @param identity_number: The national identity number to lookup
+        @type identity_number: str
+        @param as_xml: If 'True' return the data as XML, if 'False' return data as an ordered dict (default: False)
+        @type as_xml: bool
+        @return: Navet data, either as XML string or parsed (ordered) dict, None if the reply has none.
+        """
+        if self.single_flight is not None:
+            return await self.single_flight.do((identity_number, as_xml), self._get_all_data, identity_number, as_xml)
+        return await self._get_all_data(identity_number, as_xml)
+
+    async def _get_all_data(self, identity_number, as_xml):
+        try:
+            status, body = await self._post(self.template.render(self.order_id, identity_number))
+            reply = parse_response(status, body)
+            if reply is None:
+                return None
+            tree = translate(reply, self.transform_hook)
+            result = etree.tostring(tree) if as_xml else etree_to_dict(tree)
+            if self.debug:
+                self.logger.debug("NAVET get_all_data lookup result:\n{!r}".format(result))
+            return result
+        except WebFault as e:
+            self.logger.error(e)
+            raise
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.logger.error("Unexpected error.")
+            raise
+
+    # The get_* helpers share the data selection functions of PostalAddress, only the lookup itself is asynchronous.
+
+    async def get_official_address(self, identity_number, data=None):
+        """
+        Async version of PostalAddress.get_official_address.
+        """
+        if data is None:
+            data = await self.get_all_data(identity_number)
+        return self._select(select_official_address, data, 'get_official_address')
+
+    async def get_name(self, identity_number, data=None):
+        """
+        Async version of PostalAddress.get_name.
+        """
+        if data is None:
+            data = await self.get_all_data(identity_number)
+        return self._select(select_name, data, 'get_name')
+
+    async def get_name_and_official_address(self, identity_number, data=None):
+        """
+        Async version of PostalAddress.get_name_and_official_address.
+        """
+        if data is None:
+            data = await self.get_all_data(identity_number)
+        return self._select(select_name_and_official_address, data, 'get_name_and_official_address')
+
+    async def get_relations(self, identity_number, data=None):
+        """
+        Async version of PostalAddress.get_relations.
+        """
+        if data is None:
+            data = await self.get_all_data(identity_number)
+        return self._select(select_relations, data, 'get_relations')
+
+    def _select(self, select, data, method):
+        try:
+            result = select(find_person(data))
+        except KeyError:
+            self.logger.exception("NAVET {} lookup failure".format(method))
+            result = False
+        if self.debug:
+            self.logger.debug("NAVET {} result:\n{!r}".format(method, result))
+        return result
@@ -0,0 +1,265 @@
+"""
+This module provides load balancing of lookups over several NAVET credentials (certificate, key and order id).
+
+NAVET rate limits every order. BalancedPostalAddress takes several credentials, each with a token bucket rate limit,
+and sends every lookup with the next credential allowed to make a call, so the total throughput grows with the number
+of credentials. Lookups wait in priority order, so interactive lookups go before queued batch lookups:
+
+    navet = BalancedPostalAddress([Credential(cert1, key1, order1, rate_limit=10),
+                                   Credential(cert2, key2, order2, rate_limit=10)], records=True)
+    navet.get_name(identity_number)
+    for result in navet.with_priority(BATCH).get_name_many(identity_numbers, max_workers=16):
+        ...
+
+A credential failing repeatedly is backed off exponentially, the other credentials take over. Transport errors and
+availability faults count as failures, faults answering the lookup itself, ie 'Personen finns inte' for an unknown
+identity number, do not.
+"""
+from pynavet.postaladdress import PostalAddress
+from pynavet.batch import RateLimiter
+from pynavet.resilience import CircuitOpenError
+from suds import WebFault
+from suds.transport import TransportError
+from logging import getLogger
+import threading
+import itertools
+import random
+import heapq
+import copy
+import time
+import re
+
+LOG = getLogger(__name__)
+
+INTERACTIVE = 0
+BATCH = 10
+
+# NAVET returns all faults as soapenv:Server, availability problems are told apart by the fault string
+_AVAILABILITY_FAULT = re.compile(u'unavailable|overload|too many|time ?out|tillf\xe4llig|otillg\xe4nglig|'
+                                 u'ej tillg\xe4nglig|\xf6verbelast', re.IGNORECASE)
+
+
+def is_availability_fault(error):
+    """
+    Tell whether a SOAP fault means the service could not answer, as opposed to a fault answering the lookup.
+
+    @param error: The fault
+    @type error: suds.WebFault
+    @rtype: bool
+    """
+    faultstring = getattr(error.fault, 'faultstring', None) or u''
+    if isinstance(faultstring, bytes):
+        faultstring = faultstring.decode('utf-8', 'replace')
+    return _AVAILABILITY_FAULT.search(faultstring) is not None
+
+
+class NoCredentialAvailableError(Exception):
+    """
+    Raised when no credential could be used within the wait timeout.
+    """
+
+
+class Credential(object):
+    """
+    A NAVET certificate, key and order id, with its rate limit and health.
+    """
+    def __init__(self, cert, key_file, order_id, rate_limit=None, burst=1):
+        """
+        @param cert: Path to authentication client certificate in PEM format
+        @type cert: str
+        @param key_file: Path to key file in PEM format
+        @type key_file: str
+        @param order_id: Organisation number + Ordering ID ie (16XXXXXXXXXX XXXXXXXX-XXXX-XXXX)
+        @type order_id: str
+        @param rate_limit: (optional) Max number of lookups per second with this credential, default unlimited
+        @type rate_limit: int | float
+        @param burst: (optional) Number of lookups allowed back to back, default 1
+        @type burst: int
+        """
+        self.cert = cert
+        self.key_file = key_file
+        self.order_id = order_id
+        self.limiter = RateLimiter(rate_limit, burst) if rate_limit else None
+        self.calls = 0
+        self.failures = 0
+        self.backoff_until = 0
+
+    def __repr__(self):
+        return 'Credential(order_id=%r)' % self.order_id
+
+
+class CredentialScheduler(object):
+    """
+    Hands out credentials to lookups, thread-safe. Waiting lookups are served in priority order, lower first, and in
+    arrival order within a priority. Credentials are used round robin among those with a token available.
+    """
+    def __init__(self, credentials, fault_threshold=3, backoff=1.0, backoff_max=60.0):
+        """
+        @param credentials: Credentials to schedule
+        @type credentials: list of Credential
+        @param fault_threshold: (optional) Consecutive failures before a credential is backed off, default 3
+        @type fault_threshold: int
+        @param backoff: (optional) Max seconds of the first backoff, doubled for every further failure, default 1
+        @type backoff: float
+        @param backoff_max: (optional) Max seconds of a backoff, default 60
+        @type backoff_max: float
+        """
+        if not credentials:
+            raise ValueError('At least one credential is required')
+        self.credentials = list(credentials)
+        self.fault_threshold = fault_threshold
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self._next = 0
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    def acquire(self, priority=INTERACTIVE, timeout=None):
+        """
+        Wait for a credential allowed to make a call and take its token.
+
+        @param priority: (optional) Lower priorities are served first, default INTERACTIVE
+        @type priority: int
+        @param timeout: (optional) Max seconds to wait, default wait forever
+        @type timeout: float
+        @rtype: Credential
+        @raise NoCredentialAvailableError: If the timeout expired
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        ticket = (priority, next(self._sequence))
+        with self._condition:
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    wait = None
+                    if self._waiting[0] == ticket:
+                        credential, wait = self._take()
+                        if credential is not None:
+                            return credential
+                    if deadline is not None:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            raise NoCredentialAvailableError('No NAVET credential available within %s seconds'
+                                                             % timeout)
+                        wait = min(wait, remaining) if wait is not None else remaining
+                    self._condition.wait(wait)
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                # Let the next lookup in line try
+                self._condition.notify_all()
+
+    def _take(self):
+        """
+        @return: A credential with its token taken, or None and the seconds until one may be available
+        @rtype: tuple
+        """
+        now = time.time()
+        wait = None
+        count = len(self.credentials)
+        for i in range(count):
+            index = (self._next + i) % count
+            credential = self.credentials[index]
+            if credential.backoff_until > now:
+                delay = credential.backoff_until - now
+            elif credential.limiter is None:
+                delay = 0
+            else:
+                delay = credential.limiter.try_acquire()
+            if delay == 0:
+                self._next = index + 1
+                credential.calls += 1
+                return credential, None
+            wait = delay if wait is None else min(wait, delay)
+        return None, wait
+
+    def record_success(self, credential):
+        with self._condition:
+            credential.failures = 0
+
+    def record_failure(self, credential):
+        """
+        Record a failed call, backing the credential off once the fault threshold is reached.
+        """
+        with self._condition:
+            credential.failures += 1
+            if credential.failures >= self.fault_threshold:
+                delay = random.uniform(0.5, 1) * min(self.backoff_max,
+                                                     self.backoff * 2 ** (credential.failures - self.fault_threshold))
+                credential.backoff_until = time.time() + delay
+                LOG.warning("NAVET credential %r failed %d times, backing off for %.1f s", credential,
+                            credential.failures, delay)
+
+
+class BalancedPostalAddress(PostalAddress):
+    """
+    PostalAddress spreading its NAVET calls over several credentials. Caching, coalescing and the batch methods work
+    as in PostalAddress, only the upstream calls are scheduled.
+    """
+    def __init__(self, credentials, use_cache=True, debug=False, **kwargs):
+        """
+        @param credentials: Credentials to use, with their rate limits
+        @type credentials: list of Credential
+        @param priority: (optional) Priority of lookups made through this object, see with_priority, default
+        INTERACTIVE
+        @type priority: int
+        @param wait_timeout: (optional) Max seconds to wait for a credential, default wait forever
+        @type wait_timeout: float
+        @param fault_threshold: (optional) Consecutive failures before a credential is backed off, default 3
+        @type fault_threshold: int
+        @param credential_backoff: (optional) Max seconds of the first backoff of a credential, default 1
+        @type credential_backoff: float
+        @param credential_backoff_max: (optional) Max seconds of a credential backoff, default 60
+        @type credential_backoff_max: float
+        @param credential_fault: (optional) Callable telling whether a WebFault counts as a failure of the
+        credential, default is_availability_fault
+        @type credential_fault: callable
+        @param kwargs: Other options are passed on to PostalAddress
+        """
+        self.credential_fault = kwargs.pop('credential_fault', is_availability_fault)
+        self.priority = kwargs.pop('priority', INTERACTIVE)
+        self.wait_timeout = kwargs.pop('wait_timeout', None)
+        self.scheduler = CredentialScheduler(credentials, fault_threshold=kwargs.pop('fault_threshold', 3),
+                                             backoff=kwargs.pop('credential_backoff', 1.0),
+                                             backoff_max=kwargs.pop('credential_backoff_max', 60.0))
+        first = self.scheduler.credentials[0]
+        PostalAddress.__init__(self, first.cert, first.key_file, first.order_id, use_cache, debug, **kwargs)
+        # Caching and coalescing happen in this object before a credential is chosen
+        kwargs.pop('result_cache', None)
+        kwargs.pop('coalesce', None)
+        self.clients = [self] + [PostalAddress(credential.cert, credential.key_file, credential.order_id, use_cache,
+                                               debug, **kwargs)
+                                 for credential in self.scheduler.credentials[1:]]
+        self._clients = dict(zip(self.scheduler.credentials, self.clients))
+
+    def with_priority(self, priority):
+        """
+        Get a view of this client making its lookups with another priority. It shares credentials, clients and cache
+        with this object.
+
+        @param priority: Lower priorities are served first, ie INTERACTIVE or BATCH
+        @type priority: int
+        @rtype: BalancedPostalAddress
+        """
+        view = copy.copy(self)
+        view.priority = priority
+        return view
+
+    def _call_upstream(self, identity_number, as_xml):
+        scheduler = self.scheduler
+        credential = scheduler.acquire(self.priority, self.wait_timeout)
+        try:
+            result = PostalAddress._call_upstream(self._clients[credential], identity_number, as_xml)
+        except WebFault as e:
+            if self.credential_fault(e):
+                scheduler.record_failure(credential)
+            else:
+                # The service answered, ie the person was not found
+                scheduler.record_success(credential)
+            raise
+        except (TransportError, IOError, CircuitOpenError):
+            scheduler.record_failure(credential)
+            raise
+        scheduler.record_success(credential)
+        return result
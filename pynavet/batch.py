@@ -0,0 +1,126 @@
+"""
+This module provides helpers for running many NAVET lookups concurrently.
+"""
+from collections import namedtuple
+from logging import getLogger
+import threading
+import time
+
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+LOG = getLogger(__name__)
+
+_STOP = object()
+
+
+class BatchResult(namedtuple('BatchResult', ['identity_number', 'result', 'error'])):
+    """
+    Result of one lookup in a batch. 'error' holds the raised exception and 'result' is None if the lookup failed.
+    """
+    __slots__ = ()
+
+
+class RateLimiter(object):
+    """
+    Token bucket rate limiter, safe to share between threads.
+    """
+    def __init__(self, rate, burst=1):
+        """
+        @param rate: Max number of calls per second
+        @type rate: int | float
+        @param burst: (optional) Number of calls allowed back to back before limiting kicks in, default 1
+        @type burst: int
+        """
+        self.rate = float(rate)
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Block until a call is allowed.
+        """
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+    def try_acquire(self):
+        """
+        Take a call without blocking, if one is allowed now.
+
+        @return: 0 if the call was taken, otherwise the seconds until one is allowed
+        @rtype: float
+        """
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+
+def imap_unordered(func, identity_numbers, max_workers=4, rate_limit=None):
+    """
+    Call func for every identity number in a pool of threads and yield BatchResults in completion order.
+
+    Exceptions raised by func, including SystemExit and the like, are captured in the BatchResult instead of aborting
+    the batch. The input is consumed lazily, at most 2 * max_workers lookups are queued at any time.
+
+    @param func: Function taking an identity number
+    @type func: callable
+    @param identity_numbers: National identity numbers to lookup
+    @type identity_numbers: iterable
+    @param max_workers: (optional) Number of worker threads, default 4
+    @type max_workers: int
+    @param rate_limit: (optional) Max number of lookups per second for the whole batch
+    @type rate_limit: int | float
+    @return: Generator of BatchResult
+    """
+    limiter = RateLimiter(rate_limit) if rate_limit else None
+    tasks = Queue()
+    results = Queue()
+
+    def worker():
+        while True:
+            identity_number = tasks.get()
+            if identity_number is _STOP:
+                return
+            if limiter is not None:
+                limiter.acquire()
+            try:
+                results.put(BatchResult(identity_number, func(identity_number), None))
+            except BaseException as e:
+                # Keep the thread, the generator waits for a result of every queued lookup
+                LOG.debug("Batch lookup failed for %s: %r", identity_number, e)
+                results.put(BatchResult(identity_number, None, e))
+
+    threads = [threading.Thread(target=worker) for _ in range(max_workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    pending = 0
+    try:
+        for identity_number in identity_numbers:
+            tasks.put(identity_number)
+            pending += 1
+            while pending >= max_workers * 2:
+                yield results.get()
+                pending -= 1
+        while pending:
+            yield results.get()
+            pending -= 1
+    finally:
+        for _ in threads:
+            tasks.put(_STOP)
@@ -0,0 +1,297 @@
+"""
+This module runs offline benchmarks of pynavet against the local NAVET stand-in server in pynavet.testserver.
+
+    python -m pynavet.benchmark --iterations 500 --concurrency 1,4,16 --latency 0.005 --output results.json
+
+Every benchmark reports throughput, p50/p99/mean latency, errors and memory use. Results are written as JSON so they
+can be compared between runs, and a summary table is printed to stderr. Where tracemalloc is available memory is
+measured in a second, untimed pass, since tracing slows down allocations.
+"""
+from pynavet.testserver import NavetServer, person_document
+from pynavet.postaladdress import PostalAddress
+from pynavet.plugins import to_serializable, translate
+from pynavet.xmlutil import etree_to_dict
+from pynavet.records import Person
+from pynavet.envelope import get_template
+from pynavet.model import new_client
+from pynavet.batch import imap_unordered
+from suds.sudsobject import Factory, asdict
+from collections import OrderedDict
+import optparse
+import platform
+import json
+import time
+import sys
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+    import resource
+
+timer = getattr(time, 'perf_counter', time.time)
+
+LOOKUPS = ('get_all_data', 'get_name', 'get_official_address', 'get_name_and_official_address', 'get_relations')
+
+
+def percentile(values, fraction):
+    """
+    @param values: Sorted values
+    @type values: list
+    @param fraction: Percentile as a fraction, ie 0.99
+    @type fraction: float
+    """
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def measure(name, func, items, concurrency=1, **params):
+    """
+    Call func for every item, in a pool of threads if concurrency > 1, and summarize latency and throughput.
+
+    @param name: Benchmark name
+    @type name: str
+    @param func: Function to benchmark, called with one item
+    @type func: callable
+    @param items: Arguments to call func with
+    @type items: list
+    @param concurrency: (optional) Number of concurrent calls, default 1
+    @type concurrency: int
+    @param params: Extra parameters to include in the result
+    @return: Benchmark result
+    @rtype: OrderedDict
+    """
+    def timed(item):
+        start = timer()
+        func(item)
+        return timer() - start
+
+    def run():
+        latencies = []
+        errors = 0
+        if concurrency == 1:
+            for item in items:
+                try:
+                    latencies.append(timed(item))
+                except Exception:
+                    errors += 1
+        else:
+            for result in imap_unordered(timed, items, max_workers=concurrency):
+                if result.error is None:
+                    latencies.append(result.result)
+                else:
+                    errors += 1
+        return latencies, errors
+
+    if tracemalloc is not None:
+        start = timer()
+        latencies, errors = run()
+        elapsed = timer() - start
+        memory = _traced_peak(run)
+    else:
+        # Reading the max RSS doesn't slow anything down, measure it around the timed pass
+        before = _max_rss()
+        start = timer()
+        latencies, errors = run()
+        elapsed = timer() - start
+        memory = _max_rss() - before
+    latencies.sort()
+    result = OrderedDict([
+        ('name', name),
+        ('concurrency', concurrency),
+        ('iterations', len(items)),
+        ('errors', errors),
+        ('seconds', elapsed),
+        ('throughput', len(latencies) / elapsed if elapsed else None),
+        ('p50', percentile(latencies, 0.5)),
+        ('p99', percentile(latencies, 0.99)),
+        ('mean', sum(latencies) / len(latencies) if latencies else None),
+        ('memory_kb', memory),
+    ])
+    result.update(params)
+    return result
+
+
+def _traced_peak(func):
+    """
+    Run func and return the peak memory allocated by Python in KiB.
+    """
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] // 1024
+    finally:
+        tracemalloc.stop()
+
+
+def _max_rss():
+    """
+    @return: The max RSS of the process in KiB, on Pythons without tracemalloc
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _to_suds(name, data):
+    """
+    Build a suds object tree like the ones SerializablePlugin converts.
+    """
+    if isinstance(data, list):
+        return [_to_suds(name, item) for item in data]
+    if not isinstance(data, dict):
+        return data
+    return Factory.object(name, dict((key.lstrip('@'), _to_suds(key, value)) for key, value in data.items()))
+
+
+def _recursive_asdict(suds_dict):
+    """
+    The recursive conversion SerializablePlugin used before to_serializable, to compare with.
+    """
+    out = {}
+    for key, val in asdict(suds_dict).items():
+        if hasattr(val, '__keylist__'):
+            out[key] = _recursive_asdict(val)
+        elif isinstance(val, list):
+            out[key] = []
+            for item in val:
+                if hasattr(item, '__keylist__'):
+                    out[key].append(_recursive_asdict(item))
+                else:
+                    out[key].append(item)
+        else:
+            out[key] = val
+    return out
+
+
+def bench_lookups(server, iterations, concurrency_levels, lookups=LOOKUPS):
+    """
+    Benchmark PostalAddress lookups against the stand-in server.
+    """
+    results = []
+    navet = PostalAddress(server.client_cert, server.client_key, 'order', use_cache=False, url=server.url(),
+                          verify=server.server_cert, pool_maxsize=max(concurrency_levels))
+    identity_numbers = ['19%010d' % i for i in range(iterations)]
+    navet.get_all_data(identity_numbers[0])  # Warm up the connection pool
+    for lookup in lookups:
+        for concurrency in concurrency_levels:
+            results.append(measure(lookup, getattr(navet, lookup), identity_numbers, concurrency,
+                                   latency=server.latency, relations=server.relations))
+    return results
+
+
+def bench_xslt(iterations, relations):
+    """
+    Benchmark the XSLT translation of a reply.
+    """
+    reply = person_document(['191212121212'], relations)
+    return measure('xslt', translate, [reply] * iterations, relations=relations)
+
+
+def bench_dict(iterations, relations):
+    """
+    Benchmark the conversion of a translated reply to a dict.
+    """
+    tree = translate(person_document(['191212121212'], relations))
+    return measure('dict', etree_to_dict, [tree] * iterations, relations=relations)
+
+
+def bench_records(iterations, relations):
+    """
+    Benchmark building typed records from a translated reply.
+    """
+    tree = translate(person_document(['191212121212'], relations))
+    return measure('records', Person.from_tree, [tree] * iterations, relations=relations)
+
+
+def bench_envelope(iterations):
+    """
+    Benchmark building a getData request envelope with suds and from the precompiled template.
+    """
+    method = new_client('wsdl/personpostXML.wsdl').service.getData.method
+    template = get_template('wsdl/personpostXML.wsdl')
+    identity_numbers = ['19%010d' % i for i in range(iterations)]
+
+    def marshal(identity_number):
+        return method.binding.input.get_message(method, ('order', identity_number), {}).plain().encode('utf-8')
+    return [measure('envelope.suds', marshal, identity_numbers),
+            measure('envelope.template', lambda identity_number: template.render('order', identity_number),
+                    identity_numbers)]
+
+
+def bench_serializable(iterations, relations):
+    """
+    Benchmark converting a suds object tree the size of a reply, with the recursive conversion SerializablePlugin used
+    before and with to_serializable.
+    """
+    data = etree_to_dict(translate(person_document(['191212121212'], relations)))
+    suds_object = _to_suds('NavetNotifications', data['NavetNotifications'])
+    items = [suds_object] * iterations
+    return [measure('serializable.recursive', _recursive_asdict, items, relations=relations),
+            measure('serializable', to_serializable, items, relations=relations),
+            measure('serializable.json', lambda item: to_serializable(item, json_ready=True), items,
+                    relations=relations)]
+
+
+def run(iterations=200, concurrency_levels=(1, 4, 16), latency=0.0, relations=4, fault_rate=0.0,
+        lookups=LOOKUPS):
+    """
+    Run all benchmarks.
+
+    @return: Run metadata and benchmark results
+    @rtype: OrderedDict
+    """
+    results = [bench_xslt(iterations, relations), bench_dict(iterations, relations),
+               bench_records(iterations, relations)]
+    results.extend(bench_serializable(iterations, relations))
+    results.extend(bench_envelope(iterations))
+    server = NavetServer(latency=latency, relations=relations, fault_rate=fault_rate)
+    server.start()
+    try:
+        results.extend(bench_lookups(server, iterations, concurrency_levels, lookups))
+    finally:
+        server.stop()
+    return OrderedDict([
+        ('timestamp', time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())),
+        ('python', platform.python_version()),
+        ('platform', platform.platform()),
+        ('results', results),
+    ])
+
+
+def format_table(report):
+    """
+    @return: The benchmark results as a text table
+    @rtype: str
+    """
+    lines = ['%-32s %5s %8s %10s %10s %10s %10s' % ('benchmark', 'conc', 'errors', 'ops/s', 'p50 ms', 'p99 ms',
+                                                      'mem KiB')]
+    for result in report['results']:
+        lines.append('%-32s %5d %8d %10.1f %10.3f %10.3f %10d' % (
+            result['name'], result['concurrency'], result['errors'], result['throughput'] or 0,
+            (result['p50'] or 0) * 1000, (result['p99'] or 0) * 1000, result['memory_kb']))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--iterations', type='int', default=200, help='Calls per benchmark (default 200)')
+    parser.add_option('--concurrency', default='1,4,16', help='Comma separated concurrency levels (default 1,4,16)')
+    parser.add_option('--latency', type='float', default=0.0, help='Stand-in server latency in seconds')
+    parser.add_option('--relations', type='int', default=4, help='Relations per person, controls payload size')
+    parser.add_option('--fault-rate', type='float', default=0.0, help='Fraction of requests answered with faults')
+    parser.add_option('--output', help='Write JSON results to this file instead of stdout')
+    options, _ = parser.parse_args(argv)
+    report = run(iterations=options.iterations,
+                 concurrency_levels=[int(level) for level in options.concurrency.split(',')],
+                 latency=options.latency, relations=options.relations, fault_rate=options.fault_rate)
+    sys.stderr.write(format_table(report) + '\n')
+    if options.output:
+        with open(options.output, 'w') as fd:
+            json.dump(report, fd, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+"""
+This module provides result caches for parsed NAVET person records, keyed on national identity number.
+"""
+from collections import OrderedDict
+from abc import ABCMeta, abstractmethod
+import threading
+import sqlite3
+import time
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+
+# abc.ABC on both Python 2 and 3
+_ABC = ABCMeta('_ABC', (object,), {})
+
+
+class ResultCache(_ABC):
+    """
+    Base class for result caches, safe to share between threads. Entries expire after 'ttl' seconds and the least
+    recently used entries are evicted when more than 'max_entries' are stored. Expired entries are kept until evicted,
+    so get_stale() can serve the last known value when NAVET can't be reached.
+
+    Cached values are shared between callers and must not be modified. Subclasses implement _get, set, invalidate and
+    clear, _get is called with self._lock held and may return a stored form of the value that _load, called without
+    the lock, turns back into the value.
+    """
+    def __init__(self, ttl=300, max_entries=10000):
+        """
+        @param ttl: (optional) Seconds an entry stays valid, default 300
+        @type ttl: int | float
+        @param max_entries: (optional) Max number of entries before LRU eviction, default 10000
+        @type max_entries: int
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Get a cached value.
+
+        @param key: Cache key
+        @type key: str
+        @return: The cached value or None if missing or expired
+        """
+        with self._lock:
+            stored = self._get(key)
+            if stored is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return self._load(stored)
+
+    def get_stale(self, key):
+        """
+        Get a cached value even if it has expired. Does not count as a hit or miss.
+
+        @param key: Cache key
+        @type key: str
+        @return: The last cached value or None if missing
+        """
+        with self._lock:
+            stored = self._get(key, stale=True)
+        return self._load(stored) if stored is not None else None
+
+    @abstractmethod
+    def set(self, key, value):
+        """
+        Store a value.
+
+        @param key: Cache key
+        @type key: str
+        @param value: Value to store, must be picklable for persistent backends
+        """
+
+    @abstractmethod
+    def invalidate(self, key):
+        """
+        Remove a value from the cache.
+
+        @param key: Cache key
+        @type key: str
+        """
+
+    @abstractmethod
+    def clear(self):
+        """
+        Remove all values from the cache.
+        """
+
+    def stats(self):
+        """
+        @return: Hit and miss counters
+        @rtype: dict
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+    @abstractmethod
+    def _get(self, key, stale=False):
+        """
+        @return: The stored value, None if missing or expired and not stale
+        """
+
+    def _load(self, stored):
+        """
+        @return: The value stored as returned by _get
+        """
+        return stored
+
+
+class MemoryCache(ResultCache):
+    """
+    In-process LRU cache, safe to share between threads.
+    """
+    def __init__(self, ttl=300, max_entries=10000):
+        ResultCache.__init__(self, ttl=ttl, max_entries=max_entries)
+        self._data = OrderedDict()
+
+    def _get(self, key, stale=False):
+        entry = self._data.pop(key, None)
+        if entry is None:
+            return None
+        # Re-insert to mark as most recently used
+        self._data[key] = entry
+        expires, value = entry
+        if expires < time.time() and not stale:
+            return None
+        return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (time.time() + self.ttl, value)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SqliteCache(ResultCache):
+    """
+    Persistent cache in a sqlite database. Several worker processes can share the same database file.
+
+    Entries are evicted every max_entries / 100 inserts, so the database may hold up to 1% more entries per process
+    in between.
+    """
+    def __init__(self, path, ttl=300, max_entries=100000, timeout=10):
+        """
+        @param path: Path to the sqlite database file
+        @type path: str
+        @param ttl: (optional) Seconds an entry stays valid, default 300
+        @type ttl: int | float
+        @param max_entries: (optional) Max number of entries before LRU eviction, default 100000
+        @type max_entries: int
+        @param timeout: (optional) Seconds to wait for a database lock held by another process, default 10
+        @type timeout: int | float
+        """
+        ResultCache.__init__(self, ttl=ttl, max_entries=max_entries)
+        self.path = path
+        self._db = sqlite3.connect(path, timeout=timeout, check_same_thread=False, isolation_level=None)
+        self._db.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, expires REAL, '
+                         'accessed REAL, value BLOB)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)')
+        self._inserts = 0
+
+    def _get(self, key, stale=False):
+        now = time.time()
+        row = self._db.execute('SELECT expires, value FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        if row[0] < now and not stale:
+            return None
+        self._db.execute('UPDATE results SET accessed = ? WHERE key = ?', (now, key))
+        return row[1]
+
+    def _load(self, stored):
+        return pickle.loads(bytes(stored))
+
+    def set(self, key, value):
+        now = time.time()
+        blob = sqlite3.Binary(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO results (key, expires, accessed, value) VALUES (?, ?, ?, ?)',
+                             (key, now + self.ttl, now, blob))
+            # Counting scans the table, only do it every 1% of max_entries inserts
+            self._inserts += 1
+            if self._inserts < max(1, self.max_entries // 100):
+                return
+            self._inserts = 0
+            count = self._db.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+            if count > self.max_entries:
+                self._db.execute('DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY accessed '
+                                 'LIMIT ?)', (count - self.max_entries,))
+
+    def invalidate(self, key):
+        with self._lock:
+            self._db.execute('DELETE FROM results WHERE key = ?', (key,))
+
+    def clear(self):
+        with self._lock:
+            self._db.execute('DELETE FROM results')
+
+    def close(self):
+        """
+        Close the database connection.
+        """
+        self._db.close()
@@ -0,0 +1,300 @@
+"""
+This module provides the 'pynavet' command for bulk lookups.
+
+    pynavet --cert client.crt --key client.key --order-id ORDER --fields name,address \\
+        --checkpoint run.checkpoint --output people.jsonl identity_numbers.txt
+
+Identity numbers are read one per line from a file or stdin and looked up concurrently over one pooled connection.
+Results are written as they complete, in completion order, as JSON lines or CSV. With --checkpoint the progress is
+saved regularly and an interrupted run started again with the same arguments continues where it stopped, appending
+to the output file. Lookups completed after the last saved checkpoint may be written twice. Failed lookups are
+written with an 'error', except lookups failing on transport errors, an open circuit or an unavailable service while
+checkpointing: these are saved in the checkpoint instead and looked up again when the run is resumed.
+"""
+from pynavet import __ws_endpoint__
+from pynavet.postaladdress import PostalAddress
+from pynavet.balancer import is_availability_fault
+from pynavet.records import Name, OfficialAddress
+from pynavet.batch import imap_unordered
+from suds import WebFault
+import optparse
+import json
+import time
+import csv
+import sys
+import os
+
+FIELDS = ('name', 'address', 'relations')
+
+text_type = type(u'')
+
+
+class Checkpoint(object):
+    """
+    Progress of a run: every input line before 'position' is done, plus the lines in 'done' after it. Lookups
+    complete out of order, so only the lines in flight around the position are kept in memory. Lines that failed
+    transiently count as done and are kept in 'retry', a dict of line number to identity number, to be looked up
+    again.
+    """
+    def __init__(self, path=None):
+        """
+        @param path: (optional) File to load and save the checkpoint in, default not saved
+        @type path: str
+        """
+        self.path = path
+        self.position = 0
+        self.done = set()
+        self.retry = {}
+        if path is not None and os.path.exists(path):
+            with open(path) as fd:
+                state = json.load(fd)
+            self.position = state['position']
+            self.done = set(state['done'])
+            self.retry = dict((index, identity_number) for index, identity_number in state.get('retry', ()))
+
+    def __contains__(self, index):
+        return index < self.position or index in self.done
+
+    def add(self, index, retry=None):
+        """
+        Mark an input line as done.
+
+        @param index: Line number, counting from 0
+        @type index: int
+        @param retry: (optional) Identity number to look up again when resumed, if the lookup failed transiently
+        @type retry: str
+        """
+        if retry is not None:
+            self.retry[index] = retry
+        else:
+            self.retry.pop(index, None)
+        if index in self:
+            return
+        self.done.add(index)
+        while self.position in self.done:
+            self.done.remove(self.position)
+            self.position += 1
+
+    def save(self):
+        """
+        Atomically write the checkpoint file.
+        """
+        if self.path is None:
+            return
+        tmp = '%s.tmp' % self.path
+        with open(tmp, 'w') as fd:
+            json.dump({'position': self.position, 'done': sorted(self.done), 'retry': sorted(self.retry.items())}, fd)
+        os.rename(tmp, self.path)
+
+
+class JSONLinesWriter(object):
+    """
+    Write one JSON object per line.
+    """
+    def __init__(self, fd, fields):
+        self.fd = fd
+        self.fields = fields
+
+    def write(self, identity_number, person, error=None):
+        item = {'identity_number': identity_number}
+        if error is not None:
+            item['error'] = error
+        else:
+            if 'name' in self.fields:
+                item['name'] = person.name.to_dict() if person.name is not None else None
+            if 'address' in self.fields:
+                address = person.official_address
+                item['address'] = address.to_dict() if address is not None else None
+            if 'relations' in self.fields:
+                item['relations'] = [relation.to_dict() for relation in person.relations]
+        self.fd.write(json.dumps(item, sort_keys=True) + '\n')
+
+
+class CSVWriter(object):
+    """
+    Write CSV rows with a header, relations are written as one JSON column.
+    """
+    def __init__(self, fd, fields, header=True):
+        self.fields = fields
+        self.columns = ['identity_number']
+        if 'name' in fields:
+            self.columns.extend(Name.__slots__)
+        if 'address' in fields:
+            self.columns.extend(OfficialAddress.__slots__)
+        if 'relations' in fields:
+            self.columns.append('relations')
+        self.columns.append('error')
+        self.writer = csv.writer(fd)
+        if header:
+            self.writer.writerow(self.columns)
+
+    def write(self, identity_number, person, error=None):
+        row = {'identity_number': identity_number, 'error': error}
+        if person is not None:
+            if 'name' in self.fields and person.name is not None:
+                row.update(person.name.to_dict())
+            if 'address' in self.fields and person.official_address is not None:
+                row.update(person.official_address.to_dict())
+            if 'relations' in self.fields:
+                row['relations'] = json.dumps([relation.to_dict() for relation in person.relations], sort_keys=True)
+        self.writer.writerow([_csv_value(row.get(column)) for column in self.columns])
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if str is bytes and isinstance(value, text_type):
+        return value.encode('utf-8')
+    return value
+
+
+def _permanent(error):
+    # Faults answering the lookup, anything else may succeed when retried
+    return isinstance(error, WebFault) and not is_availability_fault(error)
+
+
+def read_identity_numbers(fd):
+    """
+    Read identity numbers one per line, skipping blank lines and lines starting with '#'.
+
+    @return: Generator of (index, identity number), index counting the identity numbers read
+    """
+    index = 0
+    for line in fd:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        yield index, line
+        index += 1
+
+
+def run(navet, identity_numbers, writer, checkpoint, concurrency=4, rate_limit=None, checkpoint_every=1000,
+        output=None):
+    """
+    Look up identity numbers concurrently, writing results as they complete.
+
+    @param navet: Client, created with records=True
+    @type navet: PostalAddress
+    @param identity_numbers: (index, identity number) tuples, see read_identity_numbers
+    @type identity_numbers: iterable
+    @param writer: JSONLinesWriter or CSVWriter
+    @param checkpoint: Progress, lines already done are skipped and lines to retry looked up first. If it is saved,
+    lookups failing transiently are added to its retry list instead of written as errors.
+    @type checkpoint: Checkpoint
+    @param output: (optional) Output file, flushed before every checkpoint save
+    @type output: file
+    @return: Summary of the run, 'retries' counting the lookups left to retry
+    @rtype: dict
+    """
+    summary = {'lookups': 0, 'errors': 0, 'skipped': 0}
+    start = time.time()
+    retrying = dict(checkpoint.retry)
+
+    def pending():
+        for item in sorted(retrying.items()):
+            yield item
+        for index, identity_number in identity_numbers:
+            if index in checkpoint:
+                if index not in retrying:
+                    summary['skipped'] += 1
+                continue
+            yield index, identity_number
+
+    def lookup(item):
+        return navet.get_all_data(item[1])
+
+    def save():
+        if output is not None:
+            output.flush()
+        checkpoint.save()
+
+    try:
+        for result in imap_unordered(lookup, pending(), max_workers=concurrency, rate_limit=rate_limit):
+            index, identity_number = result.identity_number
+            summary['lookups'] += 1
+            if result.error is not None and checkpoint.path is not None and not _permanent(result.error):
+                checkpoint.add(index, retry=identity_number)
+            else:
+                if result.error is not None:
+                    summary['errors'] += 1
+                    writer.write(identity_number, None, error=str(result.error) or type(result.error).__name__)
+                elif result.result is None:
+                    summary['errors'] += 1
+                    writer.write(identity_number, None, error='Not found')
+                else:
+                    writer.write(identity_number, result.result)
+                checkpoint.add(index)
+            if summary['lookups'] % checkpoint_every == 0:
+                save()
+    finally:
+        save()
+        summary['retries'] = len(checkpoint.retry)
+        summary['seconds'] = time.time() - start
+        summary['throughput'] = summary['lookups'] / summary['seconds'] if summary['seconds'] else 0.0
+    return summary
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options] [FILE]',
+                                   description='Look up national identity numbers, one per line in FILE or stdin.')
+    parser.add_option('--cert', help='Client certificate in PEM format')
+    parser.add_option('--key', help='Client certificate key in PEM format')
+    parser.add_option('--order-id', help='Organisation number + ordering ID')
+    parser.add_option('--url', default=__ws_endpoint__, help='Service URL endpoint')
+    parser.add_option('--ca-bundle', help='CA certificates to verify the endpoint with')
+    parser.add_option('--no-verify', action='store_true', default=False, help='Do not verify the endpoint certificate')
+    parser.add_option('--timeout', type='float', help='Request timeout in seconds')
+    parser.add_option('--retries', type='int', default=2, help='Retries of failed requests (default 2)')
+    parser.add_option('--fields', default='name,address',
+                      help='Comma separated fields to output: %s (default name,address)' % ', '.join(FIELDS))
+    parser.add_option('--format', choices=('jsonl', 'csv'), default='jsonl', help='jsonl or csv (default jsonl)')
+    parser.add_option('--output', help='Output file, default stdout')
+    parser.add_option('--concurrency', type='int', default=4, help='Concurrent lookups (default 4)')
+    parser.add_option('--rate-limit', type='float', help='Max lookups per second')
+    parser.add_option('--checkpoint', help='Checkpoint file to save progress in and resume from')
+    parser.add_option('--checkpoint-every', type='int', default=1000,
+                      help='Lookups between checkpoint saves (default 1000)')
+    options, args = parser.parse_args(argv)
+    if not options.cert or not options.key or not options.order_id:
+        parser.error('--cert, --key and --order-id are required')
+    fields = [field.strip() for field in options.fields.split(',') if field.strip()]
+    unknown = set(fields) - set(FIELDS)
+    if unknown:
+        parser.error('Unknown fields: %s' % ', '.join(sorted(unknown)))
+    if len(args) > 1:
+        parser.error('Only one input file can be given')
+
+    checkpoint = Checkpoint(options.checkpoint)
+    resuming = checkpoint.position > 0 or bool(checkpoint.done) or bool(checkpoint.retry)
+    if options.output:
+        new_output = not (resuming and os.path.exists(options.output))
+        output = open(options.output, 'w' if new_output else 'a')
+    else:
+        new_output = not resuming
+        output = sys.stdout
+    if options.format == 'csv':
+        writer = CSVWriter(output, fields, header=new_output)
+    else:
+        writer = JSONLinesWriter(output, fields)
+
+    verify = options.ca_bundle or not options.no_verify
+    navet = PostalAddress(options.cert, options.key, options.order_id, url=options.url, verify=verify,
+                          timeout=options.timeout, retries=options.retries, pool_maxsize=options.concurrency,
+                          records=True)
+    source = open(args[0]) if args and args[0] != '-' else sys.stdin
+    try:
+        summary = run(navet, read_identity_numbers(source), writer, checkpoint, concurrency=options.concurrency,
+                      rate_limit=options.rate_limit, checkpoint_every=options.checkpoint_every, output=output)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+        navet.client.options.transport.close()
+    sys.stderr.write('%(lookups)d lookups, %(errors)d errors, %(skipped)d skipped, %(retries)d to retry in '
+                     '%(seconds).1f s (%(throughput).1f lookups/s)\n' % summary)
+    return 1 if summary['errors'] or summary['retries'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
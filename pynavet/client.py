@@ -1,17 +1,20 @@
 """
 This module provides a wrapper for suds.client
 """
-import os
+import threading
 from pynavet.transport import CertAuthTransport
-from pynavet.plugins import SerializablePlugin
-from suds.client import Client
-from suds.cache import ObjectCache
-from suds.xsd.doctor import ImportDoctor, Import
+from pynavet.plugins import SerializablePlugin, InstrumentationPlugin
+from pynavet.model import new_client
+from suds.cache import ObjectCache, NoCache
 
 
 class NavetClient(object):
     """
     This class represents a wrapper for suds.client
+
+    The suds client itself is not thread-safe, use get_client() to get a suds client for the calling thread. All
+    clients share the same pooled transport and plugins. Clients are cloned from the precompiled service model in
+    pynavet.model instead of parsing the WSDL every time.
     """
     def __init__(self, wsdl, cert, url, use_cache, **kwargs):
         """
@@ -29,9 +32,31 @@ class NavetClient(object):
         @type serializable: bool
         @param plugins: (optional) List of suds plugins to load
         @type plugins: list of plugins
+        @param timeout: (optional) Connect and read timeout in seconds, float or tuple (connect, read)
+        @type timeout: float | tuple
+        @param pool_connections: (optional) Number of per-host connection pools to cache
+        @type pool_connections: int
+        @param pool_maxsize: (optional) Max number of kept-alive connections per host
+        @type pool_maxsize: int
+        @param pool_block: (optional) Block when the connection pool is exhausted
+        @type pool_block: bool
+        @param keep_alive: (optional) Reuse HTTPS connections between requests, default True
+        @type keep_alive: bool
+        @param session: (optional) requests.Session to share between clients
+        @type session: requests.Session
+        @param instrumentation: (optional) Receiver of timings and counters, see pynavet.instrumentation
+        @type instrumentation: pynavet.instrumentation.Instrumentation
+        @param retries: (optional) Number of retries of failed requests, with 'backoff', 'backoff_max' and
+        'retry_statuses', see CertAuthTransport
+        @type retries: int
+        @param hedge_after: (optional) Seconds before sending a second identical request
+        @type hedge_after: float
+        @param circuit_breaker: (optional) Circuit breaker failing calls fast while NAVET is down
+        @type circuit_breaker: pynavet.resilience.CircuitBreaker
+        @param profiler: (optional) Profiler of a sample of the lookups, see pynavet.profiling
+        @type profiler: pynavet.profiling.SamplingProfiler
         """
-        path = os.path.abspath(os.path.dirname(__file__))
-        cache = ObjectCache(days=1) if use_cache else None
+        cache = ObjectCache(days=1) if use_cache else NoCache()
 
         plugins = kwargs.pop('plugins', None)
         if plugins is not None:
@@ -40,18 +65,56 @@ class NavetClient(object):
             self.plugins = []
 
         serializable = kwargs.pop('serializable', False)
-        transport = CertAuthTransport(cert=cert, **kwargs)
+        self.instrumentation = kwargs.pop('instrumentation', None)
+        self.profiler = kwargs.pop('profiler', None)
+        transport = CertAuthTransport(cert=cert, instrumentation=self.instrumentation, **kwargs)
         headers = {"Content-Type": "text/xml;charset=UTF-8"}
 
-        # Do the magic XSD dance, required since the WSDL lack explicit xsd imports
-        imp = Import('http://schemas.xmlsoap.org/soap/encoding/', location='file://%s/schema/soap-encoding.xsd' % path)
-        doctor = ImportDoctor(imp)
-
-        self.client = Client('file://%s/%s' % (path, wsdl), location=url, transport=transport, headers=headers,
-                             cache=cache, plugins=self.plugins, doctor=doctor)
+        self._client_args = (wsdl, dict(location=url, headers=headers, cache=cache))
+        self._local = threading.local()
+        self._owner = threading.current_thread()
+        self.client = self._create_client(self.plugins, transport)
 
         if serializable:
             self.load_plugin(SerializablePlugin)
+        if self.instrumentation is not None:
+            self.load_plugin(InstrumentationPlugin, self.instrumentation)
+
+    def _begin_call(self):
+        """
+        Notify the instrumentation plugin, if loaded, that a service method is about to be invoked.
+        """
+        for plugin in self.client.options.plugins:
+            if isinstance(plugin, InstrumentationPlugin):
+                plugin.begin()
+
+    def _profiled(self, func, *args):
+        """
+        Call func, letting the profiler, if any, decide whether to profile the call.
+        """
+        if self.profiler is None:
+            return func(*args)
+        return self.profiler.call(func, *args)
+
+    def _create_client(self, plugins, transport):
+        wsdl, options = self._client_args
+        return new_client(wsdl, plugins=plugins, transport=transport, **options)
+
+    def get_client(self):
+        """
+        Get the suds client to use in the calling thread. The thread that created this object gets self.client,
+        other threads get a suds client of their own, created on first use.
+
+        @return: suds client
+        @rtype: suds.client.Client
+        """
+        if threading.current_thread() is self._owner:
+            return self.client
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self._create_client(self.client.options.plugins,
+                                                              self.client.options.transport.clone())
+        return client
 
     def load_plugin(self, plugin, *args):
         """
@@ -0,0 +1,74 @@
+"""
+This module provides request coalescing (single-flight): concurrent calls for the same key share one upstream call.
+"""
+import threading
+
+
+class _Call(object):
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Coalesce concurrent calls with the same key. The first caller makes the call, callers arriving while it is in
+    flight wait for it and get the same result or exception. Nothing is remembered once the call has completed.
+    """
+    def __init__(self, instrumentation=None):
+        """
+        @param instrumentation: (optional) Receiver of the 'pynavet.coalesced' counter
+        @type instrumentation: pynavet.instrumentation.Instrumentation
+        """
+        self.instrumentation = instrumentation
+        self.calls = 0
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args):
+        """
+        Call func(*args), or wait for an identical call already in flight.
+
+        @param key: Identifies identical calls, must be hashable
+        @param func: Function to call
+        @type func: callable
+        @return: The result of the call
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+        if not leader:
+            if self.instrumentation is not None:
+                self.instrumentation.count('pynavet.coalesced')
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = func(*args)
+            return call.result
+        except BaseException as e:
+            # Waiters must not take an interrupted call, ie KeyboardInterrupt or GeneratorExit, for a None result
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def stats(self):
+        """
+        @return: Number of upstream calls made and number of calls served by another caller's call
+        @rtype: dict
+        """
+        return {'calls': self.calls, 'coalesced': self.coalesced}
@@ -0,0 +1,226 @@
+"""
+This module provides precompiled SOAP request envelopes for the NAVET services, and parsing of their replies.
+"""
+from pynavet.model import new_client
+from suds import WebFault
+from suds.sax.enc import Encoder
+from suds.sudsobject import Factory
+from suds.transport import Request, TransportError
+from lxml import etree
+from io import BytesIO
+import threading
+
+try:
+    from suds.client import SoapClient
+except ImportError:
+    # suds-community
+    from suds.client import _SoapClient as SoapClient
+
+text_type = type(u'')
+
+SOAP_ENV = '{http://schemas.xmlsoap.org/soap/envelope/}'
+
+_MARKER = u'PYNAVETARG%dMARKER'
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+class EnvelopeTemplate(object):
+    """
+    Request envelope for an rpc operation taking string arguments, rendered by suds once with placeholder values and
+    then filled in with plain string operations. The output is identical to what suds sends for the same arguments,
+    including the suds escaping of special characters and the omission of None arguments.
+    """
+    def __init__(self, client, operation='getData'):
+        """
+        @param client: suds client to derive the envelope from
+        @type client: suds.client.Client
+        @param operation: Name of the operation
+        @type operation: str
+        """
+        method = getattr(client.service, operation).method
+        self.operation = operation
+        self.headers = {'Content-Type': 'text/xml; charset=utf-8', 'SOAPAction': method.soap.action}
+        self.parts = [str(param[0]) for param in method.binding.input.param_defs(method)]
+
+        markers = [_MARKER % i for i in range(len(self.parts))]
+        envelope = method.binding.input.get_message(method, markers, {}).plain()
+        self.args = []
+        position = None
+        for marker in markers:
+            index = envelope.index(marker)
+            start = envelope.rindex(u'<', 0, index)
+            end = envelope.index(u'>', index + len(marker)) + 1
+            if position is None:
+                self.head = envelope[:start]
+            elif start != position:
+                raise ValueError('Unexpected content between arguments in %s envelope' % operation)
+            self.args.append((envelope[start:index], envelope[index + len(marker):end]))
+            position = end
+        self.tail = envelope[position:]
+        self._encoder = Encoder()
+
+    def render(self, *args):
+        """
+        Render the request envelope.
+
+        @param args: The operation arguments, in WSDL parameter order. None arguments are left out.
+        @return: UTF-8 encoded envelope
+        @rtype: str
+        """
+        return self.render_text(*args).encode('utf-8')
+
+    def render_text(self, *args):
+        """
+        Render the request envelope without encoding it, see render.
+
+        @rtype: unicode
+        """
+        if len(args) != len(self.args):
+            raise TypeError('%s() takes exactly %d arguments (%d given)' % (self.operation, len(self.args), len(args)))
+        body = []
+        encode = self._encoder.encode
+        for (start, end), value in zip(self.args, args):
+            if value is None:
+                continue
+            if isinstance(value, bytes):
+                value = value.decode('utf-8')
+            elif not isinstance(value, text_type):
+                value = text_type(value)
+            body.append(start)
+            body.append(encode(value))
+            body.append(end)
+        if body:
+            envelope = self.head + u''.join(body) + self.tail
+        else:
+            # suds renders an empty operation element as a self-closing tag
+            envelope = self.head[:-1] + u'/>' + self.tail[self.tail.index(u'>') + 1:]
+        return envelope
+
+
+class _RenderedEnvelope(object):
+    """
+    Stands in for the suds sax Document that SoapClient.send serializes. There is no document tree, so 'marshalled'
+    plugins get None as envelope. 'sending' and later plugins work as usual.
+    """
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text
+
+    def root(self):
+        return None
+
+    def plain(self):
+        return self.text
+
+    def str(self):
+        return self.text
+
+    def __unicode__(self):
+        return self.text
+
+    def __str__(self):
+        return self.text if str is text_type else self.text.encode('utf-8')
+
+
+def get_template(wsdl, operation='getData'):
+    """
+    Get the envelope template for an operation in one of the bundled wsdl files, built once per process.
+
+    @param wsdl: Which bundled wsdl file to load
+    @type wsdl: str
+    @param operation: Name of the operation
+    @type operation: str
+    @rtype: EnvelopeTemplate
+    """
+    key = (wsdl, operation)
+    template = _templates.get(key)
+    if template is None:
+        with _templates_lock:
+            template = _templates.get(key)
+            if template is None:
+                template = _templates[key] = EnvelopeTemplate(new_client(wsdl), operation)
+    return template
+
+
+def send_envelope(client, template, *args):
+    """
+    Invoke an operation with a request rendered from a template instead of marshalled by suds. The request is sent
+    and the reply processed by suds as usual, with the client's transport, headers, plugins and options.
+
+    @param client: suds client to send with
+    @type client: suds.client.Client
+    @param template: Template for the operation, derived from the client's wsdl
+    @type template: EnvelopeTemplate
+    @param args: The operation arguments, in WSDL parameter order
+    @return: Whatever client.service.<operation>(*args) returns
+    """
+    method = getattr(client.service, template.operation).method
+    return SoapClient(client, method).send(_RenderedEnvelope(template.render_text(*args)))
+
+
+def post_envelope(client, template, envelope):
+    """
+    Send a rendered request envelope with the client's transport, bypassing suds: no plugins are run and the reply
+    is neither parsed nor unmarshalled. The request is sent to the same location with the same headers as suds would.
+
+    @param client: suds client to take the transport, location and headers from
+    @type client: suds.client.Client
+    @param template: Template the envelope was rendered from
+    @type template: EnvelopeTemplate
+    @param envelope: Rendered request envelope
+    @type envelope: bytes
+    @return: The return value of the operation, see parse_response
+    @rtype: unicode | None
+    """
+    options = client.options
+    location = options.location or getattr(client.service, template.operation).method.location
+    request = Request(location, envelope)
+    request.headers = dict(template.headers)
+    request.headers.update(options.headers)
+    reply = options.transport.send(request)
+    return parse_response(reply.code, reply.message)
+
+
+def parse_response(status, body):
+    """
+    Get the return value from an HTTP response to an rpc request, see parse_reply.
+
+    @param status: HTTP status
+    @type status: int
+    @param body: Response body
+    @type body: bytes
+    @rtype: unicode | None
+    @raise WebFault: For SOAP faults
+    @raise TransportError: For other HTTP errors
+    """
+    if status in (202, 204):
+        return None
+    if status not in (200, 500):
+        raise TransportError('HTTP status %s' % status, status, BytesIO(body))
+    result = parse_reply(body)
+    if status != 200:
+        raise TransportError('HTTP status %s' % status, status, BytesIO(body))
+    return result
+
+
+def parse_reply(body):
+    """
+    Get the return value from a raw rpc reply, raising WebFault for SOAP faults like suds does. The body is parsed
+    by lxml as is, decoded according to its XML declaration.
+
+    @param body: Raw SOAP reply
+    @type body: bytes
+    @return: The return value, ie the NAVET document for getData
+    @rtype: unicode | None
+    """
+    document = etree.fromstring(body)
+    reply = document.find(SOAP_ENV + 'Body')[0]
+    if reply.tag == SOAP_ENV + 'Fault':
+        fault = Factory.object('Fault', dict((child.tag, child.text) for child in reply))
+        raise WebFault(fault, document)
+    if not len(reply):
+        return None
+    return reply[0].text
@@ -0,0 +1,162 @@
+"""
+This module provides instrumentation interfaces for timing NAVET lookups.
+
+Pass an Instrumentation instance as 'instrumentation' to NavetClient/PostalAddress to receive these metrics:
+
+    pynavet.call                 timing      NAVET lookup including translation of the reply
+    pynavet.search               timing      One NameSearch request, excluding parsing of the results
+    pynavet.envelope             timing      Building the request envelope
+    pynavet.http.ttfb            timing      Sending the request until response headers, including connect and TLS
+    pynavet.http.body            timing      Reading the response body
+    pynavet.http.connections     count       New connections opened to the endpoint
+    pynavet.http.responses       count       HTTP responses, tagged with status
+    pynavet.http.retries         count       Retried requests
+    pynavet.http.hedges          count       Hedged requests sent after hedge_after seconds
+    pynavet.http.request_size    observation Request envelope size in bytes
+    pynavet.http.response_size   observation Response body size in bytes
+    pynavet.xslt                 timing      XSLT translation of the reply
+    pynavet.dict                 timing      Full conversion of the translated reply to a dict, on first use
+    pynavet.coalesced            count       Lookups served by a concurrent lookup of the same identity number
+    pynavet.faults               count       SOAP faults returned by NAVET
+    pynavet.errors               count       Other failed calls
+
+Without instrumentation none of the measurements are taken.
+"""
+from contextlib import contextmanager
+import threading
+import time
+
+
+class Instrumentation(object):
+    """
+    Base class for instrumentation. All methods do nothing, subclasses override what they need.
+    """
+    def timing(self, name, seconds, tags=None):
+        """
+        Record a duration.
+
+        @param name: Metric name
+        @type name: str
+        @param seconds: Duration in seconds
+        @type seconds: float
+        @param tags: (optional) Metric tags
+        @type tags: dict
+        """
+
+    def observe(self, name, value, tags=None):
+        """
+        Record a value, for example a payload size.
+
+        @param name: Metric name
+        @type name: str
+        @param value: Observed value
+        @type value: int | float
+        @param tags: (optional) Metric tags
+        @type tags: dict
+        """
+
+    def count(self, name, value=1, tags=None):
+        """
+        Increment a counter.
+
+        @param name: Metric name
+        @type name: str
+        @param value: (optional) Increment, default 1
+        @type value: int
+        @param tags: (optional) Metric tags
+        @type tags: dict
+        """
+
+    @contextmanager
+    def span(self, name, tags=None):
+        """
+        Context manager timing the enclosed block and recording it with timing().
+
+        @param name: Metric name
+        @type name: str
+        @param tags: (optional) Metric tags
+        @type tags: dict
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.timing(name, time.time() - start, tags)
+
+
+class PrometheusInstrumentation(Instrumentation):
+    """
+    Instrumentation exporting histograms and counters with prometheus_client. Metric names have their dots replaced
+    with underscores, timings get a '_seconds' suffix and counters a '_total' suffix. The tags used with a metric
+    become its labels and must be the same every time.
+    """
+    def __init__(self, registry=None, buckets=None):
+        """
+        @param registry: (optional) prometheus_client registry, default the global registry
+        @type registry: prometheus_client.CollectorRegistry
+        @param buckets: (optional) Histogram buckets for timings
+        @type buckets: list
+        """
+        import prometheus_client
+        self._prometheus = prometheus_client
+        self.registry = registry if registry is not None else prometheus_client.REGISTRY
+        self.buckets = buckets
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _metric(self, kind, name, tags, **kwargs):
+        key = (kind, name)
+        metric = self._metrics.get(key)
+        if metric is None:
+            # Registering a name twice raises, create each metric once even when first used by several threads
+            with self._lock:
+                metric = self._metrics.get(key)
+                if metric is None:
+                    labels = sorted(tags) if tags else []
+                    metric = self._metrics[key] = getattr(self._prometheus, kind)(
+                        name, name, labels, registry=self.registry, **kwargs)
+        if tags:
+            metric = metric.labels(**tags)
+        return metric
+
+    def timing(self, name, seconds, tags=None):
+        kwargs = {'buckets': self.buckets} if self.buckets else {}
+        self._metric('Histogram', name.replace('.', '_') + '_seconds', tags, **kwargs).observe(seconds)
+
+    def observe(self, name, value, tags=None):
+        self._metric('Histogram', name.replace('.', '_'), tags).observe(value)
+
+    def count(self, name, value=1, tags=None):
+        self._metric('Counter', name.replace('.', '_') + '_total', tags).inc(value)
+
+
+class OpenTelemetryInstrumentation(Instrumentation):
+    """
+    Instrumentation recording timed steps as OpenTelemetry spans. Counts and observations are added as attributes
+    to the current span.
+    """
+    def __init__(self, tracer=None):
+        """
+        @param tracer: (optional) OpenTelemetry tracer, default the tracer for 'pynavet' from the global provider
+        @type tracer: opentelemetry.trace.Tracer
+        """
+        from opentelemetry import trace
+        self._trace = trace
+        self.tracer = tracer if tracer is not None else trace.get_tracer('pynavet')
+
+    @contextmanager
+    def span(self, name, tags=None):
+        with self.tracer.start_as_current_span(name, attributes=tags):
+            yield
+
+    def timing(self, name, seconds, tags=None):
+        # Steps not measured with span() are added to the current span instead
+        self._trace.get_current_span().set_attribute(name, seconds)
+
+    def observe(self, name, value, tags=None):
+        self._trace.get_current_span().set_attribute(name, value)
+
+    def count(self, name, value=1, tags=None):
+        if tags:
+            name = '%s.%s' % (name, '.'.join(str(tags[key]) for key in sorted(tags)))
+        self._trace.get_current_span().set_attribute(name, value)
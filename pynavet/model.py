@@ -0,0 +1,222 @@
+"""
+This module provides precompiled service models for the bundled wsdl files, so suds clients can be created without
+parsing the WSDL and XSD files every time.
+
+The parsed model (suds Definitions) of a wsdl is pickled once per process and, if a model directory is configured,
+stored on disk for other processes. Each thread gets one template client per wsdl and new clients are shallow clones
+of it, since suds clients sharing a model must not be used concurrently.
+
+Models can be generated at build or deploy time with:
+
+    python -m pynavet.model [directory]
+
+The directory defaults to the 'model' directory next to this module, which is then used automatically. Another
+directory can be selected with the PYNAVET_MODEL_DIR environment variable.
+"""
+from suds.cache import Cache, NoCache
+from suds.client import Client, ServiceSelector
+from suds.options import Options
+from suds.transport.https import HttpAuthenticated
+from suds.xsd.doctor import ImportDoctor, Import
+from logging import getLogger
+import suds
+import threading
+import hashlib
+import sys
+import os
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+LOG = getLogger(__name__)
+
+PACKAGE_DIR = os.path.abspath(os.path.dirname(__file__))
+BUNDLED_WSDLS = ('wsdl/personpostXML.wsdl', 'wsdl/namnsokningXML.wsdl')
+
+_models = {}
+_models_lock = threading.Lock()
+_templates = threading.local()
+
+
+def bundled_client(wsdl, **kwargs):
+    """
+    Create a suds client for one of the bundled wsdl files, parsing the WSDL and XSD files.
+
+    @param wsdl: Which bundled wsdl file to load
+    @type wsdl: str
+    @param kwargs: Options passed on to suds.client.Client
+    @return: suds client
+    @rtype: suds.client.Client
+    """
+    # Do the magic XSD dance, required since the WSDL lack explicit xsd imports
+    imp = Import('http://schemas.xmlsoap.org/soap/encoding/',
+                 location='file://%s/schema/soap-encoding.xsd' % PACKAGE_DIR)
+    doctor = ImportDoctor(imp)
+    return Client('file://%s/%s' % (PACKAGE_DIR, wsdl), doctor=doctor, **kwargs)
+
+
+def default_model_dir():
+    """
+    @return: The model directory from PYNAVET_MODEL_DIR or the package model directory if it exists, else None
+    @rtype: str | None
+    """
+    location = os.environ.get('PYNAVET_MODEL_DIR')
+    if location:
+        return location
+    location = os.path.join(PACKAGE_DIR, 'model')
+    if os.path.isdir(location):
+        return location
+    return None
+
+
+class ModelCache(Cache):
+    """
+    suds object cache holding the pickled model of one bundled wsdl file, used with cachingpolicy=1. Every get()
+    returns a fresh copy of the model.
+    """
+    protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, wsdl, location=None):
+        """
+        @param wsdl: Which bundled wsdl file the model is for
+        @type wsdl: str
+        @param location: (optional) Directory to load and store the model in
+        @type location: str
+        """
+        self.wsdl = wsdl
+        self.location = location
+        self._blob = None
+
+    @property
+    def filename(self):
+        """
+        Model file name, unique for the wsdl contents, suds version and python version.
+        """
+        with open(os.path.join(PACKAGE_DIR, self.wsdl), 'rb') as fd:
+            digest = hashlib.sha1(fd.read()).hexdigest()[:12]
+        return '%s-%s-suds%s-py%d%d.model' % (os.path.basename(self.wsdl), digest, suds.__version__,
+                                              sys.version_info[0], sys.version_info[1])
+
+    def get(self, id):
+        if self._blob is None and self.location is not None:
+            try:
+                with open(os.path.join(self.location, self.filename), 'rb') as fd:
+                    self._blob = fd.read()
+            except (IOError, OSError):
+                return None
+        if self._blob is None:
+            return None
+        try:
+            return pickle.loads(self._blob)
+        except Exception:
+            LOG.warning("Could not load service model for %s, parsing the wsdl instead", self.wsdl, exc_info=True)
+            self._blob = None
+            return None
+
+    def put(self, id, object):
+        self._blob = pickle.dumps(object, self.protocol)
+        if self.location is not None:
+            path = os.path.join(self.location, self.filename)
+            tmp = '%s.%d.tmp' % (path, os.getpid())
+            try:
+                with open(tmp, 'wb') as fd:
+                    fd.write(self._blob)
+                os.rename(tmp, path)
+            except (IOError, OSError):
+                LOG.debug("Could not store service model in %s", self.location, exc_info=True)
+        return object
+
+    def purge(self, id):
+        self._blob = None
+
+    def clear(self):
+        self._blob = None
+
+
+def get_model_cache(wsdl):
+    """
+    Get the process wide model cache for a bundled wsdl file.
+
+    @param wsdl: Which bundled wsdl file to load
+    @type wsdl: str
+    @rtype: ModelCache
+    """
+    with _models_lock:
+        cache = _models.get(wsdl)
+        if cache is None:
+            cache = _models[wsdl] = ModelCache(wsdl, default_model_dir())
+        return cache
+
+
+def template_client(wsdl):
+    """
+    Get the template suds client for a bundled wsdl file in the calling thread.
+
+    @param wsdl: Which bundled wsdl file to load
+    @type wsdl: str
+    @rtype: suds.client.Client
+    """
+    templates = getattr(_templates, 'clients', None)
+    if templates is None:
+        templates = _templates.clients = {}
+    client = templates.get(wsdl)
+    if client is None:
+        model_cache = get_model_cache(wsdl)
+        with _models_lock:
+            client = bundled_client(wsdl, cache=model_cache, cachingpolicy=1)
+        client.set_options(cache=NoCache(), cachingpolicy=0)
+        templates[wsdl] = client
+    return client
+
+
+def new_client(wsdl, **kwargs):
+    """
+    Create a suds client for a bundled wsdl file from the precompiled model. The client shares its model with other
+    clients created in the same thread.
+
+    @param wsdl: Which bundled wsdl file to load
+    @type wsdl: str
+    @param kwargs: Options passed on to suds.client.Client
+    @return: suds client
+    @rtype: suds.client.Client
+    """
+    template = template_client(wsdl)
+    # Like Client.clone(), but with fresh options instead of a deep copy of the template's. Deep copying linked suds
+    # options recurses endlessly on Python 3.11+.
+    client = Client.__new__(Client)
+    client.options = Options()
+    client.wsdl = template.wsdl
+    client.factory = template.factory
+    client.service = ServiceSelector(client, template.wsdl.services)
+    client.sd = template.sd
+    client.messages = dict(tx=None, rx=None)
+    # The transport goes first, options like 'headers' belong to it
+    client.set_options(transport=kwargs.pop('transport', None) or HttpAuthenticated())
+    client.set_options(**kwargs)
+    return client
+
+
+def build_models(location):
+    """
+    Parse all bundled wsdl files and store their models in a directory.
+
+    @param location: Directory to store the models in, created if missing
+    @type location: str
+    @return: Paths of the stored model files
+    @rtype: list
+    """
+    if not os.path.isdir(location):
+        os.makedirs(location)
+    paths = []
+    for wsdl in BUNDLED_WSDLS:
+        cache = ModelCache(wsdl, location)
+        bundled_client(wsdl, cache=cache, cachingpolicy=1)
+        paths.append(os.path.join(location, cache.filename))
+    return paths
+
+
+if __name__ == '__main__':
+    for model in build_models(sys.argv[1] if len(sys.argv) > 1 else os.path.join(PACKAGE_DIR, 'model')):
+        print(model)
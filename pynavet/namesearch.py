@@ -0,0 +1,244 @@
+"""
+This module implements "namnsokningXML" for the Swedish government population register service (NAVET)
+"""
+from pynavet.client import NavetClient
+from pynavet.plugins import get_transform
+from pynavet.xmlutil import etree_to_dict
+from pynavet.batch import imap_unordered
+from pynavet.envelope import get_template, send_envelope, parse_reply
+from logging import getLogger
+from lxml import etree
+from io import BytesIO
+import datetime
+import copy
+import itertools
+
+# Search argument names and the getData parts they map to
+ARGUMENTS = (
+    ('address', 'adress'),
+    ('surname', 'eftermellannamn'),
+    ('birth_date_from', 'fodelsetidFrom'),
+    ('birth_date_to', 'fodelsetidTom'),
+    ('given_name', 'fornamn'),
+    ('sex', 'kon'),
+    ('postal_code_from', 'postnummerFrom'),
+    ('postal_code_to', 'postnummerTom'),
+    ('city', 'postort'),
+)
+
+
+def split_postal_codes(start, end, parts):
+    """
+    Split an inclusive postal code range into at most 'parts' adjacent ranges.
+
+    @param start: First postal code, ie '10000'
+    @type start: str
+    @param end: Last postal code, ie '19999'
+    @type end: str
+    @param parts: Number of ranges
+    @type parts: int
+    @return: List of (start, end) tuples
+    @rtype: list
+    """
+    width = len(start)
+    return [('%0*d' % (width, low), '%0*d' % (width, high)) for low, high in _split(int(start), int(end), parts)]
+
+
+def split_birth_dates(start, end, parts):
+    """
+    Split an inclusive birth date range into at most 'parts' adjacent ranges.
+
+    @param start: First birth date, YYYYMMDD
+    @type start: str
+    @param end: Last birth date, YYYYMMDD
+    @type end: str
+    @param parts: Number of ranges
+    @type parts: int
+    @return: List of (start, end) tuples
+    @rtype: list
+    """
+    first = datetime.datetime.strptime(start, '%Y%m%d').date()
+    last = datetime.datetime.strptime(end, '%Y%m%d').date()
+    return [((first + datetime.timedelta(days=low)).strftime('%Y%m%d'),
+             (first + datetime.timedelta(days=high)).strftime('%Y%m%d'))
+            for low, high in _split(0, (last - first).days, parts)]
+
+
+def _split(low, high, parts):
+    count = high - low + 1
+    parts = max(1, min(parts, count))
+    bounds = [low + count * i // parts for i in range(parts + 1)]
+    return [(bounds[i], bounds[i + 1] - 1) for i in range(parts)]
+
+
+def iter_population_items(reply, as_xml=False):
+    """
+    Parse the document in a namnsokningXML getData reply incrementally, translating one person record at a time and
+    freeing it before the next one is parsed. The reply itself is held in memory as a whole.
+
+    @param reply: Raw SOAP reply
+    @type reply: bytes
+    @param as_xml: (optional) Yield translated XML strings instead of ordered dicts, default False
+    @type as_xml: bool
+    @return: Generator of translated 'PopulationItem' records
+    @raise WebFault: If the reply is a SOAP fault
+    """
+    document = parse_reply(reply)
+    if not document:
+        return
+    transform = get_transform()
+    # Characters outside latin-1 become character references, matching the document's declared encoding
+    data = BytesIO(document.encode('iso-8859-1', 'xmlcharrefreplace'))
+    for _, element in etree.iterparse(data, events=('end',), tag='Folkbokforingspost'):
+        # Transforming the element in place corrupts the partially parsed tree once processed elements are freed,
+        # transform a detached copy of the record instead
+        result = transform(copy.deepcopy(element))
+        if as_xml:
+            yield etree.tostring(result)
+        else:
+            yield etree_to_dict(result)['PopulationItem']
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+
+
+class NameSearch(NavetClient):
+    """
+    This class is used to search the Swedish population register by name, birth date, address, postal code, city and
+    sex.
+
+    The matching people are returned one at a time by a generator. Every reply is received as a whole, but its person
+    records are parsed, translated and converted as they are iterated, so the results of a search are never all held
+    as trees or dicts at once. Wide postal code and birth date ranges can be split into sub-queries sent concurrently,
+    which also keeps the size of each reply down.
+    """
+    def __init__(self, cert, key_file, order_id, use_cache=True, debug=False, **kwargs):
+        """
+        @param cert: Path to authentication client certificate in PEM format
+        @type cert: str
+        @param key_file: Path to key file in PEM format
+        @type key_file: str
+        @param order_id: Organisation number + Ordering ID ie (16XXXXXXXXXX XXXXXXXX-XXXX-XXXX)
+        @type order_id: str
+        @param use_cache: (Optional) Enable/Disable XSD caching in python-suds
+        @type use_cache: bool
+        @param debug: (Optional) Set to True to get some debug logging.
+        @type debug: bool
+        @param max_workers: (optional) Number of concurrent sub-queries, default 4
+        @type max_workers: int
+        @param url: (optional) Service URL endpoint, default the NAVET production endpoint
+        @type url: str
+        @param prebuilt_envelopes: (optional) Render requests from a precompiled envelope template instead of having
+        suds marshal every request, the requests sent are identical, default False
+        @type prebuilt_envelopes: bool
+        @param profiler: (optional) Profiler of a sample of the search requests, the results are parsed outside of
+        it as they are iterated, see pynavet.profiling
+        @type profiler: pynavet.profiling.SamplingProfiler
+        """
+        ws_url = kwargs.pop('url', 'https://www2.skatteverket.se/na/na_epersondata/services/namnsokningXML')
+        self.cert = cert
+        self.key_file = key_file
+        self.order_id = order_id
+        self.debug = debug
+        self.max_workers = kwargs.pop('max_workers', 4)
+        self.envelope = get_template('wsdl/namnsokningXML.wsdl') if kwargs.pop('prebuilt_envelopes', False) else None
+        self.logger = getLogger(__name__)
+        NavetClient.__init__(self, wsdl='wsdl/namnsokningXML.wsdl', cert=(cert, key_file), url=ws_url,
+                             use_cache=use_cache, **kwargs)
+
+    def _create_client(self, plugins, transport):
+        # Replies are parsed incrementally by iter_population_items instead of being unmarshalled by suds
+        client = NavetClient._create_client(self, plugins, transport)
+        client.set_options(retxml=True)
+        return client
+
+    def search(self, as_xml=False, split_postal_codes=1, split_birth_dates=1, **criteria):
+        """
+        Search for people matching all of the provided criteria.
+
+        @param given_name: (optional) Given name
+        @type given_name: str
+        @param surname: (optional) Middle or last name
+        @type surname: str
+        @param birth_date_from: (optional) First birth date, YYYYMMDD
+        @type birth_date_from: str
+        @param birth_date_to: (optional) Last birth date, YYYYMMDD
+        @type birth_date_to: str
+        @param postal_code_from: (optional) First postal code
+        @type postal_code_from: str
+        @param postal_code_to: (optional) Last postal code
+        @type postal_code_to: str
+        @param city: (optional) Postal city
+        @type city: str
+        @param address: (optional) Street address
+        @type address: str
+        @param sex: (optional) 'M' or 'K'
+        @type sex: str
+        @param as_xml: (optional) Yield translated XML strings instead of ordered dicts, default False
+        @type as_xml: bool
+        @param split_postal_codes: (optional) Split the postal code range into this many concurrent sub-queries
+        @type split_postal_codes: int
+        @param split_birth_dates: (optional) Split the birth date range into this many concurrent sub-queries
+        @type split_birth_dates: int
+        @return: Generator of translated 'PopulationItem' records, in no particular order when split. No request is
+        sent before the generator is iterated, faults and transport errors are raised from there.
+        @raise TypeError: If an unknown criterion is given
+        """
+        unknown = set(criteria) - set(name for name, _ in ARGUMENTS)
+        if unknown:
+            raise TypeError('Unknown search criteria: %s' % ', '.join(sorted(unknown)))
+        queries = self._split(criteria, split_postal_codes, split_birth_dates)
+        if len(queries) == 1:
+            return self._search_one(queries[0], as_xml)
+        return self._search_many(queries, as_xml)
+
+    def _search_one(self, query, as_xml):
+        for item in iter_population_items(self._fetch(query), as_xml):
+            yield item
+
+    def _search_many(self, queries, as_xml):
+        # Sub-queries are fetched by worker threads, replies are parsed in the calling thread as they arrive
+        for result in imap_unordered(self._fetch, queries, max_workers=self.max_workers):
+            if result.error is not None:
+                raise result.error
+            for item in iter_population_items(result.result, as_xml):
+                yield item
+
+    @staticmethod
+    def _split(criteria, postal_code_parts, birth_date_parts):
+        postal_codes = [(criteria.get('postal_code_from'), criteria.get('postal_code_to'))]
+        if postal_code_parts > 1 and None not in postal_codes[0]:
+            postal_codes = split_postal_codes(postal_codes[0][0], postal_codes[0][1], postal_code_parts)
+        birth_dates = [(criteria.get('birth_date_from'), criteria.get('birth_date_to'))]
+        if birth_date_parts > 1 and None not in birth_dates[0]:
+            birth_dates = split_birth_dates(birth_dates[0][0], birth_dates[0][1], birth_date_parts)
+        queries = []
+        for postal_code, birth_date in itertools.product(postal_codes, birth_dates):
+            query = dict(criteria)
+            query['postal_code_from'], query['postal_code_to'] = postal_code
+            query['birth_date_from'], query['birth_date_to'] = birth_date
+            queries.append(query)
+        return queries
+
+    def _fetch(self, criteria):
+        """
+        Send one search request.
+
+        @return: Raw SOAP reply
+        @rtype: bytes
+        """
+        arguments = dict((part, criteria.get(name)) for name, part in ARGUMENTS)
+        arguments['bestallningsid'] = self.order_id
+        if self.debug:
+            self.logger.debug("NAVET search: {!r}".format(criteria))
+        if self.instrumentation is not None:
+            self._begin_call()
+            with self.instrumentation.span('pynavet.search'):
+                return self._profiled(self._get_data, arguments)
+        return self._profiled(self._get_data, arguments)
+
+    def _get_data(self, arguments):
+        if self.envelope is not None:
+            args = [arguments.get(part) for part in self.envelope.parts]
+            return send_envelope(self.get_client(), self.envelope, *args)
+        return self.get_client().service.getData(**arguments)
@@ -2,26 +2,220 @@
 This module provides suds plugins.
 """
 from suds.plugin import MessagePlugin
-from suds.sudsobject import asdict
+from suds.sudsobject import Object
 from logging import getLogger
 from lxml import etree
 from pkg_resources import resource_filename
+from decimal import Decimal
+import threading
+import datetime
+import time
+import re
 
 LOG = getLogger(__name__)
 
+_XML_DECLARATION = re.compile(u'^\\s*<\\?xml[^>]*\\?>')
+
+text_type = type(u'')
+
+# Kinds of values handled by to_serializable, cached per type
+_OBJECT, _LIST, _DICT, _SCALAR = range(4)
+_kinds = {list: _LIST, tuple: _LIST, dict: _DICT}
+_json_converters = {}
+_MISSING = object()
+
+try:
+    _JSON_TYPES = frozenset((text_type, str, int, long, float, bool, type(None)))
+    _NUMBER_TYPES = (int, long, float)
+except NameError:
+    _JSON_TYPES = frozenset((text_type, int, float, bool, type(None)))
+    _NUMBER_TYPES = (int, float)
+
+_stylesheets = {}
+_stylesheets_lock = threading.Lock()
+_transforms = threading.local()
+
+
+def get_transform(name='addressdata.xsl'):
+    """
+    Get a compiled XSLT transform for one of the bundled stylesheets.
+
+    The stylesheet is parsed once per process and compiled once per thread, since lxml XSLT objects must not be
+    shared between threads.
+
+    @param name: File name of the stylesheet in the xslt directory
+    @type name: str
+    @return: Compiled stylesheet
+    @rtype: lxml.etree.XSLT
+    """
+    cache = getattr(_transforms, 'cache', None)
+    if cache is None:
+        cache = _transforms.cache = {}
+    transform = cache.get(name)
+    if transform is None:
+        with _stylesheets_lock:
+            xslt = _stylesheets.get(name)
+            if xslt is None:
+                xslt = _stylesheets[name] = etree.parse('%s/%s' % (resource_filename(__name__, 'xslt'), name))
+        transform = cache[name] = etree.XSLT(xslt)
+    return transform
+
+
+def translate(reply, transform_hook=None):
+    """
+    Parse a NAVET getData reply document, remove unneeded elements and translate the remaining ones to english.
+
+    Decoded documents are parsed as they are, without their XML declaration since its encoding no longer applies.
+    Undecoded documents are decoded by lxml according to the declaration.
+
+    @param reply: The getData return value
+    @type reply: unicode | bytes
+    @param transform_hook: (optional) Callable receiving the time in seconds spent in the XSLT transform
+    @type transform_hook: callable
+    @return: Translated document
+    @rtype: lxml.etree._XSLTResultTree
+    """
+    if isinstance(reply, bytes):
+        xml = etree.fromstring(reply)
+    else:
+        xml = etree.fromstring(_XML_DECLARATION.sub(u'', reply, 1))
+    transform = get_transform()
+    if transform_hook is None:
+        return transform(xml)
+    start = time.time()
+    result = transform(xml)
+    transform_hook(time.time() - start)
+    return result
+
+
+def timed_transform_hook(transform_hook=None, instrumentation=None):
+    """
+    Combine a transform hook with reporting the transform time as 'pynavet.xslt'.
+
+    @param transform_hook: (optional) Callable receiving the time in seconds spent in the XSLT transform
+    @type transform_hook: callable
+    @param instrumentation: (optional) Receiver of the XSLT transform timing
+    @type instrumentation: pynavet.instrumentation.Instrumentation
+    @return: Transform hook to pass to translate
+    @rtype: callable | None
+    """
+    if instrumentation is None:
+        return transform_hook
+
+    def hook(seconds):
+        instrumentation.timing('pynavet.xslt', seconds)
+        if transform_hook is not None:
+            transform_hook(seconds)
+    return hook
+
+
+def _kind(cls):
+    kind = _kinds.get(cls)
+    if kind is None:
+        if issubclass(cls, Object):
+            kind = _OBJECT
+        elif issubclass(cls, (list, tuple)):
+            kind = _LIST
+        elif issubclass(cls, dict):
+            kind = _DICT
+        else:
+            kind = _SCALAR
+        _kinds[cls] = kind
+    return kind
+
+
+def _json_converter(cls):
+    """
+    @return: Function converting values of a type to one json.dumps accepts, None if they already are
+    """
+    if cls in _JSON_TYPES:
+        converter = None
+    elif issubclass(cls, text_type):
+        # suds Text and other string subclasses
+        converter = text_type
+    elif issubclass(cls, bytes):
+        converter = _decode
+    elif issubclass(cls, (datetime.date, datetime.time)):
+        converter = cls.isoformat
+    elif issubclass(cls, _NUMBER_TYPES) and not issubclass(cls, Decimal):
+        converter = None
+    else:
+        converter = text_type
+    _json_converters[cls] = converter
+    return converter
+
+
+def _decode(value):
+    return value.decode('utf-8')
+
+
+def to_serializable(value, json_ready=False):
+    """
+    Convert suds objects to dicts, the containers in them to lists and dicts, and leave other values as they are.
+
+    The conversion is iterative so deeply nested values don't hit the recursion limit, and the handling of every type
+    is looked up once and cached.
+
+    @param value: Value to convert, typically a suds object
+    @param json_ready: (optional) Also convert the values to types json.dumps accepts: strings to plain unicode,
+    bytes decoded from UTF-8, dates and times to ISO 8601, Decimal and unknown types to strings. Default False
+    @type json_ready: bool
+    @return: The converted value
+    """
+    kinds = _kinds
+    converters = _json_converters
+    root = [None]
+    # Containers to fill in and the (key, value) items to fill them with
+    pending = [(root, [(0, value)])]
+    while pending:
+        out, items = pending.pop()
+        for key, item in items:
+            # type() of instances of the old-style suds 0.4 classes is InstanceType
+            cls = item.__class__
+            kind = kinds.get(cls)
+            if kind is None:
+                kind = _kind(cls)
+            if kind == _SCALAR:
+                if json_ready:
+                    convert = converters.get(cls, _MISSING)
+                    if convert is _MISSING:
+                        convert = _json_converter(cls)
+                    if convert is not None:
+                        item = convert(item)
+                out[key] = item
+                continue
+            if kind == _OBJECT:
+                fields = item.__dict__
+                children = [(name, fields[name]) for name in item.__keylist__]
+                container = {}
+            elif kind == _DICT:
+                children = list(item.items())
+                container = {}
+            else:
+                children = enumerate(item)
+                container = [None] * len(item)
+            out[key] = container
+            pending.append((container, children))
+    return root[0]
+
 
 class SerializablePlugin(MessagePlugin):
     """
     This class is a suds plugin that convert all suds results into serializable format.
     """
+    def __init__(self, json_ready=False):
+        """
+        @param json_ready: (optional) Convert the results to types json.dumps accepts, see to_serializable
+        @type json_ready: bool
+        """
+        self.json_ready = json_ready
+
     def unmarshalled(self, context):
         if isinstance(context.reply, list) and len(context.reply) > 0:
             LOG.debug("context.reply list size %s", len(context.reply))
-            reply = []
-            for item in context.reply:
-                reply.append(self._recursive_asdict(item))
-        elif isinstance(context.reply, dict):
-            reply = self._recursive_asdict(context.reply)
+            reply = to_serializable(context.reply, self.json_ready)
+        elif isinstance(context.reply, (dict, Object)):
+            reply = to_serializable(context.reply, self.json_ready)
         else:
             reply = context.reply
 
@@ -31,20 +225,7 @@ class SerializablePlugin(MessagePlugin):
         """
         Convert Suds object into serializable format.
         """
-        out = {}
-        for key, val in asdict(suds_dict).iteritems():
-            if hasattr(val, '__keylist__'):
-                out[key] = self._recursive_asdict(val)
-            elif isinstance(val, list):
-                out[key] = []
-                for item in val:
-                    if hasattr(item, '__keylist__'):
-                        out[key].append(self._recursive_asdict(item))
-                    else:
-                        out[key].append(item)
-            else:
-                out[key] = val
-        return out
+        return to_serializable(suds_dict, self.json_ready)
 
 
 class MarshallXMLData(MessagePlugin):
@@ -52,12 +233,44 @@ class MarshallXMLData(MessagePlugin):
     This class marshall the received data from NAVET by removing unneeded attributes from the XML, translate remaining
     attributes to english, then converts the XML into a python dict.
     """
+    def __init__(self, transform_hook=None, as_tree=False, instrumentation=None):
+        """
+        @param transform_hook: (optional) Callable receiving the time in seconds spent in the XSLT transform
+        @type transform_hook: callable
+        @param as_tree: (optional) Leave the transformed lxml tree as reply instead of serializing it, default False
+        @type as_tree: bool
+        @param instrumentation: (optional) Receiver of the XSLT transform timing
+        @type instrumentation: pynavet.instrumentation.Instrumentation
+        """
+        self.transform_hook = timed_transform_hook(transform_hook, instrumentation)
+        self.as_tree = as_tree
+
     def unmarshalled(self, context):
-        xslt_dir = resource_filename(__name__, 'xslt')
-        xslt = etree.parse('%s/addressdata.xsl' % xslt_dir)
-        try:
-            xml = etree.fromstring(context.reply.encode('iso-8859-1'))
-        except etree.XMLSyntaxError:  # XMLSyntaxError: Input is not proper UTF-8, indicate encoding !
-            xml = etree.fromstring(context.reply.encode('UTF-8'))
-        transform = etree.XSLT(xslt)
-        context.reply = etree.tostring(transform(xml))
+        result = translate(context.reply, self.transform_hook)
+        context.reply = result if self.as_tree else etree.tostring(result)
+
+
+class InstrumentationPlugin(MessagePlugin):
+    """
+    This class is a suds plugin reporting the time spent building request envelopes. Call begin() right before
+    invoking a service method.
+    """
+    def __init__(self, instrumentation):
+        """
+        @param instrumentation: Receiver of the envelope timing
+        @type instrumentation: pynavet.instrumentation.Instrumentation
+        """
+        self.instrumentation = instrumentation
+        self._local = threading.local()
+
+    def begin(self):
+        """
+        Mark the start of a service method invocation in the calling thread.
+        """
+        self._local.start = time.time()
+
+    def sending(self, context):
+        start = getattr(self._local, 'start', None)
+        if start is not None:
+            self.instrumentation.timing('pynavet.envelope', time.time() - start)
+            self._local.start = None
@@ -2,7 +2,13 @@
 This module implements "personpostXML" for the Swedish government population register service (NAVET)
 """
 from pynavet.client import NavetClient
-from pynavet.plugins import MarshallXMLData
+from pynavet.plugins import MarshallXMLData, translate, timed_transform_hook
+from pynavet.envelope import get_template, send_envelope, post_envelope
+from pynavet.records import Person
+from pynavet.xmlutil import LazyDict
+from pynavet.batch import imap_unordered
+from pynavet.resilience import CircuitOpenError
+from pynavet.coalesce import SingleFlight
 from suds import WebFault
 from xmltodict import parse as xmltodict
 from lxml import etree
@@ -10,6 +16,84 @@ from logging import getLogger
 from collections import OrderedDict
 import pprint
 
+PERSON_PATH = 'PopulationItems/PopulationItem/PersonItem'
+
+
+def find_person(data):
+    """
+    Get the 'PersonItem' object from looked up data.
+
+    @param data: Results of get_all_data(identity_number, as_xml=False)
+    @type data: OrderedDict | pynavet.xmlutil.LazyDict | pynavet.records.Person | None
+    @return: Person data
+    @rtype: OrderedDict | pynavet.records.Person
+    @raise KeyError: If there is no person in the data
+    """
+    if data is None:
+        raise KeyError('PersonItem')
+    if isinstance(data, Person):
+        return data
+    if isinstance(data, LazyDict):
+        # Only the fields the caller uses get converted
+        person = data.find(PERSON_PATH)
+        if person is None:
+            raise KeyError('PersonItem')
+        return person
+    return data['NavetNotifications']['PopulationItems']['PopulationItem']['PersonItem']
+
+
+def select_official_address(person):
+    """
+    @param person: Person data, see find_person
+    @type person: OrderedDict | pynavet.records.Person
+    @return: The official postal address, as returned by get_official_address
+    @raise KeyError: If the person has no official address
+    """
+    if isinstance(person, Person):
+        return person.official_address
+    return OrderedDict([(u'OfficialAddress', person['PostalAddresses']['OfficialAddress']),
+                        ])
+
+
+def select_name(person):
+    """
+    @param person: Person data, see find_person
+    @type person: OrderedDict | pynavet.records.Person
+    @return: The name, as returned by get_name
+    @raise KeyError: If the person has no name
+    """
+    if isinstance(person, Person):
+        return person.name
+    return OrderedDict([(u'Name', person['Name']),
+                        ])
+
+
+def select_name_and_official_address(person):
+    """
+    @param person: Person data, see find_person
+    @type person: OrderedDict | pynavet.records.Person
+    @return: The name and the official postal address, as returned by get_name_and_official_address
+    @raise KeyError: If the person has no name or official address
+    """
+    if isinstance(person, Person):
+        return person.name, person.official_address
+    return OrderedDict([(u'Name', person['Name']),
+                        (u'OfficialAddress', person['PostalAddresses']['OfficialAddress']),
+                        ])
+
+
+def select_relations(person):
+    """
+    @param person: Person data, see find_person
+    @type person: OrderedDict | pynavet.records.Person
+    @return: The relations, as returned by get_relations
+    @raise KeyError: If the person has no relations
+    """
+    if isinstance(person, Person):
+        return person.relations
+    return OrderedDict([(u'Relations', person['Relations']),
+                        ])
+
 
 class PostalAddress(NavetClient):
     """
@@ -29,17 +113,56 @@ class PostalAddress(NavetClient):
         @type debug: bool
         @param verify: (optional) Whether to verify SSL endpoint certificate or not, default True
         @type verify: bool
+        @param timeout: (optional) Connect and read timeout in seconds, float or tuple (connect, read)
+        @type timeout: float | tuple
+        @param pool_maxsize: (optional) Max number of kept-alive connections, see CertAuthTransport for more options
+        @type pool_maxsize: int
+        @param transform_hook: (optional) Callable receiving the XSLT transform time in seconds for every reply
+        @type transform_hook: callable
+        @param result_cache: (optional) Cache for parsed person records, see pynavet.cache
+        @type result_cache: pynavet.cache.ResultCache
+        @param instrumentation: (optional) Receiver of timings and counters, see pynavet.instrumentation
+        @type instrumentation: pynavet.instrumentation.Instrumentation
+        @param url: (optional) Service URL endpoint, default the NAVET production endpoint
+        @type url: str
+        @param records: (optional) Return compact pynavet.records objects instead of dicts, default False
+        @type records: bool
+        @param coalesce: (optional) Share one request between concurrent lookups of the same identity number, the
+        callers then get the same result object which must not be modified, default False
+        @type coalesce: bool
+        @param retries: (optional) Number of retries of failed requests, see CertAuthTransport for backoff and hedging
+        @type retries: int
+        @param circuit_breaker: (optional) Fail fast while NAVET is down, serving the last known value from
+        result_cache if there is one, see pynavet.resilience
+        @type circuit_breaker: pynavet.resilience.CircuitBreaker
+        @param raw_replies: (optional) Send requests rendered from the precompiled envelope template straight with the
+        transport and parse the reply bytes with lxml, bypassing suds and its plugins, default False
+        @type raw_replies: bool
+        @param prebuilt_envelopes: (optional) Render requests from a precompiled envelope template instead of having
+        suds marshal every request, the requests sent are identical, default False
+        @type prebuilt_envelopes: bool
+        @param profiler: (optional) Profiler of a sample of the lookups, see pynavet.profiling
+        @type profiler: pynavet.profiling.SamplingProfiler
         """
-        ws_url = 'https://www2.skatteverket.se/na/na_epersondata/services/personpostXML'
+        ws_url = kwargs.pop('url', 'https://www2.skatteverket.se/na/na_epersondata/services/personpostXML')
         self.cert = cert
         self.key_file = key_file
         self.order_id = order_id
         self.debug = debug
         self.logger = getLogger(__name__)
+        self.result_cache = kwargs.pop('result_cache', None)
+        self.records = kwargs.pop('records', False)
+        coalesce = kwargs.pop('coalesce', False)
+        transform_hook = kwargs.pop('transform_hook', None)
+        self.raw_replies = kwargs.pop('raw_replies', False)
+        prebuilt_envelopes = kwargs.pop('prebuilt_envelopes', False)
+        self.envelope = get_template('wsdl/personpostXML.wsdl') if prebuilt_envelopes or self.raw_replies else None
         NavetClient.__init__(self, wsdl='wsdl/personpostXML.wsdl', cert=(cert, key_file), url=ws_url,
                              use_cache=use_cache, **kwargs)
-        # This plugin translates all (known) XML-tags from Swedish to English
-        self.load_plugin(MarshallXMLData)
+        self.single_flight = SingleFlight(self.instrumentation) if coalesce else None
+        self.transform_hook = timed_transform_hook(transform_hook, self.instrumentation)
+        # This plugin translates all (known) XML-tags from Swedish to English and hands us the resulting lxml tree
+        self.load_plugin(MarshallXMLData, transform_hook, True, self.instrumentation)
 
     def get_all_data(self, identity_number, as_xml=False):
         """
@@ -49,22 +172,169 @@ class PostalAddress(NavetClient):
         @type identity_number: str
         @param as_xml: If 'True' return the data as XML, if 'False' return data as an ordered dict (default: False)
         @type as_xml: bool
-        @return: Navet data, either as XML string or parsed (ordered) dict.
+        @return: Navet data, either as XML string, parsed (ordered) dict or a pynavet.records.Person in records mode.
+        """
+        return self._profiled(self._lookup, identity_number, as_xml)
+
+    def _lookup(self, identity_number, as_xml):
+        if as_xml:
+            return self._call(identity_number, True)
+        result = self._get_document(identity_number)
+        if isinstance(result, LazyDict):
+            result = self._to_dict(result)
+        return result
+
+    def _get_document(self, identity_number):
+        """
+        Get the (cached) parsed data for a national identity number. Unless records are enabled it is a LazyDict,
+        converted to dicts only as far as it is used.
+
+        @rtype: pynavet.xmlutil.LazyDict | pynavet.records.Person | OrderedDict
+        """
+        use_cache = self.result_cache is not None
+        if use_cache:
+            result = self.result_cache.get(identity_number)
+            if result is not None:
+                return result
+        try:
+            result = self._call(identity_number, False)
+        except CircuitOpenError:
+            if use_cache:
+                result = self.result_cache.get_stale(identity_number)
+                if result is not None:
+                    self.logger.warning("NAVET circuit breaker is open, returning stale data")
+                    return result
+            raise
+        if use_cache:
+            self.result_cache.set(identity_number, result)
+        return result
+
+    def _to_dict(self, document):
         """
+        Fully convert a LazyDict document, like xmltodict would.
+        """
+        if self.instrumentation is not None and not document.converted:
+            with self.instrumentation.span('pynavet.dict'):
+                return OrderedDict([(document.name, document.to_dict())])
+        return OrderedDict([(document.name, document.to_dict())])
+
+    def _call(self, identity_number, as_xml):
+        if self.single_flight is not None:
+            return self.single_flight.do((identity_number, as_xml), self._call_upstream, identity_number, as_xml)
+        return self._call_upstream(identity_number, as_xml)
+
+    def _call_upstream(self, identity_number, as_xml):
+        if self.instrumentation is not None:
+            with self.instrumentation.span('pynavet.call'):
+                return self._get_all_data(identity_number, as_xml)
+        return self._get_all_data(identity_number, as_xml)
+
+    def _get_all_data(self, identity_number, as_xml):
+        instrumentation = self.instrumentation
         try:
-            result = self.client.service.getData(self.order_id, identity_number)
-            if not as_xml:
+            if self.raw_replies:
+                result = self._post_raw(identity_number)
+                if result is None:
+                    return None
+                result = translate(result, self.transform_hook)
+            else:
+                if instrumentation is not None:
+                    self._begin_call()
+                if self.envelope is not None:
+                    result = send_envelope(self.get_client(), self.envelope, self.order_id, identity_number)
+                else:
+                    result = self.get_client().service.getData(self.order_id, identity_number)
+            if self.records and not as_xml:
+                if not isinstance(result, etree._ElementTree):
+                    result = translate(result)
+                result = Person.from_tree(result)
+            elif isinstance(result, etree._ElementTree):
+                if as_xml:
+                    result = etree.tostring(result)
+                else:
+                    result = LazyDict(result.getroot())
+            elif not as_xml:
                 result = xmltodict(result)
             if self.debug:
-                self.logger.debug("NAVET get_all_data lookup result:\n{!r}".format(result))
+                self.logger.debug("NAVET get_all_data lookup result:\n{!r}".format(
+                    dict(result) if isinstance(result, LazyDict) else result))
             return result
         except WebFault as e:
-            self.logger.error(e.message)  # TODO: Add translation for exceptions
+            if instrumentation is not None:
+                instrumentation.count('pynavet.faults')
+            self.logger.error(e.args[0])  # TODO: Add translation for exceptions
             raise
         except:
+            if instrumentation is not None:
+                instrumentation.count('pynavet.errors')
             self.logger.error("Unexpected error.")
             raise
 
+    def _post_raw(self, identity_number):
+        """
+        Send a getData request with the transport and parse the reply bytes once with lxml. suds only provides the
+        transport and its options.
+
+        @return: The NAVET document, None if the reply has none
+        @rtype: unicode | None
+        """
+        if self.instrumentation is not None:
+            with self.instrumentation.span('pynavet.envelope'):
+                envelope = self.envelope.render(self.order_id, identity_number)
+        else:
+            envelope = self.envelope.render(self.order_id, identity_number)
+        return post_envelope(self.get_client(), self.envelope, envelope)
+
+    def get_all_data_many(self, identity_numbers, max_workers=4, rate_limit=None):
+        """
+        Get all data for several national identity numbers using a pool of threads sharing the pooled transport.
+
+        @param identity_numbers: The national identity numbers to lookup
+        @type identity_numbers: iterable
+        @param max_workers: (optional) Number of concurrent lookups, default 4
+        @type max_workers: int
+        @param rate_limit: (optional) Max number of lookups per second
+        @type rate_limit: int | float
+        @return: Generator of pynavet.batch.BatchResult(identity_number, result, error) in completion order
+        """
+        return imap_unordered(self.get_all_data, identity_numbers, max_workers=max_workers, rate_limit=rate_limit)
+
+    def get_official_address_many(self, identity_numbers, max_workers=4, rate_limit=None):
+        """
+        Batch version of get_official_address, see get_all_data_many.
+        """
+        return imap_unordered(self.get_official_address, identity_numbers, max_workers=max_workers,
+                              rate_limit=rate_limit)
+
+    def get_name_many(self, identity_numbers, max_workers=4, rate_limit=None):
+        """
+        Batch version of get_name, see get_all_data_many.
+        """
+        return imap_unordered(self.get_name, identity_numbers, max_workers=max_workers, rate_limit=rate_limit)
+
+    def get_name_and_official_address_many(self, identity_numbers, max_workers=4, rate_limit=None):
+        """
+        Batch version of get_name_and_official_address, see get_all_data_many.
+        """
+        return imap_unordered(self.get_name_and_official_address, identity_numbers, max_workers=max_workers,
+                              rate_limit=rate_limit)
+
+    def get_relations_many(self, identity_numbers, max_workers=4, rate_limit=None):
+        """
+        Batch version of get_relations, see get_all_data_many.
+        """
+        return imap_unordered(self.get_relations, identity_numbers, max_workers=max_workers, rate_limit=rate_limit)
+
+    def invalidate(self, identity_number):
+        """
+        Remove any cached data for the provided national identity number.
+
+        @param identity_number: The national identity number
+        @type identity_number: str
+        """
+        if self.result_cache is not None:
+            self.result_cache.invalidate(identity_number)
+
     def get_official_address(self, identity_number, data=None):
         """
         Retrieve the official postal address for the provided national identity number from the Swedish population
@@ -73,12 +343,10 @@ class PostalAddress(NavetClient):
         @param identity_number: The national identity number to lookup
         @type identity_number: str
         @param data: Results previously fetched with get_all_data(identity_number, as_xml=False) (optional)
-        @type data: OrderedDict | None
+        @type data: OrderedDict | pynavet.records.Person | None
         """
         try:
-            person = self._get_person(identity_number, data)
-            result = OrderedDict([(u'OfficialAddress', person['PostalAddresses']['OfficialAddress']),
-                                  ])
+            result = select_official_address(self._get_person(identity_number, data))
         except KeyError:
             self.logger.exception("NAVET address lookup failure")
             result = False
@@ -94,12 +362,10 @@ class PostalAddress(NavetClient):
         @param identity_number: The national identity number to lookup
         @type identity_number: str
         @param data: Results previously fetched with get_all_data(identity_number, as_xml=False) (optional)
-        @type data: OrderedDict | None
+        @type data: OrderedDict | pynavet.records.Person | None
         """
         try:
-            person = self._get_person(identity_number, data)
-            result = OrderedDict([(u'Name', person['Name']),
-                                  ])
+            result = select_name(self._get_person(identity_number, data))
         except KeyError:
             self.logger.exception("NAVET get_name lookup failure")
             result = False
@@ -115,13 +381,10 @@ class PostalAddress(NavetClient):
         @param identity_number: The national identity number to lookup
         @type identity_number: str
         @param data: Results previously fetched with get_all_data(identity_number, as_xml=False) (optional)
-        @type data: OrderedDict | None
+        @type data: OrderedDict | pynavet.records.Person | None
         """
         try:
-            person = self._get_person(identity_number, data)
-            result = OrderedDict([(u'Name', person['Name']),
-                                  (u'OfficialAddress', person['PostalAddresses']['OfficialAddress']),
-                                  ])
+            result = select_name_and_official_address(self._get_person(identity_number, data))
         except KeyError:
             self.logger.exception("NAVET get_name_and_official_address lookup failure")
             result = False
@@ -137,12 +400,10 @@ class PostalAddress(NavetClient):
         @param identity_number: The national identity number to lookup
         @type identity_number: str
         @param data: Results previously fetched with get_all_data(identity_number, as_xml=False) (optional)
-        @type data: OrderedDict | None
+        @type data: OrderedDict | pynavet.records.Person | None
         """
         try:
-            person = self._get_person(identity_number, data)
-            result = OrderedDict([(u'Relations', person['Relations']),
-                                  ])
+            result = select_relations(self._get_person(identity_number, data))
         except KeyError:
             self.logger.exception("NAVET get_relations lookup failure")
             result = False
@@ -157,17 +418,16 @@ class PostalAddress(NavetClient):
         @param identity_number: The national identity number to lookup
         @type identity_number: str
         @param data: Results previously fetched with get_all_data(identity_number, as_xml=False) (optional)
-        @type data: OrderedDict | None
+        @type data: OrderedDict | pynavet.records.Person | None
         @return: Person data
-        @rtype: OrderedDict
+        @rtype: OrderedDict | pynavet.records.Person
         """
         # Only enable this excessive logging when really needed.
         #if self.debug:
         #    self.logger.debug("NAVET get_name_and_official_address parsing:\n{!s}".format(pprint.pformat(data)))
         try:
             if data is None:
-                data = self.get_all_data(identity_number, as_xml=False)
-            person = data['NavetNotifications']['PopulationItems']['PopulationItem']['PersonItem']
-            return person
+                data = self._profiled(self._get_document, identity_number)
+            return find_person(data)
         except WebFault as e:
             raise e
@@ -0,0 +1,390 @@
+"""
+This module provides a pool of worker processes for large batches of NAVET lookups.
+
+The XSLT translation and the conversion of replies to dicts are CPU bound and hold the GIL, so threads stop scaling
+after a few cores. ProcessPool forks worker processes that each build their own PostalAddress, with its own suds
+client, connection pool and compiled XSLT, and hands them chunks of identity numbers.
+
+    with ProcessPool(cert, key_file, order_id, processes=8, method='get_name') as pool:
+        for result in pool.imap(identity_numbers):
+            ...
+
+Workers are created with fork and are Unix only.
+"""
+from pynavet.batch import BatchResult
+from pynavet.postaladdress import PostalAddress
+from pynavet import envelope, model, plugins
+from collections import deque
+from logging import getLogger
+import multiprocessing
+import threading
+import select
+import signal
+import stat
+import os
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+LOG = getLogger(__name__)
+
+try:
+    _context = multiprocessing.get_context('fork')
+except (AttributeError, ValueError):
+    _context = multiprocessing
+
+
+class WorkerCrashedError(Exception):
+    """
+    The worker process doing the lookup exited unexpectedly, ie it was killed or crashed.
+    """
+
+
+class RemoteError(Exception):
+    """
+    An exception raised in a worker process that could not be sent back as is.
+    """
+
+
+def _reset_after_fork():
+    """
+    Replace module locks that another thread of the parent may have held while forking, and drop the compiled XSLT
+    transforms inherited from the forking thread.
+    """
+    plugins._stylesheets_lock = threading.Lock()
+    plugins._transforms = threading.local()
+    model._models_lock = threading.Lock()
+    model._templates = threading.local()
+    envelope._templates_lock = threading.Lock()
+
+
+def _portable(error):
+    """
+    @return: The exception, or a RemoteError in its place if it can't be pickled and unpickled, ie an exception whose
+    constructor takes other arguments than it keeps in 'args' like suds TransportError
+    @rtype: Exception
+    """
+    try:
+        pickle.loads(pickle.dumps(error, pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return RemoteError('%s: %s' % (type(error).__name__, error))
+    return error
+
+
+def _dumps(results):
+    """
+    Pickle chunk results, replacing exceptions and results that can't be pickled.
+    """
+    results = [(index, result if result.error is None else result._replace(error=_portable(result.error)))
+               for index, result in results]
+    try:
+        return pickle.dumps(results, pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        safe = []
+        for index, result in results:
+            try:
+                pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+            except Exception as e:
+                error = result.error if result.error is not None else e
+                result = BatchResult(result.identity_number, None,
+                                     RemoteError('%s: %s' % (type(error).__name__, error)))
+            safe.append((index, result))
+        return pickle.dumps(safe, pickle.HIGHEST_PROTOCOL)
+
+
+def _worker(tasks, results, inherited, cert, key_file, order_id, method, threads, kwargs):
+    """
+    Worker process main loop: receive chunks of (index, identity number) and send back (index, BatchResult) lists.
+    """
+    for connection in inherited:
+        connection.close()
+    # Interrupts are handled by the parent, which stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _reset_after_fork()
+    try:
+        navet = PostalAddress(cert, key_file, order_id, **kwargs)
+        plugins.get_transform()
+        lookup = getattr(navet, method)
+    except Exception as e:
+        LOG.exception("Could not start NAVET worker process")
+        results.send_bytes(pickle.dumps(('error', RemoteError('%s: %s' % (type(e).__name__, e)))))
+        return
+
+    if threads > 1:
+        # The threads live as long as the process, so their suds clients are created once
+        items_queue = Queue()
+        done_queue = Queue()
+
+        def lookup_thread():
+            while True:
+                index, identity_number = items_queue.get()
+                try:
+                    done_queue.put((index, BatchResult(identity_number, lookup(identity_number), None)))
+                except BaseException as e:
+                    done_queue.put((index, BatchResult(identity_number, None, e)))
+
+        for _ in range(threads):
+            thread = threading.Thread(target=lookup_thread)
+            thread.daemon = True
+            thread.start()
+
+    while True:
+        try:
+            task = tasks.recv_bytes()
+        except EOFError:
+            return
+        chunk_id, items = pickle.loads(task)
+        done = []
+        if threads > 1:
+            for item in items:
+                items_queue.put(item)
+            done = [done_queue.get() for _ in items]
+        else:
+            for index, identity_number in items:
+                try:
+                    done.append((index, BatchResult(identity_number, lookup(identity_number), None)))
+                except Exception as e:
+                    done.append((index, BatchResult(identity_number, None, e)))
+        try:
+            results.send_bytes(pickle.dumps(('results', (chunk_id, _dumps(done)))))
+        except (IOError, OSError):
+            # The parent stopped listening
+            return
+
+
+class _Worker(object):
+    __slots__ = ('process', 'tasks', 'results', 'chunks')
+
+    def __init__(self, process, tasks, results):
+        self.process = process
+        self.tasks = tasks
+        self.results = results
+        # Chunk ids sent to the worker and not yet answered, in the order the worker processes them
+        self.chunks = deque()
+
+
+class ProcessPool(object):
+    """
+    Pool of worker processes doing PostalAddress lookups.
+
+    A worker that dies fails the lookups of the chunk it was working on with WorkerCrashedError and is replaced, the
+    chunks queued for it are handed to other workers. Exceptions raised by lookups are returned in the BatchResults;
+    exceptions that can't be pickled and unpickled are returned as RemoteError.
+
+    The certificate and key are only passed on as paths and read by the workers. A pool must not be iterated by more
+    than one thread at a time.
+    """
+    def __init__(self, cert, key_file, order_id, processes=None, threads=1, chunksize=16, method='get_all_data',
+                 **kwargs):
+        """
+        @param cert: Path to authentication client certificate in PEM format
+        @type cert: str
+        @param key_file: Path to key file in PEM format
+        @type key_file: str
+        @param order_id: Organisation number + Ordering ID ie (16XXXXXXXXXX XXXXXXXX-XXXX-XXXX)
+        @type order_id: str
+        @param processes: (optional) Number of worker processes, default the number of CPUs
+        @type processes: int
+        @param threads: (optional) Concurrent lookups in every worker process, default 1
+        @type threads: int
+        @param chunksize: (optional) Identity numbers sent to a worker at a time, default 16
+        @type chunksize: int
+        @param method: (optional) PostalAddress method to call for every identity number, default 'get_all_data'
+        @type method: str
+        @param kwargs: Options passed on to PostalAddress in the workers, ie records=True. Objects such as
+        instrumentation or result_cache are copied into every worker and not shared.
+        @raise IOError: If the certificate or key file can't be read
+        """
+        for path in (cert, key_file):
+            if path:
+                # Fail here rather than in every worker
+                with open(path, 'rb'):
+                    pass
+        if key_file and os.stat(key_file).st_mode & (stat.S_IRWXG | stat.S_IRWXO):
+            LOG.warning("Key file %s is readable by other users", key_file)
+        if not hasattr(PostalAddress, method):
+            raise AttributeError('PostalAddress has no method %r' % method)
+        self.cert = cert
+        self.key_file = key_file
+        self.order_id = order_id
+        self.processes = processes or multiprocessing.cpu_count()
+        self.threads = threads
+        self.chunksize = chunksize
+        self.method = method
+        self.kwargs = kwargs
+        self.crashes = 0
+        self._workers = []
+        self._chunk_id = 0
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _start_worker(self):
+        tasks_read, tasks_write = _context.Pipe(duplex=False)
+        results_read, results_write = _context.Pipe(duplex=False)
+        # The child must not hold on to the parent ends of other workers' pipes, or their EOFs would never arrive
+        inherited = [tasks_write, results_read]
+        for worker in self._workers:
+            inherited.extend((worker.tasks, worker.results))
+        process = _context.Process(target=_worker,
+                                   args=(tasks_read, results_write, inherited, self.cert, self.key_file,
+                                         self.order_id, self.method, self.threads, self.kwargs))
+        process.daemon = True
+        process.start()
+        tasks_read.close()
+        results_write.close()
+        worker = _Worker(process, tasks_write, results_read)
+        self._workers.append(worker)
+        return worker
+
+    def _stop_worker(self, worker):
+        self._workers.remove(worker)
+        worker.tasks.close()
+        worker.results.close()
+        worker.process.join(1)
+        if worker.process.is_alive():
+            worker.process.terminate()
+            worker.process.join()
+
+    def imap(self, identity_numbers, ordered=False):
+        """
+        Look up identity numbers in the worker processes, started on first use.
+
+        The input is consumed lazily, at most two chunks per worker are in flight at any time. In input order no new
+        chunk is sent while 2 * processes chunks are not yet yielded, so a stalled chunk doesn't buffer the input.
+
+        @param identity_numbers: National identity numbers to lookup
+        @type identity_numbers: iterable
+        @param ordered: (optional) Yield results in input order instead of completion order, default False
+        @type ordered: bool
+        @return: Generator of pynavet.batch.BatchResult
+        @raise RemoteError: If the workers could not create their PostalAddress
+        """
+        if self._closed:
+            raise ValueError('ProcessPool is closed')
+        while len(self._workers) < self.processes:
+            self._start_worker()
+
+        chunks = {}
+        retry = deque()
+        broken = set()
+        finished = {}
+        next_index = [0]
+        window = 2 * self.processes
+        source = enumerate(identity_numbers)
+
+        def dispatch():
+            while True:
+                workers = [w for w in self._workers if w not in broken]
+                if not workers:
+                    return
+                worker = min(workers, key=lambda w: len(w.chunks))
+                if len(worker.chunks) >= 2:
+                    return
+                if retry:
+                    chunk_id = retry.popleft()
+                elif ordered and chunks and self._chunk_id - min(chunks) + 1 >= window:
+                    return
+                else:
+                    items = [item for _, item in zip(range(self.chunksize), source)]
+                    if not items:
+                        return
+                    self._chunk_id += 1
+                    chunk_id = self._chunk_id
+                    chunks[chunk_id] = items
+                try:
+                    worker.tasks.send_bytes(pickle.dumps((chunk_id, chunks[chunk_id]), pickle.HIGHEST_PROTOCOL))
+                except (IOError, OSError):
+                    # The worker died, its EOF is handled by the loop below
+                    broken.add(worker)
+                    retry.appendleft(chunk_id)
+                    continue
+                worker.chunks.append(chunk_id)
+
+        def emit(results):
+            if not ordered:
+                return [result for _, result in results]
+            finished.update(results)
+            ready = []
+            while next_index[0] in finished:
+                ready.append(finished.pop(next_index[0]))
+                next_index[0] += 1
+            return ready
+
+        while True:
+            dispatch()
+            if not chunks:
+                return
+            readable, _, _ = select.select([worker.results for worker in self._workers], [], [])
+            for connection in readable:
+                worker = [w for w in self._workers if w.results is connection][0]
+                try:
+                    kind, payload = pickle.loads(connection.recv_bytes())
+                except (EOFError, IOError, OSError):
+                    for result in emit(self._crashed(worker, chunks, retry)):
+                        yield result
+                    continue
+                if kind == 'error':
+                    self.close()
+                    raise payload
+                chunk_id, data = payload
+                worker.chunks.remove(chunk_id)
+                # Chunks of an abandoned earlier imap are no longer known
+                items = chunks.pop(chunk_id, None)
+                if items is not None:
+                    for result in emit(self._loads(data, items)):
+                        yield result
+
+    @staticmethod
+    def _loads(data, items):
+        """
+        Unpickle chunk results, failing the lookups of the chunk with RemoteError if that fails.
+
+        @return: (index, BatchResult) for the lookups of the chunk
+        @rtype: list
+        """
+        try:
+            return pickle.loads(data)
+        except Exception as e:
+            LOG.error("Could not unpickle NAVET worker results: %r", e)
+            error = RemoteError('%s: %s' % (type(e).__name__, e))
+            return [(index, BatchResult(identity_number, None, error)) for index, identity_number in items]
+
+    def _crashed(self, worker, chunks, retry):
+        """
+        Fail the chunk a dead worker was working on, queue the rest of its chunks for other workers and replace it.
+
+        @return: (index, BatchResult) for the failed lookups
+        @rtype: list
+        """
+        worker.process.join()
+        self.crashes += 1
+        LOG.error("NAVET worker process %s exited with %s", worker.process.pid, worker.process.exitcode)
+        self._stop_worker(worker)
+        self._start_worker()
+        failed = []
+        if worker.chunks:
+            items = chunks.pop(worker.chunks.popleft(), [])
+            error = WorkerCrashedError('Worker process exited with %s' % worker.process.exitcode)
+            failed = [(index, BatchResult(identity_number, None, error)) for index, identity_number in items]
+        retry.extend(chunk_id for chunk_id in worker.chunks if chunk_id in chunks)
+        return failed
+
+    def close(self):
+        """
+        Stop the worker processes.
+        """
+        self._closed = True
+        for worker in list(self._workers):
+            self._stop_worker(worker)
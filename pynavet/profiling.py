@@ -0,0 +1,189 @@
+"""
+This module provides a sampling profiler for diagnosing slow NAVET lookups in production.
+
+Pass a SamplingProfiler as 'profiler' to NavetClient/PostalAddress/NameSearch:
+
+    profiler = SamplingProfiler(rate=0.01, interval=600, path='/var/tmp/pynavet.prof')
+    navet = PostalAddress(cert, key_file, order_id, profiler=profiler)
+
+A fraction of the lookups, 'rate', is run under cProfile and, where available, tracemalloc. This covers sending the
+request, the XSLT translation of the reply and the conversion to a dict or record. Statistics are aggregated over the
+sampled lookups and every 'interval' seconds logged as a report, dumped to 'path' in pstats format and reset. Use
+report(), dump() and flush() to get them on demand.
+
+Only one lookup at a time is profiled, concurrent lookups are not sampled meanwhile. A lookup that is not sampled
+costs one call to random.random().
+"""
+from logging import getLogger
+import threading
+import cProfile
+import pstats
+import random
+import time
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+LOG = getLogger(__name__)
+
+
+class SamplingProfiler(object):
+    """
+    Profiles a random sample of the calls made through it, thread-safe.
+    """
+    def __init__(self, rate=0.01, interval=None, path=None, memory=True, limit=30, sort='cumulative', frames=10):
+        """
+        @param rate: (optional) Fraction of calls to profile, default 0.01
+        @type rate: float
+        @param interval: (optional) Seconds between reports, checked after every sampled call, default only on demand
+        @type interval: float
+        @param path: (optional) File the aggregated pstats are dumped to with every report, overwritten each time
+        @type path: str
+        @param memory: (optional) Trace allocations of sampled calls with tracemalloc, if available and not already
+        tracing, default True
+        @type memory: bool
+        @param limit: (optional) Number of functions and allocation sites in a report, default 30
+        @type limit: int
+        @param sort: (optional) pstats sort key of the functions in a report, default 'cumulative'
+        @type sort: str
+        @param frames: (optional) Number of frames stored per traced allocation, default 10
+        @type frames: int
+        """
+        self.rate = rate
+        self.interval = interval
+        self.path = path
+        self.memory = memory and tracemalloc is not None
+        self.limit = limit
+        self.sort = sort
+        self.frames = frames
+        self._active = threading.Lock()
+        self._lock = threading.Lock()
+        self._reported = time.time()
+        self.reset()
+
+    def reset(self):
+        """
+        Discard the aggregated statistics.
+        """
+        with self._lock:
+            self.sampled = 0
+            self.seconds = 0.0
+            self.slowest = 0.0
+            self.peak_memory = 0
+            self._stats = None
+            self._allocations = {}
+
+    def call(self, func, *args):
+        """
+        Call func, profiling the call if it is sampled.
+
+        @param func: Function to call
+        @type func: callable
+        @return: What func returned
+        """
+        if random.random() >= self.rate or not self._active.acquire(False):
+            return func(*args)
+        try:
+            return self._profile(func, args)
+        finally:
+            self._active.release()
+
+    def _profile(self, func, args):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is active in this process (Python 3.12+)
+            return func(*args)
+        tracing = self.memory and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start(self.frames)
+        start = time.time()
+        try:
+            return func(*args)
+        finally:
+            elapsed = time.time() - start
+            profile.disable()
+            snapshot = peak = None
+            if tracing:
+                snapshot = tracemalloc.take_snapshot()
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            self._add(profile, elapsed, snapshot, peak)
+            if self.interval is not None and time.time() - self._reported >= self.interval:
+                self.flush()
+
+    def _add(self, profile, elapsed, snapshot, peak):
+        with self._lock:
+            self.sampled += 1
+            self.seconds += elapsed
+            self.slowest = max(self.slowest, elapsed)
+            if self._stats is None:
+                self._stats = pstats.Stats(profile)
+            else:
+                self._stats.add(profile)
+            if snapshot is not None:
+                self.peak_memory = max(self.peak_memory, peak)
+                snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__),
+                                                   tracemalloc.Filter(False, __file__)])
+                for stat in snapshot.statistics('lineno'):
+                    site = str(stat.traceback[0])
+                    size, count = self._allocations.get(site, (0, 0))
+                    self._allocations[site] = (size + stat.size, count + stat.count)
+
+    def report(self):
+        """
+        @return: The aggregated statistics of the sampled calls as text
+        @rtype: str
+        """
+        with self._lock:
+            lines = ['Sampled %d calls (rate %s), %.3f s in total, slowest %.3f s' % (
+                self.sampled, self.rate, self.seconds, self.slowest)]
+            if self._stats is not None:
+                stream = StringIO()
+                self._stats.stream = stream
+                self._stats.sort_stats(self.sort).print_stats(self.limit)
+                lines.append(stream.getvalue())
+            if self._allocations:
+                lines.append('Peak traced memory %d bytes, allocations still held after the calls:' %
+                             self.peak_memory)
+                sites = sorted(self._allocations.items(), key=lambda item: item[1][0], reverse=True)
+                for site, (size, count) in sites[:self.limit]:
+                    lines.append('%12d B %8d blocks  %s' % (size, count, site))
+        return '\n'.join(lines)
+
+    def dump(self, path=None):
+        """
+        Write the aggregated cProfile statistics in pstats format, ie for 'python -m pstats' or snakeviz.
+
+        @param path: (optional) File to write, default the path given to the constructor
+        @type path: str
+        """
+        path = path or self.path
+        if path is None:
+            raise ValueError('No path to dump profiling statistics to')
+        with self._lock:
+            if self._stats is not None:
+                self._stats.dump_stats(path)
+
+    def flush(self):
+        """
+        Log a report, dump the statistics to the configured path, if any, and reset them.
+        """
+        self._reported = time.time()
+        if not self.sampled:
+            return
+        LOG.info("NAVET profile:\n%s", self.report())
+        if self.path is not None:
+            try:
+                self.dump()
+            except (IOError, OSError) as e:
+                LOG.warning("Could not dump NAVET profile to %s: %r", self.path, e)
+        self.reset()
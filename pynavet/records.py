@@ -0,0 +1,156 @@
+"""
+This module provides compact typed person records, built directly from a translated NAVET reply.
+
+The records use __slots__ and hold plain strings, so they take a fraction of the memory of the nested OrderedDicts
+returned by default. Enable them with PostalAddress(..., records=True).
+"""
+from collections import OrderedDict
+import json
+
+
+class Record(object):
+    """
+    Base class for records. Missing fields are None.
+    """
+    __slots__ = ()
+
+    def __init__(self, **kwargs):
+        for name in self.__slots__:
+            setattr(self, name, kwargs.pop(name, None))
+        if kwargs:
+            raise TypeError('Unknown fields for %s: %s' % (type(self).__name__, ', '.join(sorted(kwargs))))
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.__getstate__() == other.__getstate__()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.__getstate__())
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__, ', '.join('%s=%r' % (name, getattr(self, name))
+                                                          for name in self.__slots__
+                                                          if getattr(self, name) is not None))
+
+    def to_dict(self):
+        """
+        @return: The fields that are set, with records converted to dicts and tuples of records to lists
+        @rtype: OrderedDict
+        """
+        result = OrderedDict()
+        for name in self.__slots__:
+            value = getattr(self, name)
+            if isinstance(value, Record):
+                value = value.to_dict()
+            elif isinstance(value, tuple):
+                value = [item.to_dict() for item in value]
+            elif value is None:
+                continue
+            result[name] = value
+        return result
+
+    def to_json(self, **kwargs):
+        """
+        @param kwargs: Options passed on to json.dumps
+        @return: The record as a JSON document
+        @rtype: str
+        """
+        return json.dumps(self.to_dict(), **kwargs)
+
+
+class Name(Record):
+    __slots__ = ('given_name_marking', 'given_name', 'middle_name', 'surname')
+
+    @classmethod
+    def from_element(cls, element):
+        """
+        @param element: Translated 'Name' element
+        @type element: lxml.etree._Element | None
+        @rtype: Name | None
+        """
+        if element is None:
+            return None
+        return cls(given_name_marking=element.findtext('GivenNameMarking'),
+                   given_name=element.findtext('GivenName'),
+                   middle_name=element.findtext('MiddleName'),
+                   surname=element.findtext('SurName'))
+
+
+class OfficialAddress(Record):
+    __slots__ = ('address1', 'address2', 'postal_code', 'city')
+
+    @classmethod
+    def from_element(cls, element):
+        """
+        @param element: Translated 'OfficialAddress' element
+        @type element: lxml.etree._Element | None
+        @rtype: OfficialAddress | None
+        """
+        if element is None:
+            return None
+        return cls(address1=element.findtext('Address1'),
+                   address2=element.findtext('Address2'),
+                   postal_code=element.findtext('PostalCode'),
+                   city=element.findtext('City'))
+
+
+class Relation(Record):
+    __slots__ = ('identity_number', 'birth_time_number', 'relation_type', 'start_date', 'name',
+                 'deregistration_code', 'deregistration_date')
+
+    @classmethod
+    def from_element(cls, element):
+        """
+        @param element: Translated 'Relation' element
+        @type element: lxml.etree._Element
+        @rtype: Relation
+        """
+        return cls(identity_number=element.findtext('RelationId/NationalIdentityNumber'),
+                   birth_time_number=element.findtext('RelationId/FodelsetidNr'),
+                   relation_type=element.findtext('RelationType'),
+                   start_date=element.findtext('RelationStartDate'),
+                   name=Name.from_element(element.find('Name')),
+                   deregistration_code=element.findtext('Avregistrering/AvregistreringsorsakKod'),
+                   deregistration_date=element.findtext('Avregistrering/Avregistreringsdatum'))
+
+
+class Person(Record):
+    __slots__ = ('identity_number', 'secrecy_marking', 'name', 'official_address', 'relations')
+
+    @classmethod
+    def from_element(cls, element):
+        """
+        @param element: Translated 'PersonItem' element
+        @type element: lxml.etree._Element
+        @rtype: Person
+        """
+        return cls(identity_number=element.findtext('PersonId/NationalIdentityNumber'),
+                   secrecy_marking=element.findtext('SecrecyMarking'),
+                   name=Name.from_element(element.find('Name')),
+                   official_address=OfficialAddress.from_element(element.find('PostalAddresses/OfficialAddress')),
+                   relations=tuple(Relation.from_element(relation) for relation in element.iterfind(
+                       'Relations/Relation')))
+
+    @classmethod
+    def from_tree(cls, tree):
+        """
+        Build the record for the first person in a translated reply.
+
+        @param tree: Translated reply, see pynavet.plugins.translate
+        @type tree: lxml.etree._ElementTree
+        @return: The person or None if the reply has no person
+        @rtype: Person | None
+        """
+        element = tree.find('PopulationItems/PopulationItem/PersonItem')
+        if element is None:
+            return None
+        return cls.from_element(element)
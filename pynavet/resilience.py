@@ -0,0 +1,109 @@
+"""
+This module provides retry backoff and a circuit breaker for calls to NAVET.
+"""
+import threading
+import random
+import time
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling NAVET while the circuit breaker is open.
+    """
+
+
+class CircuitBreaker(object):
+    """
+    Thread-safe circuit breaker. After 'failure_threshold' consecutive failures the circuit opens and calls fail fast
+    for 'reset_timeout' seconds. Then one trial call is let through (half-open), its outcome closes or re-opens the
+    circuit.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        """
+        @param failure_threshold: (optional) Consecutive failures before opening the circuit, default 5
+        @type failure_threshold: int
+        @param reset_timeout: (optional) Seconds to fail fast before trying again, default 30
+        @type reset_timeout: int | float
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """
+        @return: CLOSED, OPEN or HALF_OPEN
+        @rtype: str
+        """
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self.opened_at is None:
+            return self.CLOSED
+        if time.time() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def before_call(self):
+        """
+        Check whether a call may be made.
+
+        @raise CircuitOpenError: If the circuit is open, or half-open with a trial call already in flight
+        """
+        with self._lock:
+            state = self._state()
+            if state == self.CLOSED:
+                return
+            if state == self.HALF_OPEN and not self._trial:
+                self._trial = True
+                return
+        raise CircuitOpenError('NAVET circuit breaker is open after %d failures' % self.failures)
+
+    def record_success(self):
+        """
+        Record a successful call, closing the circuit.
+        """
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        """
+        Record a failed call, opening the circuit when the threshold is reached or a trial call failed.
+        """
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.failure_threshold:
+                self.opened_at = time.time()
+            self._trial = False
+
+    def reset(self):
+        """
+        Close the circuit.
+        """
+        self.record_success()
+
+
+def backoff_delays(retries, base=0.1, maximum=5.0):
+    """
+    Delays to sleep before each retry: exponential backoff with full jitter.
+
+    @param retries: Number of retries
+    @type retries: int
+    @param base: (optional) Delay before the first retry, doubled for every retry, default 0.1
+    @type base: float
+    @param maximum: (optional) Max delay, default 5
+    @type maximum: float
+    @return: Generator of delays in seconds
+    """
+    for attempt in range(retries):
+        yield random.uniform(0, min(maximum, base * 2 ** attempt))
@@ -0,0 +1,281 @@
+"""
+This module provides incremental change detection of NAVET data against snapshots stored in sqlite.
+
+    navet = PostalAddress(cert, key_file, order_id, records=True)
+    sync = Synchronizer(navet, SnapshotStore('navet.sqlite'))
+    for change in sync.sync(identity_numbers, full=True):
+        ...
+
+Every person is still looked up, but only added, changed and vanished people are returned, so downstream writes
+scale with the rate of change rather than the population size. A content hash is kept per identity number, and
+optionally the normalized record to report field-level diffs.
+"""
+from pynavet.records import Person
+from collections import namedtuple
+from logging import getLogger
+import hashlib
+import sqlite3
+import json
+import time
+
+LOG = getLogger(__name__)
+
+ADDED = 'added'
+CHANGED = 'changed'
+VANISHED = 'vanished'
+FAILED = 'failed'
+
+
+class Change(namedtuple('Change', ['identity_number', 'kind', 'record', 'previous', 'diff', 'error'])):
+    """
+    A change found by Synchronizer.sync.
+
+    'kind' is ADDED, CHANGED, VANISHED or FAILED. 'record' is the current Person, None unless added or changed.
+    'previous' is the stored normalized record and 'diff' maps changed field paths, ie 'official_address.city' or
+    'relations[FA:191212121212].name.surname', to (old, new) values. Both are None if the store keeps hashes only.
+    'error' is the exception of a FAILED lookup, the stored snapshot is then left as it is.
+    """
+    __slots__ = ()
+
+
+def normalize(person):
+    """
+    @param person: The person to normalize
+    @type person: pynavet.records.Person
+    @return: The person as a dict, with relations in a stable order
+    @rtype: dict
+    """
+    record = dict(person.to_dict())
+    if 'relations' in record:
+        record['relations'] = sorted(record['relations'], key=_relation_key)
+    return record
+
+
+def content_hash(record):
+    """
+    @param record: Normalized record
+    @type record: dict
+    @return: SHA-1 digest of the record
+    @rtype: bytes
+    """
+    return hashlib.sha1(json.dumps(record, sort_keys=True, separators=(',', ':')).encode('utf-8')).digest()
+
+
+def diff(previous, record):
+    """
+    Compare two normalized records field by field.
+
+    @return: Changed field paths mapped to (old, new) values, missing fields are None
+    @rtype: dict
+    """
+    old = _flatten(previous or {})
+    new = _flatten(record or {})
+    return dict((path, (old.get(path), new.get(path))) for path in set(old) | set(new)
+                if old.get(path) != new.get(path))
+
+
+def _relation_key(relation):
+    return '%s:%s' % (relation.get('relation_type') or '',
+                      relation.get('identity_number') or relation.get('birth_time_number') or '')
+
+
+def _flatten(record, prefix='', result=None):
+    if result is None:
+        result = {}
+    for key, value in record.items():
+        path = prefix + key
+        if isinstance(value, dict):
+            _flatten(value, path + '.', result)
+        elif isinstance(value, list):
+            for item in value:
+                _flatten(item, '%s[%s].' % (path, _relation_key(item)), result)
+        else:
+            result[path] = value
+    return result
+
+
+class SnapshotStore(object):
+    """
+    Snapshots of person records in a sqlite database: a content hash and optionally the normalized record. A store
+    must only be used by the thread that created it.
+    """
+    def __init__(self, path=':memory:', store_records=True):
+        """
+        @param path: (optional) sqlite database file, default an in-memory database
+        @type path: str
+        @param store_records: (optional) Keep the normalized records to report field-level diffs, default True
+        @type store_records: bool
+        """
+        self.path = path
+        self.store_records = store_records
+        self.db = sqlite3.connect(path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS snapshots (identity_number TEXT PRIMARY KEY, hash BLOB NOT NULL, '
+                        'record TEXT, updated REAL NOT NULL)')
+        self.db.commit()
+
+    def get(self, identity_number):
+        """
+        @return: The stored hash and normalized record (None if not stored), or None if there is no snapshot
+        @rtype: tuple | None
+        """
+        row = self.db.execute('SELECT hash, record FROM snapshots WHERE identity_number = ?',
+                              (identity_number,)).fetchone()
+        if row is None:
+            return None
+        return bytes(row[0]), json.loads(row[1]) if row[1] is not None else None
+
+    def put(self, identity_number, digest, record):
+        """
+        Store the snapshot of a person.
+
+        @param digest: Content hash, see content_hash
+        @type digest: bytes
+        @param record: Normalized record, see normalize
+        @type record: dict
+        """
+        data = json.dumps(record, sort_keys=True, separators=(',', ':')) if self.store_records else None
+        self.db.execute('INSERT OR REPLACE INTO snapshots (identity_number, hash, record, updated) VALUES (?, ?, ?, ?)',
+                        (identity_number, sqlite3.Binary(digest), data, time.time()))
+
+    def delete(self, identity_number):
+        self.db.execute('DELETE FROM snapshots WHERE identity_number = ?', (identity_number,))
+
+    def identity_numbers(self):
+        """
+        @return: Generator of the identity numbers with a snapshot
+        """
+        for row in self.db.execute('SELECT identity_number FROM snapshots'):
+            yield row[0]
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM snapshots').fetchone()[0]
+
+    def clear_seen(self):
+        """
+        Start tracking the identity numbers seen by a full sync, in a temporary table.
+        """
+        self.db.execute('CREATE TEMP TABLE IF NOT EXISTS seen (identity_number TEXT PRIMARY KEY)')
+        self.db.execute('DELETE FROM seen')
+
+    def mark_seen(self, identity_number):
+        self.db.execute('INSERT OR IGNORE INTO seen VALUES (?)', (identity_number,))
+
+    def unseen(self):
+        """
+        @return: The identity numbers with a snapshot not marked seen since clear_seen
+        @rtype: list
+        """
+        return [row[0] for row in self.db.execute(
+            'SELECT identity_number FROM snapshots WHERE identity_number NOT IN (SELECT identity_number FROM seen)')]
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+
+class Synchronizer(object):
+    """
+    Look up people and report how they changed since the stored snapshots.
+    """
+    def __init__(self, navet, store, max_workers=4, rate_limit=None, commit_every=1000):
+        """
+        @param navet: Client to look up people with, created with records=True
+        @type navet: pynavet.postaladdress.PostalAddress
+        @param store: Snapshots to compare with and update
+        @type store: SnapshotStore
+        @param max_workers: (optional) Number of concurrent lookups, default 4
+        @type max_workers: int
+        @param rate_limit: (optional) Max number of lookups per second
+        @type rate_limit: int | float
+        @param commit_every: (optional) Changes between store commits, default 1000
+        @type commit_every: int
+        """
+        if not getattr(navet, 'records', False):
+            raise ValueError('Synchronizer needs a PostalAddress created with records=True')
+        self.navet = navet
+        self.store = store
+        self.max_workers = max_workers
+        self.rate_limit = rate_limit
+        self.commit_every = commit_every
+        self.stats = {'lookups': 0, ADDED: 0, CHANGED: 0, VANISHED: 0, FAILED: 0}
+
+    def sync(self, identity_numbers, full=False):
+        """
+        Look up identity numbers and yield a Change for every added, changed, vanished or failed one.
+
+        A change is recorded in the store when the caller asks for the next one, so the change the caller was
+        handling when stopping is reported again by the next sync.
+
+        @param identity_numbers: National identity numbers to look up
+        @type identity_numbers: iterable
+        @param full: (optional) The identity numbers are the whole population, people with a snapshot that were
+        not looked up have vanished, default False
+        @type full: bool
+        @return: Generator of Change
+        """
+        store = self.store
+        if full:
+            store.clear_seen()
+        pending = 0
+        try:
+            results = self.navet.get_all_data_many(identity_numbers, max_workers=self.max_workers,
+                                                    rate_limit=self.rate_limit)
+            for result in results:
+                self.stats['lookups'] += 1
+                identity_number = result.identity_number
+                if full:
+                    store.mark_seen(identity_number)
+                change, snapshot = self._compare(identity_number, result.result, result.error)
+                if change is None:
+                    continue
+                self.stats[change.kind] += 1
+                yield change
+                self._record(change, snapshot)
+                pending += 1
+                if pending >= self.commit_every:
+                    store.commit()
+                    pending = 0
+            if full:
+                for identity_number in store.unseen():
+                    change, _ = self._compare(identity_number, None, None)
+                    self.stats[change.kind] += 1
+                    yield change
+                    self._record(change, None)
+        finally:
+            store.commit()
+
+    def _compare(self, identity_number, person, error):
+        """
+        @return: The change, or None if unchanged, and the new snapshot (digest, record) to store
+        @rtype: tuple
+        """
+        if error is not None:
+            LOG.warning("NAVET lookup of %s failed during sync: %r", identity_number, error)
+            return Change(identity_number, FAILED, None, None, None, error), None
+        snapshot = self.store.get(identity_number)
+        if person is None:
+            if snapshot is None:
+                return None, None
+            previous = snapshot[1]
+            changes = diff(previous, None) if previous is not None else None
+            return Change(identity_number, VANISHED, None, previous, changes, None), None
+        if not isinstance(person, Person):
+            raise TypeError('Expected a pynavet.records.Person, got %s' % type(person).__name__)
+        record = normalize(person)
+        digest = content_hash(record)
+        if snapshot is None:
+            return Change(identity_number, ADDED, person, None, diff(None, record), None), (digest, record)
+        if snapshot[0] == digest:
+            return None, None
+        previous = snapshot[1]
+        changes = diff(previous, record) if previous is not None else None
+        return Change(identity_number, CHANGED, person, previous, changes, None), (digest, record)
+
+    def _record(self, change, snapshot):
+        if change.kind == VANISHED:
+            self.store.delete(change.identity_number)
+        elif snapshot is not None:
+            self.store.put(change.identity_number, snapshot[0], snapshot[1])
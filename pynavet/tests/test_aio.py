@@ -0,0 +1,76 @@
+from unittest import TestCase, SkipTest
+from mock import MagicMock
+import pkg_resources
+
+try:
+    import asyncio
+    from pynavet.aio import AsyncPostalAddress
+except (ImportError, SyntaxError):
+    raise SkipTest('asyncio client requires Python 3.5+ and aiohttp')
+
+from suds import WebFault
+
+FAULT = b'''<?xml version="1.0" encoding="UTF-8"?>
+<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/">
+<soapenv:Body><soapenv:Fault><faultcode>soapenv:Server</faultcode><faultstring>Not found</faultstring></soapenv:Fault>
+</soapenv:Body></soapenv:Envelope>'''
+
+
+class TestAsyncPostalAddress(TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.navet = AsyncPostalAddress('', '', 'order')
+        data_dir = pkg_resources.resource_filename(__name__, 'data')
+        self.response = open('%s/getdata_response.xml' % data_dir, 'rb').read()
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.navet.close())
+        self.loop.close()
+
+    def _mock_post(self, status, body):
+        future = self.loop.create_future()
+        future.set_result((status, body))
+        self.navet._post = MagicMock(return_value=future)
+
+    def test_get_all_data(self):
+        self._mock_post(200, self.response)
+        result = self.loop.run_until_complete(self.navet.get_all_data('190001010000'))
+        person = result['NavetNotifications']['PopulationItems']['PopulationItem']['PersonItem']
+        self.assertEqual(person['Name']['GivenName'], 'John')
+        envelope = self.navet._post.call_args[0][0]
+        self.assertTrue(b'>190001010000</personid>' in envelope)
+        self.assertTrue(b'>order</bestallningsid>' in envelope)
+
+    def test_get_name(self):
+        self._mock_post(200, self.response)
+        result = self.loop.run_until_complete(self.navet.get_name(''))
+        self.assertEqual(result['Name']['GivenName'], 'John')
+
+    def test_get_name_and_official_address(self):
+        self._mock_post(200, self.response)
+        result = self.loop.run_until_complete(self.navet.get_name_and_official_address(''))
+        self.assertEqual(result['OfficialAddress']['Address2'], 'Example road 10')
+
+    def test_get_relations_no_content(self):
+        self._mock_post(204, b'')
+        self.navet.debug = True
+        self.assertEqual(self.loop.run_until_complete(self.navet.get_relations('')), False)
+
+    def test_fault(self):
+        self._mock_post(500, FAULT)
+        self.assertRaises(WebFault, self.loop.run_until_complete, self.navet.get_all_data(''))
+
+    def test_coalesce(self):
+        self.navet = AsyncPostalAddress('', '', 'order', coalesce=True)
+
+        def post(envelope):
+            future = self.loop.create_future()
+            self.loop.call_later(0.05, future.set_result, (200, self.response))
+            return future
+        self.navet._post = MagicMock(side_effect=post)
+        asyncio.set_event_loop(self.loop)
+        lookups = asyncio.gather(*[self.navet.get_name('190001010000') for _ in range(3)])
+        results = self.loop.run_until_complete(lookups)
+        self.assertEqual([result['Name']['GivenName'] for result in results], ['John'] * 3)
+        self.assertEqual(self.navet._post.call_count, 1)
+        self.assertEqual(self.navet.single_flight.stats(), {'calls': 1, 'coalesced': 2})
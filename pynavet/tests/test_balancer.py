@@ -0,0 +1,118 @@
+from pynavet.balancer import (BalancedPostalAddress, Credential, CredentialScheduler, NoCredentialAvailableError,
+                              INTERACTIVE, BATCH)
+from pynavet.testserver import FAULT
+from unittest import TestCase
+from mock import MagicMock
+import pkg_resources
+import threading
+import requests
+import time
+
+
+class TestCredentialScheduler(TestCase):
+    def test_round_robin(self):
+        credentials = [Credential('', '', 'a'), Credential('', '', 'b')]
+        scheduler = CredentialScheduler(credentials)
+        self.assertEquals([scheduler.acquire().order_id for _ in range(4)], ['a', 'b', 'a', 'b'])
+
+    def test_rate_limits_add_up(self):
+        scheduler = CredentialScheduler([Credential('', '', 'a', rate_limit=20)])
+        start = time.time()
+        for _ in range(5):
+            scheduler.acquire()
+        single = time.time() - start
+        scheduler = CredentialScheduler([Credential('', '', 'a', rate_limit=20),
+                                         Credential('', '', 'b', rate_limit=20)])
+        start = time.time()
+        for _ in range(5):
+            scheduler.acquire()
+        self.assertTrue(time.time() - start < single * 0.75)
+
+    def test_interactive_preempts_batch(self):
+        scheduler = CredentialScheduler([Credential('', '', 'a', rate_limit=10)])
+        scheduler.acquire()
+        order = []
+
+        def lookup(name, priority):
+            scheduler.acquire(priority)
+            order.append(name)
+
+        threads = [threading.Thread(target=lookup, args=('batch%d' % i, BATCH)) for i in range(3)]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.01)
+        threads.append(threading.Thread(target=lookup, args=('interactive', INTERACTIVE)))
+        threads[-1].start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals(order, ['interactive', 'batch0', 'batch1', 'batch2'])
+
+    def test_backoff(self):
+        credentials = [Credential('', '', 'a'), Credential('', '', 'b')]
+        scheduler = CredentialScheduler(credentials, fault_threshold=2, backoff=10)
+        scheduler.record_failure(credentials[0])
+        self.assertEquals(set(scheduler.acquire().order_id for _ in range(2)), set(['a', 'b']))
+        scheduler.record_failure(credentials[0])
+        self.assertEquals([scheduler.acquire().order_id for _ in range(3)], ['b', 'b', 'b'])
+        scheduler.record_failure(credentials[1])
+        scheduler.record_success(credentials[1])
+        self.assertEquals(credentials[1].failures, 0)
+
+    def test_timeout(self):
+        credential = Credential('', '', 'a')
+        scheduler = CredentialScheduler([credential], fault_threshold=1, backoff=10)
+        scheduler.record_failure(credential)
+        self.assertRaises(NoCredentialAvailableError, scheduler.acquire, INTERACTIVE, 0.05)
+        self.assertEquals(scheduler._waiting, [])
+
+
+class TestBalancedPostalAddress(TestCase):
+    def setUp(self):
+        self.navet = BalancedPostalAddress([Credential('', '', 'order-a'), Credential('', '', 'order-b')],
+                                           fault_threshold=2, credential_backoff=10)
+        data_dir = pkg_resources.resource_filename(__name__, 'data')
+        self.response = open('%s/getdata_response.xml' % data_dir, 'rb').read()
+        for client in self.navet.clients:
+            client.client.options.transport.session.post = MagicMock(
+                return_value=MagicMock(status_code=200, headers={}, content=self.response))
+
+    def _posts(self):
+        return [client.client.options.transport.session.post for client in self.navet.clients]
+
+    def test_spread_over_credentials(self):
+        for _ in range(4):
+            self.assertEquals(self.navet.get_name('xxxx')['Name']['GivenName'], 'John')
+        posts = self._posts()
+        self.assertEquals([post.call_count for post in posts], [2, 2])
+        self.assertTrue(b'order-b' in posts[1].call_args[1]['data'])
+
+    def test_failing_credential_backed_off(self):
+        posts = self._posts()
+        posts[0].side_effect = requests.ConnectionError('Connection refused')
+        results = list(self.navet.with_priority(BATCH).get_name_many(['xxxx'] * 8, max_workers=1))
+        self.assertEquals(len([r for r in results if r.error is not None]), 2)
+        self.assertEquals(posts[0].call_count, 2)
+        self.assertEquals(posts[1].call_count, 6)
+
+    def _fault(self, post, message):
+        post.return_value = MagicMock(status_code=500, headers={}, content=(FAULT % message).encode('utf-8'))
+
+    def test_not_found_faults_keep_credential(self):
+        for post in self._posts():
+            self._fault(post, u'Personen finns inte')
+        results = list(self.navet.get_name_many(['xxxx'] * 8, max_workers=1))
+        self.assertEquals(len([r for r in results if r.error is not None]), 8)
+        self.assertEquals([post.call_count for post in self._posts()], [4, 4])
+        self.assertEquals([credential.failures for credential in self.navet.scheduler.credentials], [0, 0])
+
+    def test_availability_faults_back_off(self):
+        posts = self._posts()
+        self._fault(posts[0], u'Tj\xe4nsten \xe4r tillf\xe4lligt otillg\xe4nglig')
+        list(self.navet.get_name_many(['xxxx'] * 8, max_workers=1))
+        self.assertEquals([post.call_count for post in posts], [2, 6])
+
+    def test_with_priority(self):
+        view = self.navet.with_priority(BATCH)
+        self.assertEquals((view.priority, self.navet.priority), (BATCH, INTERACTIVE))
+        self.assertTrue(view.scheduler is self.navet.scheduler)
+        self.assertTrue(view.clients is self.navet.clients)
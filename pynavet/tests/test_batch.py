@@ -0,0 +1,69 @@
+from pynavet.batch import imap_unordered, RateLimiter
+from unittest import TestCase
+import threading
+import time
+
+
+class TestImapUnordered(TestCase):
+    def test_results_and_errors(self):
+        def lookup(identity_number):
+            if identity_number == 'bad':
+                raise ValueError(identity_number)
+            return identity_number.upper()
+
+        results = dict((r.identity_number, r) for r in imap_unordered(lookup, ['a', 'bad', 'c'] * 5, max_workers=3))
+        self.assertEquals(results['a'].result, 'A')
+        self.assertEquals(results['c'].error, None)
+        self.assertTrue(isinstance(results['bad'].error, ValueError))
+        self.assertEquals(results['bad'].result, None)
+
+    def test_base_exception(self):
+        def lookup(identity_number):
+            if identity_number == 'exit':
+                raise SystemExit(1)
+            return identity_number
+
+        results = []
+        thread = threading.Thread(target=lambda: results.extend(imap_unordered(lookup, ['exit', 'a', 'b'],
+                                                                               max_workers=1)))
+        thread.daemon = True
+        thread.start()
+        thread.join(5)
+        self.assertEquals(sorted(r.identity_number for r in results), ['a', 'b', 'exit'])
+        self.assertTrue([r for r in results if isinstance(r.error, SystemExit)])
+
+    def test_completion_order(self):
+        def lookup(delay):
+            time.sleep(delay)
+            return delay
+
+        results = [r.result for r in imap_unordered(lookup, [0.2, 0.01], max_workers=2)]
+        self.assertEquals(results, [0.01, 0.2])
+
+    def test_lazy_input(self):
+        consumed = []
+
+        def numbers():
+            for i in range(1000):
+                consumed.append(i)
+                yield i
+
+        results = imap_unordered(lambda i: i, numbers(), max_workers=2)
+        next(results)
+        results.close()
+        self.assertTrue(len(consumed) < 10)
+
+
+class TestRateLimiter(TestCase):
+    def test_rate(self):
+        limiter = RateLimiter(50)
+        start = time.time()
+        for _ in range(6):
+            limiter.acquire()
+        self.assertTrue(time.time() - start >= 0.09)
+
+    def test_try_acquire(self):
+        limiter = RateLimiter(10)
+        self.assertEquals(limiter.try_acquire(), 0)
+        wait = limiter.try_acquire()
+        self.assertTrue(0 < wait <= 0.1)
@@ -0,0 +1,102 @@
+from pynavet.cache import ResultCache, MemoryCache, SqliteCache
+from unittest import TestCase
+from mock import patch
+from collections import OrderedDict
+import threading
+import tempfile
+import shutil
+import time
+import os
+
+
+class CacheTests(object):
+    def test_get_set(self):
+        self.cache.set('1', OrderedDict([('Name', 'John')]))
+        self.assertEquals(self.cache.get('1')['Name'], 'John')
+        self.assertEquals(self.cache.get('2'), None)
+        self.assertEquals(self.cache.stats(), {'hits': 1, 'misses': 1})
+
+    def test_expiry(self):
+        self.cache.ttl = -1
+        self.cache.set('1', {'a': 1})
+        self.assertEquals(self.cache.get('1'), None)
+        self.assertEquals(self.cache.get_stale('1'), {'a': 1})
+        self.assertEquals(self.cache.get_stale('2'), None)
+
+    def test_lru_eviction(self):
+        self.cache.max_entries = 2
+        self.cache.set('1', {'a': 1})
+        time.sleep(0.01)
+        self.cache.set('2', {'a': 2})
+        time.sleep(0.01)
+        self.cache.get('1')
+        time.sleep(0.01)
+        self.cache.set('3', {'a': 3})
+        self.assertEquals(self.cache.get('2'), None)
+        self.assertEquals(self.cache.get('1'), {'a': 1})
+        self.assertEquals(self.cache.get('3'), {'a': 3})
+
+    def test_invalidate(self):
+        self.cache.set('1', {'a': 1})
+        self.cache.invalidate('1')
+        self.assertEquals(self.cache.get('1'), None)
+        self.cache.set('2', {'a': 2})
+        self.cache.clear()
+        self.assertEquals(self.cache.get('2'), None)
+
+    def test_concurrent_stats(self):
+        self.cache.set('1', {'a': 1})
+
+        def get():
+            for i in range(200):
+                self.cache.get(str(i % 2))
+
+        threads = [threading.Thread(target=get) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals(self.cache.stats(), {'hits': 800, 'misses': 800})
+
+
+class TestResultCache(TestCase):
+    def test_abstract(self):
+        self.assertRaises(TypeError, ResultCache)
+
+
+class TestMemoryCache(CacheTests, TestCase):
+    def setUp(self):
+        self.cache = MemoryCache()
+
+
+class TestSqliteCache(CacheTests, TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = SqliteCache(os.path.join(self.tmpdir, 'cache.db'))
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_eviction_batched(self):
+        self.cache.max_entries = 200
+        for i in range(201):
+            self.cache.set(str(i), i)
+        count = lambda: self.cache._db.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+        self.assertEquals(count(), 201)
+        self.cache.set('201', 201)
+        self.assertEquals(count(), 200)
+        self.assertEquals(self.cache.get('0'), None)
+        self.assertEquals(self.cache.get('201'), 201)
+
+    def test_unpickled_outside_lock(self):
+        self.cache.set('1', {'a': 1})
+        with patch('pynavet.cache.pickle.loads', side_effect=lambda data: self.cache._lock.locked()):
+            self.assertEquals(self.cache.get('1'), False)
+            self.assertEquals(self.cache.get_stale('1'), False)
+
+    def test_shared_between_instances(self):
+        self.cache.set('1', {'a': 1})
+        other = SqliteCache(self.cache.path)
+        self.assertEquals(other.get('1'), {'a': 1})
+        other.close()
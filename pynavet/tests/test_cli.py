@@ -0,0 +1,135 @@
+from pynavet.cli import Checkpoint, JSONLinesWriter, CSVWriter, read_identity_numbers, run, main
+from pynavet.records import Person, Name, OfficialAddress, Relation
+from pynavet.resilience import CircuitOpenError
+from suds.transport import TransportError
+from suds import WebFault
+from unittest import TestCase
+from mock import MagicMock, patch
+import tempfile
+import shutil
+import json
+import os
+
+PERSON = Person(identity_number='191212121212', name=Name(given_name='John', surname='Doe'),
+                official_address=OfficialAddress(address2='Example road 10', postal_code='12345', city='Town'),
+                relations=(Relation(identity_number='199401135679', relation_type='B'),))
+
+
+class TestCli(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.navet = MagicMock()
+        self.navet.get_all_data.side_effect = lambda identity_number: None if identity_number == 'missing' else PERSON
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _read(self, name):
+        with open(self._path(name)) as fd:
+            return fd.read()
+
+    def test_checkpoint(self):
+        checkpoint = Checkpoint(self._path('checkpoint'))
+        for index in (0, 2, 3, 1, 5):
+            checkpoint.add(index)
+        self.assertEquals((checkpoint.position, checkpoint.done), (4, set([5])))
+        checkpoint.save()
+        checkpoint = Checkpoint(self._path('checkpoint'))
+        self.assertTrue(3 in checkpoint and 5 in checkpoint)
+        self.assertFalse(4 in checkpoint)
+
+    def test_read_identity_numbers(self):
+        lines = ['191212121212\n', '\n', '# comment\n', ' 191212121213 \n']
+        self.assertEquals(list(read_identity_numbers(lines)), [(0, '191212121212'), (1, '191212121213')])
+
+    def test_run_jsonl(self):
+        with open(self._path('output'), 'w') as output:
+            writer = JSONLinesWriter(output, ['name', 'relations'])
+            summary = run(self.navet, enumerate(['1', 'missing', '3']), writer, Checkpoint(), concurrency=2)
+        self.assertEquals((summary['lookups'], summary['errors'], summary['skipped']), (3, 1, 0))
+        lines = sorted((json.loads(line) for line in self._read('output').splitlines()),
+                       key=lambda item: item['identity_number'])
+        self.assertEquals(lines[0]['name'], {'given_name': 'John', 'surname': 'Doe'})
+        self.assertEquals(lines[0]['relations'], [{'identity_number': '199401135679', 'relation_type': 'B'}])
+        self.assertFalse('address' in lines[0])
+        self.assertEquals(lines[2], {'identity_number': 'missing', 'error': 'Not found'})
+
+    def test_run_csv(self):
+        self.navet.get_all_data.side_effect = IOError('connection refused')
+        with open(self._path('output'), 'w') as output:
+            run(self.navet, enumerate(['1']), CSVWriter(output, ['name', 'address']), Checkpoint())
+        header, row = self._read('output').splitlines()
+        self.assertEquals(header, 'identity_number,given_name_marking,given_name,middle_name,surname,address1,'
+                                  'address2,postal_code,city,error')
+        self.assertEquals(row, '1,,,,,,,,,connection refused')
+
+    def test_resume(self):
+        checkpoint = Checkpoint(self._path('checkpoint'))
+        checkpoint.add(0)
+        checkpoint.add(2)
+        with open(self._path('output'), 'w') as output:
+            summary = run(self.navet, enumerate(['1', '2', '3', '4']), JSONLinesWriter(output, ['name']), checkpoint)
+        self.assertEquals((summary['lookups'], summary['skipped']), (2, 2))
+        self.assertEquals(sorted(call[0][0] for call in self.navet.get_all_data.call_args_list), ['2', '4'])
+        self.assertEquals(Checkpoint(self._path('checkpoint')).position, 4)
+
+    def test_resume_retries_transient_errors(self):
+        errors = {'1': TransportError('Service Unavailable', 503), '2': IOError('connection reset'),
+                  '3': CircuitOpenError('open'), '4': WebFault(MagicMock(faultstring='Personen finns inte'), None),
+                  '5': WebFault(MagicMock(faultstring='Service temporarily unavailable'), None)}
+
+        def get_all_data(identity_number):
+            if identity_number in errors:
+                raise errors[identity_number]
+            return None if identity_number == 'missing' else PERSON
+
+        self.navet.get_all_data.side_effect = get_all_data
+        identity_numbers = ['0', '1', '2', '3', '4', '5', 'missing', '7']
+        with open(self._path('output'), 'w') as output:
+            summary = run(self.navet, enumerate(identity_numbers), JSONLinesWriter(output, ['name']),
+                          Checkpoint(self._path('checkpoint')), concurrency=1)
+        self.assertEquals((summary['errors'], summary['retries']), (2, 4))
+        checkpoint = Checkpoint(self._path('checkpoint'))
+        # The position moves past transient failures
+        self.assertEquals((checkpoint.position, checkpoint.done), (8, set()))
+        self.assertEquals(checkpoint.retry, {1: '1', 2: '2', 3: '3', 5: '5'})
+        written = [json.loads(line)['identity_number'] for line in self._read('output').splitlines()]
+        self.assertEquals(written, ['0', '4', 'missing', '7'])
+
+        del errors['1'], errors['5']
+        self.navet.get_all_data.reset_mock()
+        with open(self._path('output'), 'a') as output:
+            summary = run(self.navet, enumerate(identity_numbers), JSONLinesWriter(output, ['name']), checkpoint)
+        self.assertEquals((summary['lookups'], summary['errors'], summary['skipped'], summary['retries']),
+                          (4, 0, 4, 2))
+        self.assertEquals(sorted(call[0][0] for call in self.navet.get_all_data.call_args_list),
+                          ['1', '2', '3', '5'])
+        self.assertEquals(Checkpoint(self._path('checkpoint')).retry, {2: '2', 3: '3'})
+        written = [json.loads(line)['identity_number'] for line in self._read('output').splitlines()]
+        self.assertEquals(sorted(written), ['0', '1', '4', '5', '7', 'missing'])
+
+    def test_retry_without_checkpoint_file(self):
+        self.navet.get_all_data.side_effect = IOError('connection reset')
+        with open(self._path('output'), 'w') as output:
+            summary = run(self.navet, enumerate(['1']), JSONLinesWriter(output, ['name']), Checkpoint())
+        self.assertEquals((summary['errors'], summary['retries']), (1, 0))
+        self.assertEquals(json.loads(self._read('output')), {'identity_number': '1', 'error': 'connection reset'})
+
+    def test_main(self):
+        with open(self._path('input'), 'w') as fd:
+            fd.write('191212121212\n191212121213\n')
+        with patch('pynavet.cli.PostalAddress', return_value=self.navet) as navet_class:
+            status = main(['--cert', 'cert', '--key', 'key', '--order-id', 'order', '--format', 'csv',
+                           '--checkpoint', self._path('checkpoint'), '--output', self._path('output'),
+                           self._path('input')])
+            self.assertEquals(status, 0)
+            self.assertEquals(navet_class.call_args[1]['records'], True)
+            # Nothing left to do when resumed
+            main(['--cert', 'cert', '--key', 'key', '--order-id', 'order', '--format', 'csv',
+                  '--checkpoint', self._path('checkpoint'), '--output', self._path('output'), self._path('input')])
+        with open(self._path('output')) as fd:
+            self.assertEquals(len(fd.read().splitlines()), 3)
+        self.assertEquals(self.navet.get_all_data.call_count, 2)
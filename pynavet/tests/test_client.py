@@ -3,6 +3,7 @@ from pynavet.plugins import SerializablePlugin, MarshallXMLData
 from pynavet.transport import CertAuthTransport
 from suds.cache import ObjectCache, NoCache
 from unittest import TestCase
+import threading
 
 
 class TestNavetClient(TestCase):
@@ -46,3 +47,15 @@ class TestNavetClient(TestCase):
         self.assertTrue(isinstance(navet.client.options.plugins[0], SerializablePlugin))
         self.assertTrue(isinstance(navet.client.options.plugins[1], MarshallXMLData))
         self.assertEquals(len(navet.client.options.plugins), 2)
+
+    def test_client_per_thread(self):
+        navet = NavetClient('wsdl/personpostXML.wsdl', '', '', False)
+        self.assertTrue(navet.get_client() is navet.client)
+        clients = []
+        thread = threading.Thread(target=lambda: clients.extend([navet.get_client(), navet.get_client()]))
+        thread.start()
+        thread.join()
+        self.assertTrue(clients[0] is clients[1])
+        self.assertFalse(clients[0] is navet.client)
+        transport = clients[0].options.transport
+        self.assertTrue(transport.session is navet.client.options.transport.session)
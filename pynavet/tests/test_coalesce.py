@@ -0,0 +1,59 @@
+from pynavet.coalesce import SingleFlight
+from unittest import TestCase
+import threading
+import time
+
+
+class TestSingleFlight(TestCase):
+    def _run(self, single_flight, func, count=5):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self._call(single_flight, func)))
+                   for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    @staticmethod
+    def _call(single_flight, func):
+        try:
+            return single_flight.do('key', func)
+        except BaseException as e:
+            return e
+
+    def test_concurrent_calls_coalesced(self):
+        calls = []
+
+        def func():
+            calls.append(1)
+            time.sleep(0.1)
+            return {'a': 1}
+        single_flight = SingleFlight()
+        results = self._run(single_flight, func)
+        self.assertEquals(len(calls), 1)
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertEquals(single_flight.stats(), {'calls': 1, 'coalesced': 4})
+        # Completed calls are not remembered
+        single_flight.do('key', func)
+        self.assertEquals(len(calls), 2)
+
+    def test_errors_shared(self):
+        def func():
+            time.sleep(0.1)
+            raise IOError('down')
+        results = self._run(SingleFlight(), func, 3)
+        self.assertTrue(all(isinstance(result, IOError) for result in results))
+
+    def test_interrupted_call_shared(self):
+        def func():
+            time.sleep(0.1)
+            raise KeyboardInterrupt()
+        results = self._run(SingleFlight(), func, 3)
+        self.assertTrue(all(isinstance(result, KeyboardInterrupt) for result in results))
+
+    def test_different_keys(self):
+        single_flight = SingleFlight()
+        self.assertEquals(single_flight.do('a', lambda: 1), 1)
+        self.assertEquals(single_flight.do('b', lambda: 2), 2)
+        self.assertEquals(single_flight.stats(), {'calls': 2, 'coalesced': 0})
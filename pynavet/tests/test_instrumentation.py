@@ -0,0 +1,92 @@
+from pynavet.instrumentation import Instrumentation, PrometheusInstrumentation
+from pynavet.postaladdress import PostalAddress
+from unittest import TestCase, skipIf
+from mock import MagicMock
+from suds import WebFault
+import pkg_resources
+import threading
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+
+class RecordingInstrumentation(Instrumentation):
+    def __init__(self):
+        self.timings = {}
+        self.observations = {}
+        self.counts = {}
+
+    def timing(self, name, seconds, tags=None):
+        self.timings.setdefault(name, []).append(seconds)
+
+    def observe(self, name, value, tags=None):
+        self.observations.setdefault(name, []).append(value)
+
+    def count(self, name, value=1, tags=None):
+        key = (name, tuple(sorted(tags.items()))) if tags else name
+        self.counts[key] = self.counts.get(key, 0) + value
+
+
+class TestInstrumentation(TestCase):
+    def setUp(self):
+        data_dir = pkg_resources.resource_filename(__name__, 'data')
+        self.response = open('%s/getdata_response.xml' % data_dir).read()
+        self.instrumentation = RecordingInstrumentation()
+        self.navet = PostalAddress('', '', '', False, instrumentation=self.instrumentation)
+        transport = self.navet.client.options.transport
+        transport.session.post = MagicMock(return_value=MagicMock(status_code=200, headers={}, content=self.response))
+
+    def test_lookup_metrics(self):
+        self.navet.get_all_data('xxxx')
+        for name in ('pynavet.call', 'pynavet.envelope', 'pynavet.http.ttfb', 'pynavet.http.body', 'pynavet.xslt',
+                     'pynavet.dict'):
+            self.assertEquals(len(self.instrumentation.timings[name]), 1, name)
+        self.assertEquals(self.instrumentation.observations['pynavet.http.response_size'], [len(self.response)])
+        self.assertTrue(self.instrumentation.observations['pynavet.http.request_size'][0] > 0)
+        self.assertEquals(self.instrumentation.counts[('pynavet.http.responses', (('status', '200'),))], 1)
+
+    def test_fault_counted(self):
+        self.navet.get_client().service.getData = MagicMock(side_effect=WebFault(MagicMock(faultstring='x'), None))
+        self.assertRaises(WebFault, self.navet.get_all_data, 'xxxx')
+        self.assertEquals(self.instrumentation.counts['pynavet.faults'], 1)
+
+    def test_disabled(self):
+        navet = PostalAddress('', '', '', False)
+        self.assertEquals(navet.instrumentation, None)
+        self.assertEquals(navet.client.options.transport.instrumentation, None)
+
+
+@skipIf(prometheus_client is None, 'prometheus_client is not installed')
+class TestPrometheusInstrumentation(TestCase):
+    def test_metrics(self):
+        registry = prometheus_client.CollectorRegistry()
+        instrumentation = PrometheusInstrumentation(registry=registry)
+        instrumentation.timing('pynavet.call', 0.5)
+        instrumentation.count('pynavet.http.responses', tags={'status': '200'})
+        instrumentation.count('pynavet.http.responses', tags={'status': '200'})
+        instrumentation.observe('pynavet.http.response_size', 1024)
+        with instrumentation.span('pynavet.dict'):
+            pass
+        self.assertEquals(registry.get_sample_value('pynavet_call_seconds_count'), 1)
+        self.assertEquals(registry.get_sample_value('pynavet_call_seconds_sum'), 0.5)
+        self.assertEquals(registry.get_sample_value('pynavet_http_responses_total', {'status': '200'}), 2)
+        self.assertEquals(registry.get_sample_value('pynavet_http_response_size_sum'), 1024)
+        self.assertEquals(registry.get_sample_value('pynavet_dict_seconds_count'), 1)
+
+    def test_concurrent_first_use(self):
+        registry = prometheus_client.CollectorRegistry()
+        instrumentation = PrometheusInstrumentation(registry=registry)
+        start = threading.Event()
+
+        def observe():
+            start.wait()
+            instrumentation.timing('pynavet.call', 0.1)
+        threads = [threading.Thread(target=observe) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+        self.assertEquals(registry.get_sample_value('pynavet_call_seconds_count'), 8)
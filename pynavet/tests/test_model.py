@@ -0,0 +1,48 @@
+from pynavet.model import ModelCache, new_client, build_models, bundled_client
+from unittest import TestCase
+import tempfile
+import threading
+import shutil
+import os
+
+
+class TestModel(TestCase):
+    def test_new_client_shares_model_per_thread(self):
+        first = new_client('wsdl/personpostXML.wsdl')
+        second = new_client('wsdl/personpostXML.wsdl')
+        self.assertTrue(first.wsdl is second.wsdl)
+        self.assertFalse(first.options is second.options)
+        other = []
+        thread = threading.Thread(target=lambda: other.append(new_client('wsdl/personpostXML.wsdl')))
+        thread.start()
+        thread.join()
+        self.assertFalse(other[0].wsdl is first.wsdl)
+
+    def test_new_client_options(self):
+        client = new_client('wsdl/personpostXML.wsdl', location='https://example.com/')
+        self.assertEquals(client.options.location, 'https://example.com/')
+        self.assertTrue(hasattr(client.service, 'getData'))
+
+
+class TestModelCache(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_build_and_load(self):
+        paths = build_models(self.tmpdir)
+        self.assertEquals(len(paths), 2)
+        self.assertTrue(all(os.path.exists(path) for path in paths))
+        cache = ModelCache('wsdl/personpostXML.wsdl', self.tmpdir)
+        client = bundled_client('wsdl/personpostXML.wsdl', cache=cache, cachingpolicy=1)
+        self.assertTrue(hasattr(client.service, 'getData'))
+        self.assertFalse(cache.get('x') is cache.get('x'))
+
+    def test_missing_or_broken_model(self):
+        cache = ModelCache('wsdl/personpostXML.wsdl', self.tmpdir)
+        self.assertEquals(cache.get('x'), None)
+        with open(os.path.join(self.tmpdir, cache.filename), 'wb') as fd:
+            fd.write(b'garbage')
+        self.assertEquals(cache.get('x'), None)
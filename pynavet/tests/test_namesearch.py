@@ -0,0 +1,92 @@
+from pynavet.namesearch import NameSearch, iter_population_items, split_postal_codes, split_birth_dates
+from pynavet.testserver import RESPONSE, FAULT, person_document
+from xml.sax.saxutils import escape
+from unittest import TestCase
+from suds import WebFault
+from mock import MagicMock, patch
+import copy
+
+
+def _reply(identity_numbers):
+    return (RESPONSE % ('namnsokningXML', escape(person_document(identity_numbers, 1)))).encode('utf-8')
+
+
+class TestNameSearch(TestCase):
+    def setUp(self):
+        self.navet = NameSearch('', '', 'order', True)
+
+    def _mock_transport(self, content, status_code=200):
+        post = MagicMock(return_value=MagicMock(status_code=status_code, headers={}, content=content))
+        self.navet.client.options.transport.session.post = post
+        return post
+
+    def test_search(self):
+        post = self._mock_transport(_reply(['191212121212', '191212121213']))
+        results = self.navet.search(given_name='John', city='Town')
+        self.assertFalse(isinstance(results, list))
+        results = list(results)
+        self.assertEquals(len(results), 2)
+        self.assertEquals(results[1]['PersonItem']['PersonId']['NationalIdentityNumber'], '191212121213')
+        self.assertEquals(results[0]['PersonItem']['Name']['GivenName'], 'John')
+        envelope = post.call_args[1]['data'].decode('utf-8')
+        self.assertTrue('<fornamn xsi:type="ns0:string">John</fornamn>' in envelope)
+        self.assertTrue('<bestallningsid xsi:type="ns0:string">order</bestallningsid>' in envelope)
+        self.assertFalse('kon' in envelope)
+
+    def test_prebuilt_envelopes(self):
+        navet = NameSearch('', '', 'order', True, prebuilt_envelopes=True)
+        criteria = [{'given_name': 'John', 'city': 'Town'},
+                    {'surname': u'\xc5str\xf6m <&>', 'sex': 'K', 'birth_date_from': '19800101',
+                     'birth_date_to': '19891231'},
+                    {}]
+        for query in criteria:
+            post = self._mock_transport(_reply(['191212121212']))
+            list(self.navet.search(**query))
+            self.navet, suds_navet = navet, self.navet
+            prebuilt_post = self._mock_transport(_reply(['191212121212']))
+            results = list(self.navet.search(**query))
+            self.navet = suds_navet
+            self.assertEquals(len(results), 1)
+            self.assertEquals(prebuilt_post.call_args, post.call_args)
+
+    def test_search_as_xml(self):
+        self._mock_transport(_reply(['191212121212']))
+        results = list(self.navet.search(surname='Doe', as_xml=True))
+        self.assertTrue(results[0].startswith(b'<PopulationItem>'))
+
+    def test_split_search(self):
+        post = self._mock_transport(_reply(['191212121212']))
+        results = list(self.navet.search(postal_code_from='10000', postal_code_to='19999', split_postal_codes=2,
+                                         birth_date_from='19800101', birth_date_to='19891231', split_birth_dates=3))
+        self.assertEquals(len(results), 6)
+        self.assertEquals(post.call_count, 6)
+
+    def test_fault(self):
+        self._mock_transport((FAULT % u'Felaktig fraga').encode('utf-8'), 500)
+        self.assertRaises(WebFault, list, self.navet.search(city='Town'))
+
+    def test_unknown_criteria(self):
+        self.assertRaises(TypeError, self.navet.search, name='John')
+
+    def test_iter_population_items_frees_records(self):
+        records = []
+
+        def deepcopy(element):
+            records.append(element)
+            return copy.deepcopy(element)
+
+        with patch('pynavet.namesearch.copy', MagicMock(deepcopy=deepcopy)):
+            items = iter_population_items(_reply([str(i) for i in range(100)]))
+            for count, item in enumerate(items, 1):
+                self.assertEquals(len(records), count)
+                # Earlier records are cleared, and removed from the tree once the next one is done
+                self.assertTrue(all(len(record) == 0 for record in records[:-1]))
+                self.assertTrue(all(record.getparent() is None for record in records[:-2]))
+                self.assertTrue(len(records[-1]) > 0)
+        self.assertEquals(len(records), 100)
+
+    def test_split_ranges(self):
+        self.assertEquals(split_postal_codes('01000', '01999', 2), [('01000', '01499'), ('01500', '01999')])
+        self.assertEquals(split_postal_codes('10000', '10001', 5), [('10000', '10000'), ('10001', '10001')])
+        self.assertEquals(split_birth_dates('19800101', '19801231', 2),
+                          [('19800101', '19800701'), ('19800702', '19801231')])
@@ -1,10 +1,17 @@
-from pynavet.plugins import SerializablePlugin, MarshallXMLData
+from pynavet.plugins import SerializablePlugin, MarshallXMLData, get_transform, translate, to_serializable
 from pynavet.client import NavetClient
 from unittest import TestCase
 from mock import MagicMock
 from lxml import etree
+from suds.sudsobject import Factory
+from suds.sax.text import Text
+from decimal import Decimal
+import datetime
+import json
+import sys
 import pkg_resources
 import cPickle
+import threading
 
 
 class TestSerializablePlugin(TestCase):
@@ -29,6 +36,42 @@ class TestSerializablePlugin(TestCase):
         self.assertTrue(cPickle.dumps(context.reply))
 
 
+    def test_to_serializable(self):
+        relation = Factory.object('Relation', {'RelationType': 'M', 'Names': ['Jane', Text('Doe')]})
+        person = Factory.object('Person', {'Relations': [relation, relation], 'Id': ('1', '2'), 'Age': 42})
+        result = to_serializable(person)
+        self.assertEquals(result, {'Relations': [{'RelationType': 'M', 'Names': ['Jane', 'Doe']}] * 2,
+                                   'Id': ['1', '2'], 'Age': 42})
+        self.assertTrue(type(result['Relations'][0]) is dict)
+        self.assertTrue(cPickle.dumps(result))
+
+    def test_to_serializable_deep(self):
+        item = Factory.object('Item', {'Value': 0})
+        for i in range(sys.getrecursionlimit() * 2):
+            item = Factory.object('Item', {'Child': item})
+        result = to_serializable(item)
+        depth = 0
+        while 'Child' in result:
+            result = result['Child']
+            depth += 1
+        self.assertEquals((depth, result), (sys.getrecursionlimit() * 2, {'Value': 0}))
+
+    def test_to_serializable_json_ready(self):
+        item = Factory.object('Item', {'Text': Text(u'\xc5ngel'), 'Date': datetime.date(2020, 1, 2),
+                                       'Amount': Decimal('1.10'), 'Count': 3, 'Missing': None,
+                                       'Map': {'When': datetime.datetime(2020, 1, 2, 3, 4, 5)}})
+        result = to_serializable(item, json_ready=True)
+        self.assertEquals(result, {'Text': u'\xc5ngel', 'Date': '2020-01-02', 'Amount': '1.10', 'Count': 3,
+                                   'Missing': None, 'Map': {'When': '2020-01-02T03:04:05'}})
+        self.assertTrue(type(result['Text']) is type(u''))
+        self.assertEquals(json.loads(json.dumps(result)), result)
+
+    def test_json_ready_plugin(self):
+        context = MagicMock(reply=Factory.object('Item', {'Date': datetime.date(2020, 1, 2)}))
+        SerializablePlugin(json_ready=True).unmarshalled(context)
+        self.assertEquals(context.reply, {'Date': '2020-01-02'})
+
+
 class TestMarshallXMLData(TestCase):
     def test_unmarshalled(self):
         md = MarshallXMLData()
@@ -37,3 +80,27 @@ class TestMarshallXMLData(TestCase):
         md.unmarshalled(context)
         xml = etree.fromstring(context.reply)
         self.assertEquals(xml.tag, 'NavetNotifications')
+
+    def test_transform_hook(self):
+        timings = []
+        md = MarshallXMLData(transform_hook=timings.append)
+        data_dir = pkg_resources.resource_filename(__name__, 'data')
+        context = MagicMock(reply=open('%s/testdata.xml' % data_dir).read())
+        md.unmarshalled(context)
+        self.assertEquals(len(timings), 1)
+        self.assertTrue(timings[0] >= 0)
+
+    def test_translate_bytes_and_text(self):
+        data_dir = pkg_resources.resource_filename(__name__, 'data')
+        data = open('%s/testdata.xml' % data_dir, 'rb').read()
+        from_bytes = etree.tostring(translate(data))
+        self.assertEquals(from_bytes, etree.tostring(translate(data.decode('iso-8859-1'))))
+        self.assertTrue(from_bytes.startswith(b'<NavetNotifications'))
+
+    def test_transform_cached_per_thread(self):
+        self.assertTrue(get_transform() is get_transform())
+        other = []
+        thread = threading.Thread(target=lambda: other.append(get_transform()))
+        thread.start()
+        thread.join()
+        self.assertFalse(other[0] is get_transform())
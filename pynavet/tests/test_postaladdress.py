@@ -1,8 +1,15 @@
 import pkg_resources
 from pynavet.postaladdress import PostalAddress
 from pynavet.plugins import MarshallXMLData
+from pynavet.cache import MemoryCache
+from pynavet.records import Person, Name
+from pynavet.resilience import CircuitBreaker, CircuitOpenError
+from pynavet.testserver import FAULT
+from suds import WebFault
 from unittest import TestCase
-from mock import MagicMock
+from mock import MagicMock, patch
+import requests
+import time
 
 
 class TestPostalAddress(TestCase):
@@ -10,6 +17,11 @@ class TestPostalAddress(TestCase):
         self.navet = PostalAddress('', '', '', True)
         data_dir = pkg_resources.resource_filename(__name__, 'data')
         self.data = open('%s/testdata.xml' % data_dir).read()
+        self.response = open('%s/getdata_response.xml' % data_dir).read()
+
+    def _mock_transport(self):
+        transport = self.navet.client.options.transport
+        transport.session.post = MagicMock(return_value=MagicMock(status_code=200, headers={}, content=self.response))
 
     def test_get_all_data_dict(self):
         self.navet.client.service.getData = MagicMock()
@@ -67,3 +79,152 @@ class TestPostalAddress(TestCase):
         self.navet.client.service.getData.return_value = context.reply
         result = self.navet.get_relations('')
         self.assertEquals(result['Relations']['Relation'][0]['RelationId']['NationalIdentityNumber'], '199401135679')
+
+    def test_get_all_data_through_suds(self):
+        self._mock_transport()
+        result = self.navet.get_all_data('xxxx')
+        person = result['NavetNotifications']['PopulationItems']['PopulationItem']['PersonItem']
+        self.assertEquals(person['Name']['GivenName'], 'John')
+        self.assertEquals(person['PostalAddresses']['OfficialAddress']['City'], 'Town')
+
+    def test_get_all_data_xml_through_suds(self):
+        self._mock_transport()
+        result = self.navet.get_all_data('xxxx', as_xml=True)
+        self.assertTrue(isinstance(result, str))
+        self.assertTrue(result.startswith('<NavetNotifications'))
+
+    def test_result_cache(self):
+        self.navet.result_cache = MemoryCache()
+        self._mock_transport()
+        self.navet.get_name('xxxx')
+        self.navet.get_official_address('xxxx')
+        self.navet.get_relations('xxxx')
+        self.assertEquals(self.navet.client.options.transport.session.post.call_count, 1)
+        self.assertEquals(self.navet.result_cache.stats(), {'hits': 2, 'misses': 1})
+        self.navet.invalidate('xxxx')
+        self.navet.get_name('xxxx')
+        self.assertEquals(self.navet.client.options.transport.session.post.call_count, 2)
+
+    def test_get_name_many(self):
+        self._mock_transport()
+        results = list(self.navet.get_name_many(['1', '2', '3'], max_workers=2))
+        self.assertEquals(sorted(r.identity_number for r in results), ['1', '2', '3'])
+        for r in results:
+            self.assertEquals(r.error, None)
+            self.assertEquals(r.result['Name']['GivenName'], 'John')
+
+    def test_get_all_data_many_errors(self):
+        self._mock_transport()
+        self.navet.client.options.transport.session.post.side_effect = IOError('connection refused')
+        results = list(self.navet.get_all_data_many(['1', '2']))
+        self.assertEquals(len(results), 2)
+        self.assertTrue(all(isinstance(r.error, IOError) for r in results))
+
+    def test_circuit_open_serves_stale(self):
+        self.navet = PostalAddress('', '', '', True, circuit_breaker=CircuitBreaker(failure_threshold=1),
+                                   result_cache=MemoryCache(ttl=-1))
+        self._mock_transport()
+        data = self.navet.get_all_data('xxxx')
+        post = self.navet.client.options.transport.session.post
+        post.side_effect = requests.ConnectionError('down')
+        self.assertRaises(requests.ConnectionError, self.navet.get_all_data, 'xxxx')
+        self.assertEquals(self.navet.get_all_data('xxxx'), data)
+        self.assertEquals(post.call_count, 2)
+        self.assertRaises(CircuitOpenError, self.navet.get_all_data, 'yyyy')
+
+    def test_records(self):
+        self.navet = PostalAddress('', '', '', True, records=True, result_cache=MemoryCache())
+        self._mock_transport()
+        person = self.navet.get_all_data('xxxx')
+        self.assertTrue(isinstance(person, Person))
+        self.assertEquals(person.identity_number, 'xxxxxxxxxx')
+        self.assertEquals(self.navet.get_name('xxxx'), Name(given_name_marking='20', given_name='John',
+                                                            surname='Doe'))
+        self.assertEquals(self.navet.get_official_address('xxxx').city, 'Town')
+        name, address = self.navet.get_name_and_official_address('xxxx')
+        self.assertEquals((name.given_name, address.address2), ('John', 'Example road 10'))
+        relations = self.navet.get_relations('xxxx')
+        self.assertEquals(relations[3].name.given_name, 'Sambalina')
+        self.assertEquals(self.navet.client.options.transport.session.post.call_count, 1)
+
+    def test_helpers_convert_only_used_fields(self):
+        self.navet.result_cache = MemoryCache()
+        self._mock_transport()
+        name = self.navet.get_name('xxxx')
+        document = self.navet.result_cache.get('xxxx')
+        self.assertFalse(document.converted)
+        data = self.navet.get_all_data('xxxx')
+        self.assertTrue(isinstance(data, dict))
+        self.assertEquals(name, self.navet.get_name('xxxx', data))
+        self.assertEquals(self.navet.get_relations('xxxx'), self.navet.get_relations('xxxx', data))
+        self.assertEquals(self.navet.get_name_and_official_address('xxxx'),
+                          self.navet.get_name_and_official_address('xxxx', data))
+        self.assertEquals(self.navet.client.options.transport.session.post.call_count, 1)
+
+    def test_coalesce(self):
+        self.navet = PostalAddress('', '', '', True, coalesce=True)
+        self._mock_transport()
+        post = self.navet.client.options.transport.session.post
+        response = post.return_value
+
+        def slow_post(*args, **kwargs):
+            time.sleep(0.1)
+            return response
+        post.side_effect = slow_post
+        results = list(self.navet.get_name_many(['xxxx'] * 4, max_workers=4))
+        self.assertTrue(all(r.result['Name']['GivenName'] == 'John' for r in results))
+        self.assertEquals(post.call_count, 1)
+        self.assertEquals(self.navet.single_flight.stats(), {'calls': 1, 'coalesced': 3})
+
+    def test_raw_replies(self):
+        self._mock_transport()
+        expected = self.navet.get_all_data('xxxx')
+        expected_xml = self.navet.get_all_data('xxxx', as_xml=True)
+        self.navet = PostalAddress('', '', '', True, raw_replies=True)
+        self._mock_transport()
+        self.assertEquals(self.navet.get_all_data('xxxx'), expected)
+        self.assertEquals(self.navet.get_all_data('xxxx', as_xml=True), expected_xml)
+        self.navet = PostalAddress('', '', '', True, raw_replies=True, records=True)
+        self._mock_transport()
+        self.assertEquals(self.navet.get_name('xxxx').given_name, 'John')
+
+    def test_debug_logs_data(self):
+        self.navet = PostalAddress('', '', '', True, debug=True)
+        self._mock_transport()
+        self.navet.logger = MagicMock()
+        self.navet.get_all_data('xxxx')
+        message = self.navet.logger.debug.call_args_list[0][0][0]
+        self.assertTrue('GivenName' in message)
+        self.assertFalse('LazyDict' in message)
+
+    def test_raw_replies_skip_suds(self):
+        self.navet = PostalAddress('', '', '', True, raw_replies=True)
+        data_dir = pkg_resources.resource_filename(__name__, 'data')
+        self.response = open('%s/getdata_response.xml' % data_dir, 'rb').read()
+        self._mock_transport()
+        with patch('suds.sax.parser.Parser.parse', side_effect=AssertionError('Parsed by suds')):
+            self.assertEquals(self.navet.get_name('xxxx')['Name']['GivenName'], 'John')
+        headers = self.navet.client.options.transport.session.post.call_args[1]['headers']
+        self.assertEquals(headers['Content-Type'], 'text/xml;charset=UTF-8')
+        self.assertTrue('SOAPAction' in headers)
+
+    def test_raw_replies_fault(self):
+        self.navet = PostalAddress('', '', '', True, raw_replies=True)
+        self.response = (FAULT % u'Personen finns inte').encode('utf-8')
+        self._mock_transport()
+        self.navet.client.options.transport.session.post.return_value.status_code = 500
+        self.assertRaises(WebFault, self.navet.get_all_data, 'xxxx')
+
+    def test_prebuilt_envelopes(self):
+        suds_navet = PostalAddress('', '', u'order <&> \xe5\xe4\xf6', True)
+        self.navet = PostalAddress('', '', u'order <&> \xe5\xe4\xf6', True, prebuilt_envelopes=True)
+        self._mock_transport()
+        suds_navet.client.options.transport.session.post = MagicMock(
+            return_value=MagicMock(status_code=200, headers={}, content=self.response))
+        self.assertEquals(self.navet.get_all_data('xxxx'), suds_navet.get_all_data('xxxx'))
+        for identity_number in ('190001010000', u'\u20ac"\'<&>', None):
+            self.navet.get_all_data(identity_number)
+            suds_navet.get_all_data(identity_number)
+            sent = self.navet.client.options.transport.session.post.call_args
+            self.assertEquals(sent, suds_navet.client.options.transport.session.post.call_args)
+            self.assertTrue(isinstance(sent[1]['data'], bytes))
@@ -0,0 +1,126 @@
+from pynavet.processpool import ProcessPool, WorkerCrashedError, RemoteError
+from pynavet.postaladdress import PostalAddress
+from pynavet.records import Name
+from suds.transport import TransportError
+from unittest import TestCase
+from mock import patch
+import threading
+import tempfile
+import shutil
+import time
+import os
+
+
+class Unpicklable(Exception):
+    def __reduce__(self):
+        raise TypeError('Not picklable')
+
+
+def fake_get_name(self, identity_number):
+    # Replaces PostalAddress.get_name, the workers inherit it through fork
+    if identity_number == 'crash':
+        os._exit(3)
+    if identity_number == 'bad':
+        raise ValueError(identity_number)
+    if identity_number == 'unpicklable':
+        raise Unpicklable()
+    if identity_number == 'unavailable':
+        raise TransportError('Service Unavailable', 503)
+    if identity_number == 'slow':
+        time.sleep(0.5)
+    return Name(given_name=identity_number, middle_name=threading.current_thread().name, surname=str(os.getpid()))
+
+
+class TestProcessPool(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cert = os.path.join(self.tmp, 'client.crt')
+        self.key = os.path.join(self.tmp, 'client.key')
+        for path in (self.cert, self.key):
+            with open(path, 'w') as fd:
+                fd.write('')
+        os.chmod(self.key, 0o600)
+        patcher = patch.object(PostalAddress, 'get_name', fake_get_name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pool = ProcessPool(self.cert, self.key, 'order', processes=2, chunksize=3, method='get_name')
+
+    def tearDown(self):
+        self.pool.close()
+        shutil.rmtree(self.tmp)
+
+    def test_imap(self):
+        identity_numbers = [str(i) for i in range(50)]
+        results = list(self.pool.imap(identity_numbers))
+        self.assertEquals(sorted(r.identity_number for r in results), sorted(identity_numbers))
+        self.assertTrue(all(r.result.given_name == r.identity_number and r.error is None for r in results))
+        self.assertEquals(len(set(r.result.surname for r in results)), 2)
+
+    def test_imap_ordered(self):
+        identity_numbers = [str(i) for i in range(50)]
+        results = list(self.pool.imap(identity_numbers, ordered=True))
+        self.assertEquals([r.identity_number for r in results], identity_numbers)
+
+    def test_threads(self):
+        self.pool = ProcessPool(self.cert, self.key, 'order', processes=2, threads=3, method='get_name')
+        results = list(self.pool.imap([str(i) for i in range(20)], ordered=True))
+        self.assertEquals([r.result.given_name for r in results], [str(i) for i in range(20)])
+
+    def test_threads_reused(self):
+        self.pool = ProcessPool(self.cert, self.key, 'order', processes=1, threads=2, chunksize=2, method='get_name')
+        results = list(self.pool.imap([str(i) for i in range(20)]))
+        self.assertEquals(len(results), 20)
+        self.assertTrue(len(set(r.result.middle_name for r in results)) <= 2)
+
+    def test_imap_ordered_window(self):
+        consumed = []
+
+        def identity_numbers():
+            for identity_number in ['slow'] + [str(i) for i in range(300)]:
+                consumed.append(identity_number)
+                yield identity_number
+        results = self.pool.imap(identity_numbers(), ordered=True)
+        self.assertEquals(next(results).identity_number, 'slow')
+        # At most 2 * processes chunks of 3 were read while the first one stalled
+        self.assertTrue(len(consumed) <= 2 * 2 * 3, len(consumed))
+        self.assertEquals(len(list(results)), 300)
+
+    def test_errors(self):
+        results = dict((r.identity_number, r) for r in self.pool.imap(['1', 'bad', 'unpicklable', '2']))
+        self.assertTrue(isinstance(results['bad'].error, ValueError))
+        self.assertTrue(isinstance(results['unpicklable'].error, RemoteError))
+        self.assertEquals(results['2'].result.given_name, '2')
+
+    def test_transport_error(self):
+        # TransportError pickles, but can't be unpickled
+        results = list(self.pool.imap(['1', 'unavailable', '2', '3'], ordered=True))
+        self.assertEquals([r.identity_number for r in results], ['1', 'unavailable', '2', '3'])
+        self.assertTrue(isinstance(results[1].error, RemoteError))
+        self.assertTrue('Service Unavailable' in str(results[1].error))
+        self.assertEquals([r.result.given_name for r in results if r.error is None], ['1', '2', '3'])
+
+    def test_worker_crash(self):
+        identity_numbers = [str(i) for i in range(20)] + ['crash'] + [str(i) for i in range(20, 40)]
+        results = list(self.pool.imap(identity_numbers, ordered=True))
+        self.assertEquals([r.identity_number for r in results], identity_numbers)
+        crashed = [r for r in results if r.error is not None]
+        self.assertTrue(0 < len(crashed) <= 3)
+        self.assertTrue(all(isinstance(r.error, WorkerCrashedError) for r in crashed))
+        self.assertTrue('crash' in [r.identity_number for r in crashed])
+        self.assertEquals(self.pool.crashes, 1)
+        # The pool keeps working with a replacement worker
+        self.assertEquals(len([r for r in self.pool.imap(['a', 'b', 'c', 'd']) if r.error is None]), 4)
+
+    def test_abandoned_imap(self):
+        results = self.pool.imap([str(i) for i in range(50)])
+        next(results)
+        results.close()
+        results = list(self.pool.imap(['x', 'y']))
+        self.assertEquals(sorted(r.identity_number for r in results), ['x', 'y'])
+
+    def test_missing_key(self):
+        self.assertRaises(IOError, ProcessPool, self.cert, os.path.join(self.tmp, 'missing.key'), 'order')
+
+    def test_worker_start_failure(self):
+        self.pool = ProcessPool(self.cert, self.key, 'order', processes=2, url=None, unknown_option=True)
+        self.assertRaises(RemoteError, list, self.pool.imap(['1']))
@@ -0,0 +1,100 @@
+from pynavet.profiling import SamplingProfiler, tracemalloc
+from pynavet.postaladdress import PostalAddress
+from unittest import TestCase, skipIf
+from mock import MagicMock, patch
+import pkg_resources
+import tempfile
+import pstats
+import shutil
+import os
+
+
+def work(size):
+    return [str(i) for i in range(size)]
+
+
+class TestSamplingProfiler(TestCase):
+    def test_not_sampled(self):
+        profiler = SamplingProfiler(rate=0)
+        self.assertEquals(profiler.call(work, 3), ['0', '1', '2'])
+        self.assertEquals(profiler.sampled, 0)
+        self.assertTrue(profiler.report().startswith('Sampled 0 calls'))
+
+    def test_sampled(self):
+        profiler = SamplingProfiler(rate=1)
+        for _ in range(3):
+            self.assertEquals(len(profiler.call(work, 1000)), 1000)
+        self.assertEquals(profiler.sampled, 3)
+        self.assertTrue('work' in profiler.report())
+
+    def test_exception(self):
+        profiler = SamplingProfiler(rate=1)
+        self.assertRaises(TypeError, profiler.call, work, None)
+        self.assertEquals(profiler.sampled, 1)
+        self.assertEquals(profiler.call(work, 1), ['0'])
+
+    def test_nested_call_not_sampled(self):
+        profiler = SamplingProfiler(rate=1)
+        self.assertEquals(profiler.call(profiler.call, work, 1), ['0'])
+        self.assertEquals(profiler.sampled, 1)
+
+    @skipIf(tracemalloc is None, 'tracemalloc not available')
+    def test_memory(self):
+        profiler = SamplingProfiler(rate=1)
+        kept = profiler.call(work, 10000)
+        self.assertTrue(profiler.peak_memory > 0)
+        self.assertTrue('allocations still held' in profiler.report())
+        self.assertFalse(tracemalloc.is_tracing())
+        self.assertEquals(len(kept), 10000)
+
+    def test_dump(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, 'navet.prof')
+            profiler = SamplingProfiler(rate=1)
+            profiler.call(work, 10)
+            profiler.dump(path)
+            self.assertTrue(pstats.Stats(path).total_calls > 0)
+            self.assertRaises(ValueError, profiler.dump)
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_periodic_flush(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, 'navet.prof')
+            profiler = SamplingProfiler(rate=1, interval=0, path=path)
+            with patch('pynavet.profiling.LOG') as log:
+                profiler.call(work, 10)
+            self.assertTrue(os.path.exists(path))
+            self.assertTrue('work' in log.info.call_args[0][1])
+            self.assertEquals(profiler.sampled, 0)
+        finally:
+            shutil.rmtree(tmp)
+
+
+class TestProfiledLookups(TestCase):
+    def setUp(self):
+        data_dir = pkg_resources.resource_filename(__name__, 'data')
+        self.response = open('%s/getdata_response.xml' % data_dir, 'rb').read()
+        self.profiler = SamplingProfiler(rate=1)
+
+    def _navet(self, **kwargs):
+        navet = PostalAddress('', '', '', True, profiler=self.profiler, **kwargs)
+        navet.client.options.transport.session.post = MagicMock(
+            return_value=MagicMock(status_code=200, headers={}, content=self.response))
+        return navet
+
+    def test_get_all_data(self):
+        navet = self._navet()
+        self.assertEquals(navet.get_all_data('xxxx')['NavetNotifications']['PopulationItems']['PopulationItem']
+                          ['PersonItem']['Name']['GivenName'], 'John')
+        self.assertEquals(self.profiler.sampled, 1)
+        report = self.profiler.report()
+        self.assertTrue('_get_all_data' in report)
+        self.assertTrue('translate' in report)
+
+    def test_get_name(self):
+        navet = self._navet(records=True)
+        self.assertEquals(navet.get_name('xxxx').given_name, 'John')
+        self.assertEquals(self.profiler.sampled, 1)
@@ -0,0 +1,44 @@
+from pynavet.records import Person, Name, Relation
+from pynavet.plugins import translate
+from unittest import TestCase
+import pkg_resources
+import json
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+
+class TestRecords(TestCase):
+    def setUp(self):
+        data_dir = pkg_resources.resource_filename(__name__, 'data')
+        with open('%s/testdata.xml' % data_dir) as fd:
+            self.person = Person.from_tree(translate(fd.read().decode('iso-8859-1')))
+
+    def test_fields(self):
+        self.assertEquals(self.person.identity_number, 'xxxxxxxxxx')
+        self.assertEquals(self.person.name.surname, 'Doe')
+        self.assertEquals(self.person.name.middle_name, None)
+        self.assertEquals(self.person.official_address.postal_code, 'YYY YYY')
+        self.assertEquals(len(self.person.relations), 4)
+        relation = self.person.relations[1]
+        self.assertEquals((relation.identity_number, relation.relation_type, relation.deregistration_code,
+                           relation.deregistration_date), ('197902069272', 'B', 'AV', '20060910'))
+        self.assertEquals(self.person.relations[3].birth_time_number, '197502020000')
+
+    def test_to_dict_and_json(self):
+        data = self.person.to_dict()
+        self.assertEquals(data['name'], {'given_name_marking': '20', 'given_name': 'John', 'surname': 'Doe'})
+        self.assertEquals(data['relations'][0]['start_date'], '19970917')
+        self.assertFalse('secrecy_marking' in data)
+        self.assertEquals(json.loads(self.person.to_json()), json.loads(json.dumps(data)))
+
+    def test_pickle(self):
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            self.assertEquals(pickle.loads(pickle.dumps(self.person, protocol)), self.person)
+
+    def test_slots(self):
+        self.assertRaises(AttributeError, setattr, self.person.name, 'nickname', 'Johnny')
+        self.assertRaises(TypeError, Relation, nickname='Johnny')
+        self.assertNotEqual(Name(given_name='John'), Name(given_name='Jane'))
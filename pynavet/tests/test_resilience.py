@@ -0,0 +1,40 @@
+from pynavet.resilience import CircuitBreaker, CircuitOpenError, backoff_delays
+from unittest import TestCase
+
+
+class TestCircuitBreaker(TestCase):
+    def test_opens_after_threshold(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        breaker.before_call()
+        breaker.record_failure()
+        self.assertEquals(breaker.state, CircuitBreaker.CLOSED)
+        breaker.record_failure()
+        self.assertEquals(breaker.state, CircuitBreaker.OPEN)
+        self.assertRaises(CircuitOpenError, breaker.before_call)
+
+    def test_success_resets_failures(self):
+        breaker = CircuitBreaker(failure_threshold=2)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        self.assertEquals(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_half_open_trial(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        self.assertEquals(breaker.state, CircuitBreaker.HALF_OPEN)
+        breaker.before_call()
+        # Only one trial call at a time
+        self.assertRaises(CircuitOpenError, breaker.before_call)
+        breaker.record_failure()
+        breaker.before_call()
+        breaker.record_success()
+        self.assertEquals(breaker.state, CircuitBreaker.CLOSED)
+
+
+class TestBackoff(TestCase):
+    def test_delays(self):
+        delays = list(backoff_delays(5, base=0.1, maximum=0.3))
+        self.assertEquals(len(delays), 5)
+        for delay, limit in zip(delays, [0.1, 0.2, 0.3, 0.3, 0.3]):
+            self.assertTrue(0 <= delay <= limit)
@@ -0,0 +1,125 @@
+from pynavet.sync import Synchronizer, SnapshotStore, normalize, content_hash, diff, ADDED, CHANGED, VANISHED, FAILED
+from pynavet.postaladdress import PostalAddress
+from pynavet.records import Person, Name, OfficialAddress, Relation
+from unittest import TestCase
+from mock import MagicMock
+import tempfile
+import shutil
+import os
+
+
+def person(identity_number, city='Town', surname='Doe', relations=()):
+    return Person(identity_number=identity_number,
+                  name=Name(given_name='John', surname=surname),
+                  official_address=OfficialAddress(address2='Example road 10', postal_code='12345', city=city),
+                  relations=tuple(relations))
+
+
+class TestSynchronizer(TestCase):
+    def setUp(self):
+        self.navet = PostalAddress('', '', '', True, records=True)
+        self.people = {}
+        self.navet.get_all_data = MagicMock(side_effect=self._lookup)
+        self.store = SnapshotStore()
+        self.sync = Synchronizer(self.navet, self.store, max_workers=2)
+
+    def _lookup(self, identity_number):
+        result = self.people.get(identity_number)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def _sync(self, identity_numbers, full=False):
+        return dict((change.identity_number, change) for change in self.sync.sync(identity_numbers, full))
+
+    def test_changes(self):
+        self.people = {'1': person('1'), '2': person('2'), '3': person('3')}
+        changes = self._sync(['1', '2', '3'])
+        self.assertEquals(set(change.kind for change in changes.values()), set([ADDED]))
+        self.assertEquals(len(self.store), 3)
+        self.assertEquals(self._sync(['1', '2', '3']), {})
+
+        self.people['2'] = person('2', city='City')
+        del self.people['3']
+        changes = self._sync(['1', '2', '3'])
+        self.assertEquals(sorted(changes), ['2', '3'])
+        self.assertEquals(changes['2'].kind, CHANGED)
+        self.assertEquals(changes['2'].diff, {'official_address.city': ('Town', 'City')})
+        self.assertEquals(changes['2'].record, self.people['2'])
+        self.assertEquals(changes['3'].kind, VANISHED)
+        self.assertEquals(changes['3'].previous['name']['given_name'], 'John')
+        self.assertEquals(len(self.store), 2)
+        self.assertEquals(self.sync.stats, {'lookups': 9, ADDED: 3, CHANGED: 1, VANISHED: 1, FAILED: 0})
+
+    def test_full_sync_vanished(self):
+        self.people = {'1': person('1'), '2': person('2')}
+        self._sync(['1', '2'])
+        changes = self._sync(['1'], full=True)
+        self.assertEquals(list(changes), ['2'])
+        self.assertEquals(changes['2'].kind, VANISHED)
+        self.assertEquals(list(self.store.identity_numbers()), ['1'])
+
+    def test_failed_lookup_keeps_snapshot(self):
+        self.people = {'1': person('1')}
+        self._sync(['1'])
+        self.people['1'] = IOError('Connection reset')
+        changes = self._sync(['1'], full=True)
+        self.assertEquals(changes['1'].kind, FAILED)
+        self.assertTrue(isinstance(changes['1'].error, IOError))
+        self.assertEquals(len(self.store), 1)
+
+    def test_relations_diff(self):
+        wife = Relation(identity_number='2', relation_type='M', name=Name(given_name='Jane', surname='Doe'))
+        child = Relation(identity_number='3', relation_type='B')
+        self.people = {'1': person('1', relations=[wife, child])}
+        self._sync(['1'])
+        self.people['1'] = person('1', relations=[child, Relation(identity_number='2', relation_type='M',
+                                                                  name=Name(given_name='Jane', surname='Smith'))])
+        changes = self._sync(['1'])
+        self.assertEquals(changes['1'].diff, {'relations[M:2].name.surname': ('Doe', 'Smith')})
+
+    def test_change_recorded_when_consumed(self):
+        self.people = {'1': person('1'), '2': person('2')}
+        changes = self.sync.sync(['1', '2'])
+        next(changes)
+        changes.close()
+        self.assertEquals(len(self.store), 0)
+        self.assertEquals(len(self._sync(['1', '2'])), 2)
+
+    def test_hash_only_store(self):
+        self.sync = Synchronizer(self.navet, SnapshotStore(store_records=False))
+        self.people = {'1': person('1')}
+        self._sync(['1'])
+        self.people['1'] = person('1', surname='Smith')
+        changes = self._sync(['1'])
+        self.assertEquals(changes['1'].kind, CHANGED)
+        self.assertTrue(changes['1'].diff is None)
+
+    def test_persistent_store(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, 'snapshots.sqlite')
+            self.sync = Synchronizer(self.navet, SnapshotStore(path))
+            self.people = {'1': person('1')}
+            self._sync(['1'])
+            self.sync.store.close()
+            self.sync = Synchronizer(self.navet, SnapshotStore(path))
+            self.assertEquals(self._sync(['1']), {})
+            self.sync.store.close()
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_requires_records(self):
+        self.assertRaises(ValueError, Synchronizer, PostalAddress('', '', '', True), self.store)
+
+
+class TestDiff(TestCase):
+    def test_relation_order_ignored(self):
+        first = Relation(identity_number='2', relation_type='M')
+        second = Relation(identity_number='3', relation_type='B')
+        self.assertEquals(content_hash(normalize(person('1', relations=[first, second]))),
+                          content_hash(normalize(person('1', relations=[second, first]))))
+
+    def test_added_fields(self):
+        self.assertEquals(diff({'name': {'surname': 'Doe'}}, {'name': {'surname': 'Doe', 'given_name': 'John'}}),
+                          {'name.given_name': (None, 'John')})
@@ -0,0 +1,79 @@
+from pynavet.testserver import NavetServer
+from pynavet.postaladdress import PostalAddress
+from pynavet.instrumentation import Instrumentation
+from pynavet import benchmark
+from unittest import TestCase, skipIf
+from suds import WebFault
+from suds.transport import TransportError
+import json
+
+try:
+    from shutil import which
+except ImportError:
+    from distutils.spawn import find_executable as which
+
+
+class CountingInstrumentation(Instrumentation):
+    def __init__(self):
+        self.counts = {}
+
+    def count(self, name, value=1, tags=None):
+        self.counts[name] = self.counts.get(name, 0) + value
+
+
+@skipIf(which('openssl') is None, 'openssl is required to generate test certificates')
+class TestNavetServer(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = NavetServer(relations=3)
+        cls.server.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.server.fault_rate = 0.0
+        self.server.error_rate = 0.0
+        self.navet = PostalAddress(self.server.client_cert, self.server.client_key, 'order', False,
+                                   url=self.server.url(), verify=self.server.server_cert)
+
+    def test_get_name_and_relations(self):
+        result = self.navet.get_all_data('191212121212')
+        person = result['NavetNotifications']['PopulationItems']['PopulationItem']['PersonItem']
+        self.assertEquals(person['PersonId']['NationalIdentityNumber'], '191212121212')
+        self.assertEquals(person['Name']['GivenName'], 'John')
+        self.assertEquals(len(person['Relations']['Relation']), 3)
+
+    def test_connections_counted(self):
+        instrumentation = CountingInstrumentation()
+        navet = PostalAddress(self.server.client_cert, self.server.client_key, 'order', False, url=self.server.url(),
+                              verify=self.server.server_cert, instrumentation=instrumentation)
+        navet.get_all_data('191212121212')
+        navet.get_all_data('191212121213')
+        self.assertEquals(instrumentation.counts.get('pynavet.http.connections'), 1)
+
+    def test_fault_injection(self):
+        self.server.fault_rate = 1.0
+        self.assertRaises(WebFault, self.navet.get_all_data, '191212121212')
+
+    def test_error_injection(self):
+        self.server.error_rate = 1.0
+        with self.assertRaises(Exception) as context:
+            self.navet.get_all_data('191212121212')
+        # suds reports HTTP errors other than SOAP faults as a plain Exception((status, reason))
+        self.assertTrue(type(context.exception) is Exception)
+        self.assertEquals(context.exception.args[0][0], 503)
+        navet = PostalAddress(self.server.client_cert, self.server.client_key, 'order', False, url=self.server.url(),
+                              verify=self.server.server_cert, raw_replies=True)
+        with self.assertRaises(TransportError) as context:
+            navet.get_all_data('191212121212')
+        self.assertEquals(context.exception.httpcode, 503)
+
+    def test_benchmark(self):
+        results = benchmark.bench_lookups(self.server, 4, [1, 2], lookups=['get_name'])
+        self.assertEquals([(r['name'], r['concurrency'], r['errors']) for r in results],
+                          [('get_name', 1, 0), ('get_name', 2, 0)])
+        self.assertTrue(results[0]['p99'] >= results[0]['p50'] > 0)
+        self.assertTrue(json.dumps(results))
+        self.assertEquals([r['errors'] for r in benchmark.bench_serializable(2, 1)], [0, 0, 0])
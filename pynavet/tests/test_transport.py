@@ -0,0 +1,108 @@
+from pynavet.transport import CertAuthTransport
+from pynavet.client import NavetClient
+from pynavet.resilience import CircuitBreaker, CircuitOpenError
+from suds.transport import Request, TransportError
+from unittest import TestCase
+from mock import MagicMock
+import requests
+import time
+
+
+class TestCertAuthTransport(TestCase):
+    def _response(self):
+        return MagicMock(status_code=200, headers={}, content='<xml/>')
+
+    def test_session_is_reused(self):
+        transport = CertAuthTransport(cert=('cert', 'key'), timeout=(3, 10))
+        transport.session.post = MagicMock(return_value=self._response())
+        transport.send(Request('https://example.com', 'one'))
+        transport.send(Request('https://example.com', 'two'))
+        self.assertEquals(transport.session.post.call_count, 2)
+        kwargs = transport.session.post.call_args[1]
+        self.assertEquals(kwargs['cert'], ('cert', 'key'))
+        self.assertEquals(kwargs['timeout'], (3, 10))
+        self.assertEquals(kwargs['data'], 'two')
+
+    def test_pool_settings(self):
+        transport = CertAuthTransport(pool_connections=2, pool_maxsize=20, pool_block=True)
+        adapter = transport.session.get_adapter('https://example.com')
+        self.assertEquals(adapter._pool_connections, 2)
+        self.assertEquals(adapter._pool_maxsize, 20)
+        self.assertTrue(adapter._pool_block)
+
+    def test_shared_session(self):
+        session = requests.Session()
+        first = NavetClient('wsdl/personpostXML.wsdl', '', '', False, session=session)
+        second = NavetClient('wsdl/personpostXML.wsdl', '', '', False, session=session)
+        self.assertTrue(first.client.options.transport.session is second.client.options.transport.session)
+
+    def test_no_keep_alive(self):
+        transport = CertAuthTransport(keep_alive=False)
+        transport.session.post = MagicMock(return_value=self._response())
+        transport.send(Request('https://example.com', 'one'))
+        self.assertEquals(transport.session.post.call_args[1]['headers']['Connection'], 'close')
+
+    def test_retries(self):
+        transport = CertAuthTransport(retries=2, backoff=0)
+        transport.session.post = MagicMock(side_effect=[requests.ConnectionError('reset'),
+                                                        MagicMock(status_code=503, headers={}, content=''),
+                                                        self._response()])
+        reply = transport.send(Request('https://example.com', 'one'))
+        self.assertEquals(reply.code, 200)
+        self.assertEquals(transport.session.post.call_count, 3)
+        self.assertEquals(transport.stats['retries'], 2)
+
+    def test_retries_exhausted(self):
+        transport = CertAuthTransport(retries=1, backoff=0)
+        transport.session.post = MagicMock(return_value=MagicMock(status_code=503, headers={}, content=b'busy'))
+        with self.assertRaises(TransportError) as context:
+            transport.send(Request('https://example.com', 'one'))
+        self.assertEquals(context.exception.httpcode, 503)
+        self.assertEquals(context.exception.fp.read(), b'busy')
+        self.assertEquals(transport.session.post.call_count, 2)
+
+    def test_faults_not_retried(self):
+        transport = CertAuthTransport(retries=3, backoff=0)
+        transport.session.post = MagicMock(return_value=MagicMock(status_code=500, headers={}, content='<fault/>'))
+        self.assertEquals(transport.send(Request('https://example.com', 'one')).code, 500)
+        self.assertEquals(transport.session.post.call_count, 1)
+
+    def test_hedging(self):
+        transport = CertAuthTransport(hedge_after=0.01)
+        responses = [0.5, 0]
+
+        def post(*args, **kwargs):
+            time.sleep(responses.pop(0))
+            return self._response()
+        transport.session.post = MagicMock(side_effect=post)
+        start = time.time()
+        transport.send(Request('https://example.com', 'one'))
+        self.assertTrue(time.time() - start < 0.4)
+        self.assertEquals(transport.stats['hedges'], 1)
+
+    def test_circuit_breaker(self):
+        breaker = CircuitBreaker(failure_threshold=2)
+        transport = CertAuthTransport(circuit_breaker=breaker)
+        transport.session.post = MagicMock(side_effect=requests.Timeout('slow'))
+        for i in range(2):
+            self.assertRaises(requests.Timeout, transport.send, Request('https://example.com', 'one'))
+        self.assertRaises(CircuitOpenError, transport.send, Request('https://example.com', 'one'))
+        self.assertEquals(transport.session.post.call_count, 2)
+        self.assertTrue(transport.clone().circuit_breaker is breaker)
+
+    def test_failed_trial_reopens_circuit(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+        transport = CertAuthTransport(circuit_breaker=breaker)
+        transport.session.post = MagicMock(side_effect=requests.Timeout('slow'))
+        self.assertRaises(requests.Timeout, transport.send, Request('https://example.com', 'one'))
+        time.sleep(0.02)
+        # The half-open trial fails with an error that is neither a connection error nor a timeout
+        transport.session.post.side_effect = requests.exceptions.ChunkedEncodingError('truncated')
+        self.assertRaises(requests.exceptions.ChunkedEncodingError, transport.send,
+                          Request('https://example.com', 'one'))
+        self.assertEquals(breaker.state, CircuitBreaker.OPEN)
+        time.sleep(0.02)
+        transport.session.post.side_effect = None
+        transport.session.post.return_value = self._response()
+        self.assertEquals(transport.send(Request('https://example.com', 'one')).code, 200)
+        self.assertEquals(breaker.state, CircuitBreaker.CLOSED)
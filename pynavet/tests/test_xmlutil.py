@@ -0,0 +1,78 @@
+from pynavet.xmlutil import etree_to_dict, LazyDict
+from pynavet.plugins import get_transform, translate
+from unittest import TestCase
+from lxml import etree
+from xmltodict import parse as xmltodict
+import pkg_resources
+import threading
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+
+class TestEtreeToDict(TestCase):
+    def test_same_as_xmltodict(self):
+        data_dir = pkg_resources.resource_filename(__name__, 'data')
+        xml = etree.fromstring(open('%s/testdata.xml' % data_dir).read())
+        tree = get_transform()(xml)
+        self.assertEquals(etree_to_dict(tree), xmltodict(etree.tostring(tree)))
+
+    def test_attributes_text_and_lists(self):
+        xml = '<a xmlns:x="urn:x" x:b="1">hi<!-- comment --> <c>1</c>there<c/><d e="2"/></a>'
+        self.assertEquals(etree_to_dict(etree.fromstring(xml)), xmltodict(xml))
+
+    def test_empty_element(self):
+        self.assertEquals(etree_to_dict(etree.fromstring('<a/>')), {'a': None})
+
+
+class TestLazyDict(TestCase):
+    def setUp(self):
+        data_dir = pkg_resources.resource_filename(__name__, 'data')
+        with open('%s/testdata.xml' % data_dir) as fd:
+            self.tree = translate(fd.read().decode('iso-8859-1'))
+        self.expected = etree_to_dict(self.tree)['NavetNotifications']
+
+    def test_fields_converted_on_access(self):
+        lazy = LazyDict(self.tree.getroot())
+        person = lazy.find('PopulationItems/PopulationItem/PersonItem')
+        expected = self.expected['PopulationItems']['PopulationItem']['PersonItem']
+        self.assertEquals(person['Name'], expected['Name'])
+        self.assertEquals(person['Relations'], expected['Relations'])
+        self.assertRaises(KeyError, person.__getitem__, 'Missing')
+        self.assertFalse(person.converted)
+        self.assertFalse(lazy.converted)
+        self.assertEquals(dict(person), dict(expected))
+        self.assertTrue(person.converted)
+
+    def test_to_dict(self):
+        lazy = LazyDict(self.tree.getroot())
+        self.assertEquals(lazy.name, 'NavetNotifications')
+        self.assertEquals(lazy['@xmlns:xsi'], self.expected['@xmlns:xsi'])
+        self.assertEquals(lazy.to_dict(), self.expected)
+        self.assertEquals(lazy, self.expected)
+
+    def test_shared_between_threads(self):
+        person = LazyDict(self.tree.getroot()).find('PopulationItems/PopulationItem/PersonItem')
+        start = threading.Event()
+        seen = []
+
+        def read():
+            start.wait()
+            seen.append((person['Name'], person['Relations'], person.to_dict()['Name']))
+        threads = [threading.Thread(target=read) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+        self.assertEquals(len(seen), 8)
+        for name, relations, converted in seen:
+            self.assertEquals(name, converted)
+            self.assertEquals(relations, self.expected['PopulationItems']['PopulationItem']['PersonItem']['Relations'])
+        self.assertTrue(all(converted is seen[0][2] for _, _, converted in seen))
+
+    def test_pickle(self):
+        lazy = pickle.loads(pickle.dumps(LazyDict(self.tree.getroot()), pickle.HIGHEST_PROTOCOL))
+        self.assertEquals(lazy.to_dict(), self.expected)
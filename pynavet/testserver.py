@@ -0,0 +1,294 @@
+"""
+This module provides a local HTTPS stand-in for the NAVET personpostXML and namnsokningXML services, for offline tests
+and benchmarks.
+
+    server = NavetServer(latency=0.01, relations=4, fault_rate=0.01)
+    server.start()
+    navet = PostalAddress(server.client_cert, server.client_key, 'order', url=server.url('personpostXML'),
+                          verify=server.server_cert)
+    ...
+    server.stop()
+
+Certificates for the server and the client are generated with the openssl command line tool.
+"""
+from xml.sax.saxutils import escape
+from logging import getLogger
+from lxml import etree
+import subprocess
+import threading
+import tempfile
+import random
+import shutil
+import time
+import ssl
+import os
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+
+LOG = getLogger(__name__)
+
+PERSON = u'''<Folkbokforingspost>
+  <Arendeuppgift andringstidpunkt="20030203000002"/>
+  <Personpost>
+    <PersonId>
+      <PersonNr>%(identity_number)s</PersonNr>
+    </PersonId>
+    <Namn>
+      <Tilltalsnamnsmarkering>20</Tilltalsnamnsmarkering>
+      <Fornamn>%(given_name)s</Fornamn>
+      <Efternamn>%(surname)s</Efternamn>
+    </Namn>
+    <Adresser>
+      <Folkbokforingsadress>
+        <Utdelningsadress2>%(street)s</Utdelningsadress2>
+        <PostNr>%(postal_code)s</PostNr>
+        <Postort>%(city)s</Postort>
+      </Folkbokforingsadress>
+      <Riksnycklar>
+        <FastighetsId>yyyy</FastighetsId>
+        <AdressplatsId>zzzz</AdressplatsId>
+        <LagenhetsId>xxxx</LagenhetsId>
+      </Riksnycklar>
+    </Adresser>
+    <Relationer>%(relations)s
+    </Relationer>
+  </Personpost>
+</Folkbokforingspost>'''
+
+RELATION = u'''
+      <Relation>
+        <RelationId>
+          <PersonNr>%s</PersonNr>
+        </RelationId>
+        <Relationstyp>B</Relationstyp>
+        <RelationFromdatum>19970917</RelationFromdatum>
+      </Relation>'''
+
+DOCUMENT = u'''<?xml version="1.0" encoding="ISO-8859-1"?>
+<Navetavisering xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+ xsi:noNamespaceSchemaLocation="http://xmls.skatteverket.se/se/skatteverket/folkbokforing/na/avisering/V1/Navetavisering.xsd">
+<Folkbokforingsposter>
+%s
+</Folkbokforingsposter>
+</Navetavisering>
+'''
+
+RESPONSE = u'''<?xml version="1.0" encoding="UTF-8"?>
+<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
+<soapenv:Body>
+<ns1:getDataResponse soapenv:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/" xmlns:ns1="https://www2.skatteverket.se/na/na_epersondata/services/%s">
+<getDataReturn xsi:type="soapenc:string" xmlns:soapenc="http://schemas.xmlsoap.org/soap/encoding/">%s</getDataReturn>
+</ns1:getDataResponse>
+</soapenv:Body>
+</soapenv:Envelope>
+'''
+
+FAULT = u'''<?xml version="1.0" encoding="UTF-8"?>
+<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/">
+<soapenv:Body>
+<soapenv:Fault>
+<faultcode>soapenv:Server</faultcode>
+<faultstring>%s</faultstring>
+</soapenv:Fault>
+</soapenv:Body>
+</soapenv:Envelope>
+'''
+
+
+def person_document(identity_numbers, relations=2):
+    """
+    Render a Navetavisering document with one made up person per identity number.
+
+    @param identity_numbers: National identity numbers
+    @type identity_numbers: list
+    @param relations: (optional) Number of relations per person, controls the payload size
+    @type relations: int
+    @rtype: unicode
+    """
+    people = []
+    for number, identity_number in enumerate(identity_numbers):
+        people.append(PERSON % {
+            'identity_number': escape(identity_number),
+            'given_name': u'John',
+            'surname': u'Doe%d' % number,
+            'street': u'Example road %d' % (number % 100),
+            'postal_code': u'%05d' % (10000 + number % 90000),
+            'city': u'Town',
+            'relations': u''.join(RELATION % ('19%010d' % i) for i in range(relations)),
+        })
+    return DOCUMENT % u'\n'.join(people)
+
+
+def generate_certificates(directory):
+    """
+    Generate self-signed server (for 'localhost') and client certificates with openssl.
+
+    @param directory: Directory to write the PEM files to
+    @type directory: str
+    @return: Paths to server cert, server key, client cert and client key
+    @rtype: tuple
+    """
+    paths = []
+    with open(os.devnull, 'w') as devnull:
+        for name, subject in (('server', '/CN=localhost'), ('client', '/CN=pynavet-client')):
+            cert = os.path.join(directory, '%s.crt' % name)
+            key = os.path.join(directory, '%s.key' % name)
+            subprocess.check_call(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '2',
+                                   '-subj', subject, '-addext', 'subjectAltName=DNS:localhost,IP:127.0.0.1',
+                                   '-keyout', key, '-out', cert],
+                                  stdout=devnull, stderr=subprocess.STDOUT)
+            paths.extend([cert, key])
+    return tuple(paths)
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def handle_error(self, request, client_address):
+        # Clients dropping kept-alive connections are expected, don't print tracebacks for them
+        LOG.debug("Error handling request from %s", client_address, exc_info=True)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send each response in one write, small writes and Nagle's algorithm add 40 ms delayed ACK stalls
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        LOG.debug(format, *args)
+
+    def do_POST(self):
+        navet = self.server.navet
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        status, response = navet.respond(self.path, body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/xml; charset=utf-8')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+        self.wfile.flush()
+
+
+class NavetServer(object):
+    """
+    Local HTTPS server answering getData requests for /personpostXML and /namnsokningXML with made up people.
+    """
+    def __init__(self, latency=0.0, jitter=0.0, relations=2, search_results=10, fault_rate=0.0,
+                 error_rate=0.0, require_client_cert=True, port=0):
+        """
+        @param latency: (optional) Seconds to wait before answering
+        @type latency: float
+        @param jitter: (optional) Max random seconds added to the latency
+        @type jitter: float
+        @param relations: (optional) Number of relations per person, controls the payload size
+        @type relations: int
+        @param search_results: (optional) Number of people returned by namnsokningXML
+        @type search_results: int
+        @param fault_rate: (optional) Fraction of requests answered with a SOAP fault
+        @type fault_rate: float
+        @param error_rate: (optional) Fraction of requests answered with HTTP 503
+        @type error_rate: float
+        @param require_client_cert: (optional) Require the generated client certificate, default True
+        @type require_client_cert: bool
+        @param port: (optional) Port to listen on, default any free port
+        @type port: int
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.relations = relations
+        self.search_results = search_results
+        self.fault_rate = fault_rate
+        self.error_rate = error_rate
+        self.require_client_cert = require_client_cert
+        self.port = port
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._random = random.Random(0)
+        self._directory = None
+        self._server = None
+        self._thread = None
+
+    def url(self, service='personpostXML'):
+        """
+        @param service: (optional) 'personpostXML' or 'namnsokningXML'
+        @type service: str
+        @return: Service URL endpoint
+        @rtype: str
+        """
+        return 'https://localhost:%d/%s' % (self.port, service)
+
+    def start(self):
+        """
+        Generate certificates and start serving in a background thread.
+        """
+        self._directory = tempfile.mkdtemp(prefix='pynavet-server-')
+        self.server_cert, self.server_key, self.client_cert, self.client_key = generate_certificates(self._directory)
+        context = ssl.SSLContext(getattr(ssl, 'PROTOCOL_TLS_SERVER', ssl.PROTOCOL_SSLv23))
+        context.load_cert_chain(self.server_cert, self.server_key)
+        if self.require_client_cert:
+            context.verify_mode = ssl.CERT_REQUIRED
+            context.load_verify_locations(self.client_cert)
+        self._server = _Server(('127.0.0.1', self.port), _Handler)
+        self._server.navet = self
+        self._server.socket = context.wrap_socket(self._server.socket, server_side=True)
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop serving and remove the generated certificates.
+        """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self._directory is not None:
+            shutil.rmtree(self._directory)
+            self._directory = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def respond(self, path, body):
+        """
+        Build the response to a getData request.
+
+        @return: HTTP status and response body
+        @rtype: tuple (int, bytes)
+        """
+        with self._lock:
+            self.requests += 1
+            roll = self._random.random()
+            delay = self.latency + self._random.random() * self.jitter
+        if delay:
+            time.sleep(delay)
+        if roll < self.error_rate:
+            return 503, b'Service Unavailable'
+        if roll < self.error_rate + self.fault_rate:
+            return 500, (FAULT % u'Injected fault').encode('utf-8')
+        # The service namespaces in the WSDL end with a space, which lxml only accepts in recover mode
+        request = etree.fromstring(body, etree.XMLParser(recover=True))
+        if request is None:
+            return 500, (FAULT % u'Malformed request').encode('utf-8')
+        arguments = dict((element.tag, element.text or u'') for element in request.iter()
+                         if not len(element) and isinstance(element.tag, str) and '}' not in element.tag)
+        service = path.strip('/').split('/')[-1]
+        if service == 'namnsokningXML':
+            identity_numbers = [u'19%010d' % i for i in range(self.search_results)]
+        else:
+            identity_numbers = [arguments.get('personid', u'')]
+        document = person_document(identity_numbers, self.relations)
+        return 200, (RESPONSE % (service, escape(document))).encode('utf-8')
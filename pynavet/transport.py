@@ -2,28 +2,255 @@
 This module provides a certificate client auth transport plugin for suds.
 """
 import requests
+from requests.adapters import HTTPAdapter
 from suds.transport.http import HttpAuthenticated
-from suds.transport import Reply
+from suds.transport import Reply, TransportError
+from pynavet.resilience import backoff_delays
+from io import BytesIO
+import threading
+import time
+
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    from queue import Queue, Empty
+
+# Guards the stats shared by a transport and its clones in all threads
+_stats_lock = threading.Lock()
 
 
 class CertAuthTransport(HttpAuthenticated):
     """
     This class provides certificate client auth transport for suds.
+
+    All requests are sent through a persistent requests.Session with a pooled HTTPAdapter, so the TCP connection and
+    the client certificate TLS handshake are reused between calls (keep-alive). The connection pool is thread-safe and
+    a session can be shared between several transports by passing it in with the 'session' keyword.
+
+    Requests failing with connection errors, timeouts or a status in 'retry_statuses' can be retried with exponential
+    backoff and jitter, and slow requests can be hedged with a second identical request. getData is an idempotent
+    lookup so both are safe. SOAP faults (HTTP 500) are answers and never retried.
     """
     def __init__(self, **kwargs):
+        """
+        @param cert: (optional) Path to certificate file and key file
+        @type cert: tuple (cert, key)
+        @param verify: (optional) Whether to verify SSL endpoint certificate or not, default True
+        @type verify: bool
+        @param timeout: (optional) Connect and read timeout in seconds, either a single value or a tuple
+        (connect, read), default None (wait forever)
+        @type timeout: float | tuple
+        @param pool_connections: (optional) Number of per-host connection pools to cache, default 10
+        @type pool_connections: int
+        @param pool_maxsize: (optional) Max number of kept-alive connections per host, default 10
+        @type pool_maxsize: int
+        @param pool_block: (optional) Block when the pool is exhausted instead of opening extra connections,
+        default False
+        @type pool_block: bool
+        @param keep_alive: (optional) Reuse connections between requests, default True
+        @type keep_alive: bool
+        @param session: (optional) Existing session to share, the pool settings above are then ignored
+        @type session: requests.Session
+        @param instrumentation: (optional) Receiver of HTTP timings and sizes
+        @type instrumentation: pynavet.instrumentation.Instrumentation
+        @param retries: (optional) Number of retries of failed requests, default 0
+        @type retries: int
+        @param backoff: (optional) Max delay in seconds before the first retry, doubled for every retry, default 0.1
+        @type backoff: float
+        @param backoff_max: (optional) Max delay in seconds between retries, default 5
+        @type backoff_max: float
+        @param retry_statuses: (optional) HTTP statuses to retry, default (502, 503, 504)
+        @type retry_statuses: tuple
+        @param hedge_after: (optional) Seconds to wait for a response before sending a second identical request,
+        default None (no hedging)
+        @type hedge_after: float
+        @param circuit_breaker: (optional) Circuit breaker guarding the endpoint, see pynavet.resilience
+        @type circuit_breaker: pynavet.resilience.CircuitBreaker
+        """
         self.cert = kwargs.pop('cert', None)
         self.verify = kwargs.pop('verify', True)
+        self.timeout = kwargs.pop('timeout', None)
+        pool_connections = kwargs.pop('pool_connections', 10)
+        pool_maxsize = kwargs.pop('pool_maxsize', 10)
+        pool_block = kwargs.pop('pool_block', False)
+        self.keep_alive = kwargs.pop('keep_alive', True)
+        session = kwargs.pop('session', None)
+        self.instrumentation = kwargs.pop('instrumentation', None)
+        self.retries = kwargs.pop('retries', 0)
+        self.backoff = kwargs.pop('backoff', 0.1)
+        self.backoff_max = kwargs.pop('backoff_max', 5.0)
+        self.retry_statuses = tuple(kwargs.pop('retry_statuses', (502, 503, 504)))
+        self.hedge_after = kwargs.pop('hedge_after', None)
+        self.circuit_breaker = kwargs.pop('circuit_breaker', None)
+        # Shared with clones, so the numbers cover all threads
+        self.stats = kwargs.pop('stats', None) or {'retries': 0, 'hedges': 0}
         # Can't pass this one on to HttpAuthenticated. Crashes on unknown attributes.
         kwargs.pop('debug', False)
+        self._kwargs = kwargs
         HttpAuthenticated.__init__(self, **kwargs)
 
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=pool_block)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+        self.session = session
+
     def send(self, request):
         self.addcredentials(request)
-        response = requests.post(request.url,
-                                 data=request.message,
-                                 headers=request.headers,
-                                 cert=self.cert,
-                                 verify=self.verify)
-        result = Reply(response.status_code, response.headers, response.content)
+        headers = dict(request.headers)
+        if not self.keep_alive:
+            headers['Connection'] = 'close'
+        breaker = self.circuit_breaker
+        if breaker is not None:
+            breaker.before_call()
+        try:
+            status, response_headers, content = self._send_with_retries(request, headers)
+        except Exception:
+            # Any failure, so a failed half-open trial call always reopens the circuit
+            if breaker is not None:
+                breaker.record_failure()
+            raise
+        if status in self.retry_statuses:
+            if breaker is not None:
+                breaker.record_failure()
+            # suds reads the reply from fp
+            raise TransportError(content, status, BytesIO(content))
+        if breaker is not None:
+            breaker.record_success()
+        result = Reply(status, response_headers, content)
 
         return result
+
+    def _send_with_retries(self, request, headers):
+        delays = backoff_delays(self.retries, self.backoff, self.backoff_max)
+        while True:
+            error = None
+            try:
+                result = self._send_hedged(request, headers)
+                if result[0] not in self.retry_statuses:
+                    return result
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            delay = next(delays, None)
+            if delay is None:
+                if error is not None:
+                    raise error
+                return result
+            self._count('retries')
+            time.sleep(delay)
+
+    def _send_hedged(self, request, headers):
+        if self.hedge_after is None:
+            return self._post(request, headers)
+        results = Queue()
+
+        def attempt():
+            try:
+                results.put((True, self._post(request, headers)))
+            except Exception as e:
+                results.put((False, e))
+
+        pending = 1
+        self._start(attempt)
+        try:
+            ok, value = results.get(timeout=self.hedge_after)
+        except Empty:
+            pending = 2
+            self._count('hedges')
+            self._start(attempt)
+            ok, value = results.get()
+        # The first successful response wins, fail only when both requests failed
+        if not ok and pending == 2:
+            ok, value = results.get()
+        if ok:
+            return value
+        raise value
+
+    def _count(self, stat):
+        """
+        Count a retry or hedge in the stats and the instrumentation.
+        """
+        with _stats_lock:
+            self.stats[stat] += 1
+        if self.instrumentation is not None:
+            self.instrumentation.count('pynavet.http.' + stat)
+
+    @staticmethod
+    def _start(target):
+        thread = threading.Thread(target=target)
+        thread.daemon = True
+        thread.start()
+
+    def _post(self, request, headers):
+        """
+        @return: HTTP status, headers and body
+        @rtype: tuple
+        """
+        if self.instrumentation is not None:
+            return self._post_instrumented(request, headers)
+        response = self.session.post(request.url,
+                                     data=request.message,
+                                     headers=headers,
+                                     cert=self.cert,
+                                     verify=self.verify,
+                                     timeout=self.timeout)
+        return response.status_code, response.headers, response.content
+
+    def _post_instrumented(self, request, headers):
+        instrumentation = self.instrumentation
+        pool = self._connection_pool(request.url)
+        connections = pool.num_connections
+        start = time.time()
+        response = self.session.post(request.url,
+                                     data=request.message,
+                                     headers=headers,
+                                     cert=self.cert,
+                                     verify=self.verify,
+                                     timeout=self.timeout,
+                                     stream=True)
+        ttfb = time.time()
+        content = response.content
+        end = time.time()
+        instrumentation.timing('pynavet.http.ttfb', ttfb - start)
+        instrumentation.timing('pynavet.http.body', end - ttfb)
+        if pool.num_connections > connections:
+            instrumentation.count('pynavet.http.connections', pool.num_connections - connections)
+        instrumentation.count('pynavet.http.responses', tags={'status': str(response.status_code)})
+        instrumentation.observe('pynavet.http.request_size', len(request.message))
+        instrumentation.observe('pynavet.http.response_size', len(content))
+        return response.status_code, response.headers, content
+
+    def _connection_pool(self, url):
+        """
+        Get the urllib3 connection pool that requests sends requests to url through.
+        """
+        adapter = self.session.get_adapter(url)
+        if not hasattr(adapter, 'build_connection_pool_key_attributes'):
+            return adapter.poolmanager.connection_from_url(url)
+        # requests 2.32+ keeps a pool per TLS setting, ie client certificate and verification
+        settings = self.session.merge_environment_settings(url, {}, None, self.verify, self.cert)
+        prepared = requests.PreparedRequest()
+        prepared.prepare_url(url, None)
+        host_params, pool_kwargs = adapter.build_connection_pool_key_attributes(prepared, settings['verify'],
+                                                                                settings['cert'])
+        return adapter.poolmanager.connection_from_host(pool_kwargs=pool_kwargs, **host_params)
+
+    def clone(self):
+        """
+        Get a new transport with the same settings sharing this transport's session and connection pool, circuit
+        breaker and stats. A suds transport can only be used by one suds client.
+
+        @rtype: CertAuthTransport
+        """
+        return CertAuthTransport(cert=self.cert, verify=self.verify, timeout=self.timeout, keep_alive=self.keep_alive,
+                                 session=self.session, instrumentation=self.instrumentation, retries=self.retries,
+                                 backoff=self.backoff, backoff_max=self.backoff_max,
+                                 retry_statuses=self.retry_statuses, hedge_after=self.hedge_after,
+                                 circuit_breaker=self.circuit_breaker, stats=self.stats, **self._kwargs)
+
+    def close(self):
+        """
+        Close all pooled connections.
+        """
+        self.session.close()
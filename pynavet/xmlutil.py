@@ -0,0 +1,179 @@
+"""
+This module provides helpers for turning lxml trees into python dicts without serializing them back to XML.
+"""
+from collections import OrderedDict
+from lxml import etree
+import threading
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+text_type = type(u'')
+
+
+def _qualified_name(name, nsmap):
+    """
+    Turn an lxml '{namespace}local' name into the 'prefix:local' form found in the document.
+    """
+    if name[0] != '{':
+        return text_type(name)
+    namespace, local = name[1:].split('}', 1)
+    for prefix, uri in nsmap.items():
+        if uri == namespace and prefix is not None:
+            return u'%s:%s' % (prefix, local)
+    return text_type(local)
+
+
+def etree_to_dict(element, dict_constructor=OrderedDict):
+    """
+    Convert an lxml element (or element tree) into the same structure xmltodict.parse would produce from its
+    serialized form, ie. attributes as '@name', text as '#text' and repeated child elements as lists.
+
+    @param element: Element or ElementTree to convert
+    @type element: lxml.etree._Element | lxml.etree._ElementTree
+    @param dict_constructor: (optional) Mapping type to build, default OrderedDict
+    @type dict_constructor: type
+    @return: Converted data, keyed on the root tag
+    @rtype: OrderedDict
+    """
+    if hasattr(element, 'getroot'):
+        element = element.getroot()
+    value = _convert(element, {}, dict_constructor)
+    return dict_constructor([(_qualified_name(element.tag, element.nsmap), value)])
+
+
+def _convert(element, parent_nsmap, dict_constructor):
+    nsmap = element.nsmap
+    item = None
+    for prefix, uri in nsmap.items():
+        if parent_nsmap.get(prefix) != uri:
+            if item is None:
+                item = dict_constructor()
+            item[u'@xmlns:%s' % prefix if prefix else u'@xmlns'] = text_type(uri)
+    for key, val in element.attrib.items():
+        if item is None:
+            item = dict_constructor()
+        item[u'@' + _qualified_name(key, nsmap)] = text_type(val)
+
+    data = [element.text] if element.text else []
+    for child in element:
+        if child.tail:
+            data.append(child.tail)
+        if not isinstance(child.tag, (str, text_type)):  # Comments and processing instructions
+            continue
+        if item is None:
+            item = dict_constructor()
+        key = _qualified_name(child.tag, child.nsmap)
+        value = _convert(child, nsmap, dict_constructor)
+        if key in item:
+            existing = item[key]
+            if isinstance(existing, list):
+                existing.append(value)
+            else:
+                item[key] = [existing, value]
+        else:
+            item[key] = value
+
+    text = (u''.join(data).strip() or None) if data else None
+    if item is None:
+        return text_type(text) if text is not None else None
+    if text is not None:
+        item[u'#text'] = text_type(text)
+    return item
+
+
+
+class LazyDict(Mapping):
+    """
+    Read-only mapping with the contents etree_to_dict would produce for an element, converted on first access one
+    child element name at a time. Looking up a few fields of a large tree only converts those subtrees, the rest is
+    converted when the mapping is iterated or to_dict() is called.
+
+    Safe to share between threads, ie through a result cache: conversions are made under a lock, so every reader gets
+    the same converted objects. Pickles as the serialized element.
+    """
+    def __init__(self, element):
+        """
+        @param element: Element to convert
+        @type element: lxml.etree._Element
+        """
+        self.element = element
+        self.name = _qualified_name(element.tag, element.nsmap)
+        self._items = {}
+        self._data = None
+        self._lock = threading.Lock()
+
+    @property
+    def converted(self):
+        """
+        Whether the whole element has been converted.
+        """
+        return self._data is not None
+
+    def __getitem__(self, key):
+        data = self._data
+        if data is not None:
+            return data[key]
+        try:
+            return self._items[key]
+        except KeyError:
+            pass
+        if key[:1] in (u'@', u'#') or u':' in key:
+            return self.to_dict()[key]
+        with self._lock:
+            if self._data is not None:
+                return self._data[key]
+            if key in self._items:
+                return self._items[key]
+            nsmap = self.element.nsmap
+            values = [_convert(child, nsmap, OrderedDict) for child in self.element.iterchildren(key)]
+            if not values:
+                raise KeyError(key)
+            value = self._items[key] = values[0] if len(values) == 1 else values
+        return value
+
+    def __iter__(self):
+        return iter(self.to_dict())
+
+    def __len__(self):
+        return len(self.to_dict())
+
+    def __repr__(self):
+        return '<LazyDict %s>' % self.name
+
+    def __reduce__(self):
+        return _lazy_from_xml, (etree.tostring(self.element),)
+
+    def find(self, path):
+        """
+        Get a LazyDict for the first matching descendant without converting anything.
+
+        @param path: ElementPath expression relative to the element, ie 'PopulationItems/PopulationItem'
+        @type path: str
+        @rtype: LazyDict | None
+        """
+        element = self.element.find(path)
+        if element is None:
+            return None
+        return LazyDict(element)
+
+    def to_dict(self):
+        """
+        @return: The fully converted element, same as etree_to_dict(element)[name]
+        @rtype: OrderedDict
+        """
+        data = self._data
+        if data is None:
+            with self._lock:
+                if self._data is None:
+                    parent = self.element.getparent()
+                    self._data = _convert(self.element, parent.nsmap if parent is not None else {}, OrderedDict)
+                    self._items = {}
+                data = self._data
+        return data
+
+
+def _lazy_from_xml(xml):
+    return LazyDict(etree.fromstring(xml))
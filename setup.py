@@ -19,6 +19,11 @@ testing_extras = [
     'coverage==3.6',
     'mock==1.0.1',
     'suds>=0.4.1',
+    'prometheus_client',
+]
+
+aio_extras = [
+    'aiohttp >= 3.0',
 ]
 
 setup(
@@ -39,5 +44,11 @@ setup(
     install_requires=install_requires,
     extras_require={
         'testing': testing_extras,
+        'aio': aio_extras,
+    },
+    entry_points={
+        'console_scripts': [
+            'pynavet = pynavet.cli:main',
+        ],
     }
 )